@@ -0,0 +1,166 @@
+# acumuladores incrementales para los rangos de las fórmulas
+#
+# los pies de sección suelen resumir el cuerpo de la sección con fórmulas como =sum(<col><startrow>:<col><row:-1>)
+# en lugar de recorrer el rango al evaluar el pie, cada sección acumula por columna los valores de las filas
+# del cuerpo según se guardan: número de valores, suma, mínimo, máximo y un resumen para calcular la mediana
+#
+# la mediana se calcula con un resumen de cuantiles mergeable (al estilo de KLL): mientras no se supera su
+# capacidad guarda todos los valores y la mediana es exacta; después compacta los valores guardando la mitad
+# con el doble de peso, de manera que la memoria está acotada y la mediana pasa a ser aproximada
+
+import statistics
+
+from itertools import accumulate
+from decimal import Decimal
+from datetime import date, datetime
+
+
+# número de valores que guarda cada nivel del resumen de cuantiles antes de compactarse
+default_sketch_capacity = 2048
+
+numeric_types = (int, float, Decimal)
+
+# Excel guarda las fechas como el número de días desde el 30/12/1899
+excel_epoch = datetime(1899, 12, 30)
+
+
+def excel_serial(value):
+    # número de serie de Excel de una fecha (date o datetime)
+    if not isinstance(value, datetime):
+        value = datetime(value.year, value.month, value.day)
+    delta = value - excel_epoch
+    return delta.days + delta.seconds / 86400
+
+
+class QuantileSketch:
+    # Resumen de cuantiles por niveles, los valores del nivel h tienen peso 2**h
+    # Con capacity None no se compacta nunca y los cuantiles son exactos
+
+    __slots__ = ('capacity', 'levels', 'count', '_offset')
+
+    def __init__(self, capacity=default_sketch_capacity):
+        self.capacity = capacity
+        self.levels = [[]]
+        self.count = 0
+        self._offset = 0  # alterna el elemento que se conserva de cada pareja al compactar
+
+    @property
+    def is_exact(self):
+        # mientras no se ha compactado ningún nivel se conservan todos los valores
+        return len(self.levels) == 1
+
+    def add(self, value):
+        level = self.levels[0]
+        level.append(value)
+        self.count += 1
+        if self.capacity and len(level) >= self.capacity:
+            self._compress()
+
+    def merge(self, other):
+        # combina otro resumen con este, el resultado es el mismo que si se hubieran añadido sus valores
+        # (exacto si los dos lo eran y no se supera la capacidad)
+        for height, items in enumerate(other.levels):
+            if height == len(self.levels):
+                self.levels.append([])
+            self.levels[height].extend(items)
+        self.count += other.count
+        if self.capacity:
+            self._compress()
+
+    def _compress(self):
+        height = 0
+        while height < len(self.levels):
+            level = self.levels[height]
+            if len(level) >= self.capacity:
+                level.sort()
+                # si el número de valores es impar, el último se queda en el nivel
+                paired = len(level) - len(level) % 2
+                if height + 1 == len(self.levels):
+                    self.levels.append([])
+                # de cada pareja de valores consecutivos se conserva uno con el doble de peso
+                self.levels[height + 1].extend(level[self._offset:paired:2])
+                self.levels[height] = level[paired:]
+                self._offset ^= 1
+            height += 1
+
+    def quantile(self, q):
+        # valor del cuantil q (entre 0 y 1): el menor valor cuyo peso acumulado alcanza q del peso total
+        if not self.count:
+            raise ValueError('No hay valores en el resumen')
+        items = sorted((value, 1 << height) for height, level in enumerate(self.levels) for value in level)
+        target = q * sum(weight for _, weight in items)
+        for (value, _), cumulative in zip(items, accumulate(weight for _, weight in items)):
+            if cumulative >= target:
+                return value
+        return items[-1][0]
+
+    def median(self):
+        # exacta (como la de Excel) mientras se conservan todos los valores
+        if self.is_exact:
+            return statistics.median(self.levels[0])
+        return self.quantile(0.5)
+
+
+class RunningAggregate:
+    # Acumula los valores de un rango como lo hacen las funciones de Excel:
+    # las celdas vacías se ignoran, el texto solo cuenta como valor no vacío (COUNTA)
+
+    __slots__ = ('count', 'non_empty', 'total', 'minimum', 'maximum', 'sketch', 'complete')
+
+    def __init__(self, sketch_capacity=default_sketch_capacity):
+        self.count = 0  # número de valores numéricos
+        self.non_empty = 0  # número de valores no vacíos
+        self.total = 0.0
+        self.minimum = None
+        self.maximum = None
+        self.sketch = QuantileSketch(sketch_capacity)
+        # False si alguno de los valores no se conocía al acumularlo (fórmulas aplazadas o que no se han podido
+        # evaluar), en ese caso el acumulador no se puede usar y hay que recorrer el rango
+        self.complete = True
+
+    @property
+    def is_exact(self):
+        return self.sketch.is_exact
+
+    def add(self, value):
+        # añade el valor de una celda
+        if value is None or value == '':
+            return
+        self.non_empty += 1
+        if isinstance(value, numeric_types) and not isinstance(value, bool):
+            self.add_number(float(value), counted=True)
+        elif isinstance(value, date):
+            # las fechas son números para Excel
+            self.add_number(excel_serial(value), counted=True)
+
+    def add_number(self, number, counted=False):
+        # añade un número (los argumentos de las funciones que no son rangos cuentan siempre como valores)
+        if not counted:
+            self.non_empty += 1
+        self.count += 1
+        self.total += number
+        if self.minimum is None or number < self.minimum:
+            self.minimum = number
+        if self.maximum is None or number > self.maximum:
+            self.maximum = number
+        self.sketch.add(number)
+
+    def merge(self, other):
+        # combina los valores de otro acumulador con los de este
+        self.count += other.count
+        self.non_empty += other.non_empty
+        self.total += other.total
+        if other.minimum is not None and (self.minimum is None or other.minimum < self.minimum):
+            self.minimum = other.minimum
+        if other.maximum is not None and (self.maximum is None or other.maximum > self.maximum):
+            self.maximum = other.maximum
+        self.sketch.merge(other.sketch)
+        self.complete = self.complete and other.complete
+        return self
+
+    def median(self):
+        return self.sketch.median()
+
+    def __repr__(self):
+        return f'RunningAggregate(count={self.count}, non_empty={self.non_empty}, total={self.total}, ' \
+               f'minimum={self.minimum}, maximum={self.maximum}, complete={self.complete})'
@@ -0,0 +1,146 @@
+# mide cómo escala redaxtor.py con el tamaño del listado
+#
+# para cada tamaño se genera un listado sintético con spool_generator.py y se procesa con cada formato de salida
+# cada medida se toma en un proceso nuevo, así el pico de memoria es el de ese proceso y los módulos ya
+# importados o las cachés de una medida no afectan a la siguiente
+# se miden el tiempo de procesar el listado y de escribir la salida (las fases 'process' y 'write' de
+# profiler.py), las líneas por segundo, el pico de memoria del proceso y el tamaño de la salida
+
+import argparse
+import json
+import pathlib
+import statistics
+import subprocess
+import sys
+import tempfile
+
+from commons import output_formats
+from redaxtor import Report
+from spool_generator import SpoolGenerator, default_section_lines
+
+
+# carpeta donde están los módulos de redaxtor
+src_folder = pathlib.Path(__file__).parent.absolute()
+
+default_sizes = [1000, 10000, 100000]
+
+# programa que se ejecuta en el proceso hijo para procesar el listado y escribir la salida
+run_program = '''
+import json, pathlib, sys
+from redaxtor import Report, process_report
+from commons import output_formats
+from profiler import Profiler, peak_memory
+
+conf_file, spool_file, output_format, output_folder, evaluate_formulas = sys.argv[1:6]
+
+profiler = Profiler()
+report = Report(conf_file)
+output_files = process_report(
+    spool_file, report, 'templates', output_formats[output_format], pathlib.Path(output_folder),
+    evaluate_formulas=evaluate_formulas == '1', profiler=profiler
+)
+
+print(json.dumps({
+    'process': profiler.stages['process'].wall,
+    'write': profiler.stages['write'].wall,
+    'peak_memory': peak_memory(),
+    'output_bytes': sum(pathlib.Path(f).stat().st_size for f in output_files),
+}))
+'''
+
+
+def run_once(conf_file, spool_file, output_format, output_folder, evaluate_formulas):
+    # procesa el listado en un proceso nuevo y devuelve sus medidas
+    result = subprocess.run(
+        [sys.executable, '-c', run_program, str(conf_file), str(spool_file), output_format.name, str(output_folder),
+         '1' if evaluate_formulas else '0'],
+        cwd=src_folder, capture_output=True, text=True, check=True
+    )
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def megabytes(value):
+    return f'{value / 2 ** 20:10.1f}' if value is not None else f'{"-":>10}'
+
+
+def benchmark(
+        conf_file, sizes=None, formats=None, repeat=3, evaluate_formulas=False, seed=0, noise=0.0, excluded=0.0,
+        section_lines=default_section_lines
+):
+    # devuelve una lista con las medidas de cada tamaño y formato (mediana de los tiempos de las repeticiones
+    # y máximo del pico de memoria)
+    sizes = sizes or default_sizes
+    formats = formats or list(output_formats)
+    results = []
+
+    print(f'{"lineas":>10} {"formato":<8} {"proceso (s)":>12} {"salida (s)":>11} {"lineas/s":>12} '
+          f'{"us/linea":>9} {"memoria MB":>10} {"salida MB":>10}')
+
+    with tempfile.TemporaryDirectory() as work_folder:
+        work_folder = pathlib.Path(work_folder)
+        generator = SpoolGenerator(Report(conf_file), seed)
+        for size in sizes:
+            spool_file = work_folder / f'spool_{size}.txt'
+            generator.write(spool_file, size, noise=noise, excluded=excluded, section_lines=section_lines)
+
+            for output_format in formats:
+                samples = [
+                    run_once(conf_file, spool_file, output_format, work_folder, evaluate_formulas)
+                    for _ in range(repeat)
+                ]
+                process = statistics.median(sample['process'] for sample in samples)
+                write = statistics.median(sample['write'] for sample in samples)
+                peaks = [sample['peak_memory'] for sample in samples if sample['peak_memory'] is not None]
+                result = {
+                    'lines': size,
+                    'format': output_format.name,
+                    'process': process,
+                    'write': write,
+                    'lines_per_second': size / (process + write),
+                    'peak_memory': max(peaks) if peaks else None,
+                    'output_bytes': samples[-1]['output_bytes'],
+                }
+                results.append(result)
+                print(f'{size:10d} {output_format.name:<8} {process:12.3f} {write:11.3f} '
+                      f'{result["lines_per_second"]:12.0f} {(process + write) / size * 1e6:9.1f} '
+                      f'{megabytes(result["peak_memory"])} {megabytes(result["output_bytes"])}')
+
+            spool_file.unlink()
+
+    return results
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Mide el rendimiento de redaxtor.py con listados sinteticos de distinto numero de lineas'
+    )
+    parser.add_argument('-c', '--conf-file', required=True, type=pathlib.Path, help='Fichero de configuracion')
+    parser.add_argument(
+        '-s', '--sizes', nargs='+', type=int, default=default_sizes, help='Numero de lineas de cada listado'
+    )
+    parser.add_argument(
+        '-f', '--formats', nargs='+', choices=[f.name for f in output_formats], default=None,
+        help='Formatos de salida a medir. Por defecto todos'
+    )
+    parser.add_argument('-r', '--repeat', type=int, default=3, help='Numero de repeticiones de cada medida')
+    parser.add_argument('-e', '--evaluate-formulas', action='store_true', help='Calcula el valor de las formulas')
+    parser.add_argument('-sd', '--seed', type=int, default=0, help='Semilla de los listados generados')
+    parser.add_argument('-nr', '--noise', type=float, default=0.0, help='Proporcion de lineas de ruido (0-1)')
+    parser.add_argument('-er', '--excluded', type=float, default=0.0, help='Proporcion de lineas excluidas (0-1)')
+    parser.add_argument('-j', '--json-file', type=pathlib.Path, help='Guarda las medidas en formato JSON')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    cli_args = parse_args()
+
+    measures = benchmark(
+        cli_args.conf_file.absolute(), cli_args.sizes,
+        [output_formats[name] for name in cli_args.formats] if cli_args.formats else None,
+        cli_args.repeat, cli_args.evaluate_formulas, cli_args.seed, cli_args.noise, cli_args.excluded
+    )
+
+    if cli_args.json_file:
+        with open(cli_args.json_file, 'w') as fout:
+            json.dump(measures, fout, indent=2)
@@ -1,14 +1,32 @@
 from enum import Enum
 from decimal import Decimal
 from datetime import datetime
+from functools import lru_cache
+from collections import OrderedDict
+from contextlib import contextmanager, nullcontext
 
 import argparse
+import bz2
+import gzip
+import io
+import lzma
+import os
+import pathlib
+import queue
 import re
+import shutil
+import sys
+import tempfile
+import threading
 
 
 # autor y nombre de la aplicación
 app_name = 'Redaxtor (https://github.com/JeCuRoz/Redaxtor)'
 
+# versión de la aplicación
+# forma parte de la clave de la caché de configuraciones, cambiarla invalida las cachés existentes
+app_version = '1.3.0'
+
 separator = '_'
 
 # símbolos para formatos numéricos
@@ -18,9 +36,13 @@ minus = '-'
 default_decimal_separator = dot
 
 # codificaciones de los ficheros de entrada
-encodings = ['utf-8', 'ascii', 'latin-1', 'utf-16', 'utf_16_le']
+# cp037 y cp500 son EBCDIC, habituales en los ficheros de registros de longitud fija de los mainframes
+encodings = ['utf-8', 'ascii', 'latin-1', 'utf-16', 'utf_16_le', 'cp037', 'cp500']
 default_encoding = encodings[0]  # utf-8
 
+# codificaciones con un carácter por byte, los registros de longitud fija se pueden decodificar por bloques
+single_byte_encodings = frozenset(('ascii', 'latin-1', 'cp037', 'cp500'))
+
 
 # convierte una cadena con un formato numérico en un número del tipo indicado
 # usando esta clase facilitamos añadir números con otros formatos numéricos
@@ -64,6 +86,9 @@ class NumericType:
 output_formats = Enum('OutputFormats', 'xlsx csv html xml json')
 default_format = output_formats.xlsx
 
+# formatos de salida que se generan con plantillas de jinja
+text_formats = frozenset([output_formats.csv, output_formats.html, output_formats.xml, output_formats.json])
+
 
 # Tipos de campos
 #
@@ -97,6 +122,10 @@ default_format = output_formats.xlsx
 #             decimalc        sin separador de millar y usa , como separador decimal
 #             decimalcd       usa , como separador de millar y usa . como separador decimal
 #             decimaldc       usa . como separador de millar y usa , como separador decimal
+#
+#     campos de fecha, pueden llevar entre paréntesis el formato de strptime del dato de entrada: date(%d/%m/%Y)
+#         date            fecha, se mapea a un date de python, formato por defecto %Y-%m-%d
+#         datetime        fecha y hora, se mapea a un datetime de python, formato por defecto %Y-%m-%d %H:%M:%S
 
 
 field_types = Enum(
@@ -104,7 +133,9 @@ field_types = Enum(
     'function empty const string fixed '
     'integer integerc integerd '
     'float floatc floatdc floatcd '
-    'decimal decimalc decimaldc decimalcd'
+    'decimal decimalc decimaldc decimalcd '
+    'date datetime',
+    qualname='field_types'  # necesario para poder serializar (pickle) los tipos con la caché de configuraciones
 )
 
 # campos especiales, pueden ser cadenas, fórmulas de excel o celdas vacías
@@ -117,8 +148,11 @@ numeric_fields = frozenset([
     field_types.decimal, field_types.decimalc, field_types.decimaldc, field_types.decimalcd
 ])
 
+# campos de fecha
+date_fields = frozenset([field_types.date, field_types.datetime])
+
 # campos que necesitan ser procesados antes de almacenarlos
-need_transform_types = frozenset.union(numeric_fields, [field_types.string])
+need_transform_types = frozenset.union(numeric_fields, date_fields, [field_types.string])
 
 # campos extraídos del fichero de entrada
 extracted_types = frozenset.union(need_transform_types, [field_types.fixed])
@@ -126,6 +160,21 @@ extracted_types = frozenset.union(need_transform_types, [field_types.fixed])
 # estos campos representan fórmulas de excel
 calculated_fields = frozenset([field_types.function])
 
+# formato de entrada por defecto de los campos de fecha
+default_date_formats = {
+    field_types.date: '%Y-%m-%d',
+    field_types.datetime: '%Y-%m-%d %H:%M:%S',
+}
+
+# formato de Excel de los campos de fecha cuyo estilo no tiene formato numérico
+excel_date_formats = {
+    field_types.date: 'yyyy-mm-dd',
+    field_types.datetime: 'yyyy-mm-dd hh:mm:ss',
+}
+
+# directivas de strptime numéricas de longitud fija y su número de dígitos
+fixed_date_directives = {'%Y': 4, '%m': 2, '%d': 2, '%H': 2, '%M': 2, '%S': 2}
+
 # información sobre el formato de los distintos tipos numéricos
 numeric_types_info = {
     field_types.integer: NumericType(
@@ -194,12 +243,277 @@ def time_mark(sep=separator):
     return datetime.now().strftime(f'%Y%m%d{sep}%H%M%S{sep}')
 
 
+# tamaño del buffer de lectura de los ficheros de entrada
+input_buffer_size = 1 << 20
+
+# formatos de compresión de los ficheros de entrada, se detectan por los primeros bytes del fichero
+compression_magics = (
+    (b'\x1f\x8b', 'gzip'),
+    (b'BZh', 'bz2'),
+    (b'\xfd7zXZ\x00', 'xz'),
+    (b'\x28\xb5\x2f\xfd', 'zstd'),
+)
+
+# nombre de fichero que representa la entrada estándar
+stdin_name = '-'
+
+# extensiones de los ficheros comprimidos, no forman parte del nombre de los ficheros de salida
+compressed_suffixes = frozenset(('.gz', '.bz2', '.xz', '.zst'))
+
+# líneas que se leen de una vez en el hilo de lectura anticipada y número de bloques que pueden estar pendientes
+read_ahead_lines = 1000
+read_ahead_chunks = 16
+
+
+def compression(head):
+    # formato de compresión a partir de los primeros bytes del fichero, None si no está comprimido
+    return next((name for magic, name in compression_magics if head.startswith(magic)), None)
+
+
+@contextmanager
+def open_binary(filename, buffer_size=input_buffer_size, on_open=None):
+    # abre un fichero de entrada en modo binario, descomprimiéndolo al leer si está comprimido
+    # con gzip, bz2, xz o zstd (este último necesita el paquete zstandard)
+    # el fichero - es la entrada estándar, que no se cierra
+    # si se indica on_open, se le llama con el fichero tal como está en disco (para saber cuánto se ha leído)
+    stdin = filename == stdin_name
+    with nullcontext(sys.stdin.buffer) if stdin else open(filename, 'rb', buffering=buffer_size) as raw:
+        if on_open:
+            on_open(raw)
+        kind = compression(raw.peek(8)[:8])
+        if kind == 'gzip':
+            stream = gzip.GzipFile(fileobj=raw)
+        elif kind == 'bz2':
+            stream = bz2.BZ2File(raw)
+        elif kind == 'xz':
+            stream = lzma.LZMAFile(raw)
+        elif kind == 'zstd':
+            try:
+                import zstandard
+            except ImportError:
+                raise ImportError(f'El fichero {filename} esta comprimido con zstd, hay que instalar zstandard')
+            stream = io.BufferedReader(
+                zstandard.ZstdDecompressor().stream_reader(raw, read_size=buffer_size), buffer_size
+            )
+        else:
+            stream = raw
+        try:
+            yield stream
+        finally:
+            # los descompresores no cierran el fichero que reciben, lo cierra el with
+            if stream is not raw:
+                stream.close()
+
+
+@contextmanager
+def open_input(filename, encoding=None, errors=None, buffer_size=input_buffer_size, on_open=None):
+    # abre un fichero de entrada en modo texto (ver open_binary)
+    with open_binary(filename, buffer_size, on_open) as stream:
+        text = io.TextIOWrapper(stream, encoding=encoding, errors=errors)
+        try:
+            yield text
+        finally:
+            # el fichero lo cierra open_binary
+            text.detach()
+
+
+def read_ahead(lines):
+    # lee las líneas en un hilo aparte por bloques, de manera que la lectura y la descompresión del fichero
+    # se solapan con el proceso de las líneas (la descompresión libera el GIL)
+    chunks = queue.Queue(read_ahead_chunks)
+    stop = threading.Event()
+
+    def put(item):
+        while not stop.is_set():
+            try:
+                chunks.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reader():
+        try:
+            chunk = []
+            for line in lines:
+                chunk.append(line)
+                if len(chunk) >= read_ahead_lines:
+                    if not put(chunk):
+                        return
+                    chunk = []
+            put(chunk)
+            put(None)
+        except BaseException as e:
+            put(e)
+        finally:
+            lines.close()
+
+    thread = threading.Thread(target=reader, name='read_ahead', daemon=True)
+    thread.start()
+    try:
+        while True:
+            chunk = chunks.get()
+            if chunk is None:
+                break
+            if isinstance(chunk, BaseException):
+                raise chunk
+            yield from chunk
+    finally:
+        stop.set()
+        thread.join()
+
+
+def _file_lines(filename, **kwargs):
+    with open_input(filename, **kwargs) as f:
+        # sin yield from: al cerrar el generador antes de terminar, yield from cerraría también f
+        # y open_input ya no podría separarlo del fichero
+        for line in f:
+            yield line
+
+
+def _file_records(
+        filename, record_length, encoding=default_encoding, errors=None, buffer_size=input_buffer_size, on_open=None
+):
+    # se leen bloques con un número entero de registros
+    block_size = max(1, buffer_size // record_length) * record_length
+    errors = errors or 'strict'
+    single_byte = encoding in single_byte_encodings
+    with open_binary(filename, buffer_size, on_open) as stream:
+        rest = b''
+        while True:
+            block = stream.read(block_size)
+            if not block:
+                break
+            if rest:
+                block = rest + block
+            # los descompresores y las tuberías pueden devolver bloques incompletos
+            end = len(block) - len(block) % record_length
+            rest = block[end:]
+            if single_byte:
+                # un carácter por byte: se decodifica el bloque entero y se corta en registros
+                text = block[:end].decode(encoding, errors)
+                for position in range(0, end, record_length):
+                    yield text[position:position + record_length]
+            else:
+                for position in range(0, end, record_length):
+                    yield block[position:position + record_length].decode(encoding, errors)
+        if rest:
+            # el último registro puede estar incompleto
+            yield rest.decode(encoding, errors)
+
+
+def file_by_record(filename, record_length, func=None, read_ahead_thread=False, **kwargs):
+    # devuelve los registros de longitud fija (en bytes) de un fichero sin separadores de línea,
+    # descomprimiéndolo si es necesario (ver open_binary)
+    # con read_ahead_thread los registros se leen en un hilo aparte (ver read_ahead)
+    records = _file_records(filename, record_length, **kwargs)
+    if read_ahead_thread:
+        records = read_ahead(records)
+    try:
+        for record in records:
+            yield func(record) if func else record
+    finally:
+        records.close()
+
+
 # itera línea a línea sobre un fichero
 # se puede aplicar una función (func) a cada línea antes de devolverla
-def file_by_line(filename, func=None, **kwargs):
-    with open(filename, **kwargs) as f:
-        for line in f:
+def file_by_line(filename, func=None, read_ahead_thread=False, **kwargs):
+    # devuelve las líneas del fichero, descomprimiéndolo si es necesario (ver open_input)
+    # con read_ahead_thread las líneas se leen en un hilo aparte (ver read_ahead)
+    lines = _file_lines(filename, **kwargs)
+    if read_ahead_thread:
+        lines = read_ahead(lines)
+    try:
+        for line in lines:
             yield func(line) if func else line
+    finally:
+        lines.close()
+
+
+class FilePool:
+    # Ficheros abiertos para escritura, como mucho max_open a la vez
+    # Cuando se alcanza el límite se cierra el que lleva más tiempo sin usarse (LRU)
+    # La primera vez que se abre un fichero se trunca, las siguientes se abre para añadir al final
+
+    def __init__(self, max_open, **kwargs):
+        self.max_open = max_open
+        self.kwargs = kwargs  # argumentos de open: encoding, newline,...
+        self._files = OrderedDict()  # fichero -> fichero abierto, del usado hace más tiempo al más reciente
+        self.opened = []  # ficheros abiertos alguna vez, en orden de apertura
+        self._seen = set()
+
+    def get(self, filename):
+        # devuelve el fichero abierto, abriéndolo si es necesario
+        f = self._files.get(filename)
+        if f is not None:
+            self._files.move_to_end(filename)
+            return f
+
+        if len(self._files) >= self.max_open:
+            _, oldest = self._files.popitem(last=False)
+            oldest.close()
+
+        if filename in self._seen:
+            mode = 'a'
+        else:
+            mode = 'w'
+            self._seen.add(filename)
+            self.opened.append(filename)
+        f = self._files[filename] = open(filename, mode, **self.kwargs)
+        return f
+
+    def close(self):
+        for f in self._files.values():
+            f.close()
+        self._files.clear()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+@contextmanager
+def work_folder(folder):
+    # carpeta temporal dentro de folder para escribir ficheros que solo deben aparecer en folder completos
+    # (ver publish_files), al salir se borra con lo que quede en ella
+    path = pathlib.Path(tempfile.mkdtemp(prefix='.redaxtor-', dir=folder))
+    try:
+        yield path
+    finally:
+        shutil.rmtree(path, ignore_errors=True)
+
+
+def publish_files(files, folder):
+    # mueve a folder los ficheros de una carpeta de trabajo (ver work_folder), renombrándolos: en el mismo sistema
+    # de ficheros el cambio es atómico y nunca se ve un fichero a medias
+    # devuelve las rutas en folder, también de los ficheros que no se han llegado a escribir
+    published = []
+    for _file in files:
+        target = pathlib.Path(folder) / pathlib.Path(_file).name
+        if os.path.exists(_file):
+            os.replace(_file, target)
+        published.append(target)
+    return published
+
+
+# devuelve el nombre de la columna de excel a partir de su índice (empezando en 0): A, B,.., Z, AA, AB,...
+# equivalente a xlsxwriter.utility.xl_col_to_name, evita importar xlsxwriter si la salida no es xlsx
+@lru_cache(maxsize=None)
+def col_to_name(col):
+    name = ''
+    col += 1
+    while col > 0:
+        col, remainder = divmod(col - 1, 26)
+        name = chr(ord('A') + remainder) + name
+    return name
+
+
+# devuelve el nombre de una celda de excel a partir de sus índices de fila y columna (empezando en 0): A1, D2, AA3,...
+def rowcol_to_cell(row, col):
+    return f'{col_to_name(col)}{row + 1}'
 
 
 # devuelve la lista de nombres de los tipos
@@ -280,6 +594,67 @@ def parse_args(description=None):
     return parser.parse_args()
 
 
+@lru_cache(maxsize=256)
+def date_parser(date_format):
+    # función que convierte un texto en un datetime según el formato de strptime date_format
+    # si el formato solo tiene directivas numéricas de longitud fija (%Y, %m, %d, %H, %M y %S) y separadores,
+    # como suele ocurrir en los listados, los campos se extraen por posición, mucho más rápido que con strptime
+    # los textos que no tienen esa forma exacta (5/01/2020, sin ceros a la izquierda,...) se convierten con strptime
+    fields = []  # (directiva, inicio, fin)
+    literals = []  # (inicio, texto)
+    position = 0
+    for token in re.findall(r'%.|[^%]+', date_format):
+        if token in fixed_date_directives:
+            length = fixed_date_directives[token]
+            fields.append((token, position, position + length))
+        elif token.startswith('%'):
+            # directiva de longitud variable (nombres de meses, %y,...)
+            return lambda value: datetime.strptime(value, date_format)
+        else:
+            length = len(token)
+            literals.append((position, token))
+        position += length
+    total_length = position
+
+    def parse(value):
+        if len(value) != total_length or any(value[start:start + len(text)] != text for start, text in literals):
+            return datetime.strptime(value, date_format)
+        parts = {}
+        for directive, start, end in fields:
+            digits = value[start:end]
+            if not digits.isdigit():
+                return datetime.strptime(value, date_format)
+            parts[directive] = int(digits)
+        # mismos valores por defecto que strptime
+        return datetime(
+            parts.get('%Y', 1900), parts.get('%m', 1), parts.get('%d', 1),
+            parts.get('%H', 0), parts.get('%M', 0), parts.get('%S', 0)
+        )
+
+    return parse
+
+
+# las fechas se repiten mucho en los listados (fecha del listado, de los movimientos,...)
+# se guardan las últimas conversiones para no volver a interpretarlas
+@lru_cache(maxsize=4096)
+def to_date(value, date_format, date_type):
+    if not value:
+        # las fechas vacías se quedan sin valor
+        return None
+    try:
+        result = date_parser(date_format)(value)
+    except ValueError:
+        raise ValueError(f'La fecha {value} no sigue el formato {date_format}')
+    return result.date() if date_type == field_types.date else result
+
+
+def field_style(styles, field):
+    # formato de Excel de las celdas de un campo
+    # los campos de fecha pueden tener un formato propio con el formato de fecha por defecto (ver Report.xlsx_styles)
+    style = styles.get((field.style_id, field.type))
+    return style if style is not None else styles.get(field.style_id)
+
+
 # convierte una cadena en un número teniendo en cuenta el formato numérico
 def to_number(value, numeric_type):
     try:
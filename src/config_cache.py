@@ -0,0 +1,84 @@
+# caché en disco de las definiciones de informes
+#
+# interpretar un fichero de configuración con pyparsing es lento, sobre todo si tiene muchos campos function
+# la definición ya construida del informe (secciones, fieldsets, campos y estilos) se serializa en disco
+# la clave de la caché es un hash del contenido del fichero de configuración y de la versión de la aplicación,
+# de manera que solo se vuelve a interpretar el fichero cuando cambia su contenido o la versión
+
+import hashlib
+import os
+import pathlib
+import pickle
+import tempfile
+
+from commons import app_version
+from logger import get_logger
+
+
+# Inicia el sistema de log
+logger = get_logger()
+
+# extensión de los ficheros de la caché
+cache_extension = '.pickle'
+
+# módulo que define las clases de la definición del informe
+definition_module = 'redaxtor'
+
+
+# cuando redaxtor.py se ejecuta como script sus clases se serializan como parte del módulo __main__
+# las buscamos siempre en el módulo redaxtor para que la caché sirva tanto al script como a quien lo importe
+class _Unpickler(pickle.Unpickler):
+
+    def find_class(self, module, name):
+        return super().find_class(definition_module if module == '__main__' else module, name)
+
+
+# calcula el hash que identifica a un fichero de configuración
+def config_hash(config_file):
+    digest = hashlib.sha256(app_version.encode())
+    with open(config_file, 'rb') as f:
+        digest.update(f.read())
+    return digest.hexdigest()
+
+
+# devuelve la ruta del fichero de la caché correspondiente a un fichero de configuración
+def cache_file(config_file, cache_folder):
+    return pathlib.Path(cache_folder) / f'{pathlib.Path(config_file).stem}_{config_hash(config_file)}{cache_extension}'
+
+
+# carga la definición de un informe desde la caché
+# devuelve None si no existe o no se puede leer, en ese caso hay que volver a interpretar el fichero
+def load_config(config_file, cache_folder):
+    _file = cache_file(config_file, cache_folder)
+
+    if not _file.is_file():
+        return None
+
+    try:
+        with open(_file, 'rb') as f:
+            definition = _Unpickler(f).load()
+        logger.debug(f'Configuracion {config_file} cargada desde la cache {_file}')
+        return definition
+    except Exception as e:
+        logger.warning(f'No se ha podido leer la cache {_file}: {e}')
+        return None
+
+
+# guarda la definición de un informe en la caché
+# se escribe en un fichero temporal que luego se renombra para que otros procesos nunca lean un fichero a medias
+def save_config(config_file, cache_folder, definition):
+    _file = cache_file(config_file, cache_folder)
+
+    temp_file = None
+    try:
+        _file.parent.mkdir(parents=True, exist_ok=True)
+        fd, temp_file = tempfile.mkstemp(dir=_file.parent, suffix='.tmp')
+        with os.fdopen(fd, 'wb') as f:
+            pickle.dump(definition, f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(temp_file, _file)
+        logger.debug(f'Configuracion {config_file} guardada en la cache {_file}')
+    except Exception as e:
+        if temp_file and os.path.exists(temp_file):
+            os.remove(temp_file)
+        # la caché es solo una optimización, un error al guardarla no impide procesar el listado
+        logger.warning(f'No se ha podido guardar la cache {_file}: {e}')
@@ -1,171 +1,214 @@
 # parser para los ficheros de definición de informes
 
-import pyparsing as pp
+import functools
+from types import SimpleNamespace
 
 from commons import extracted_types, type_names, store_empty, store_type, store_optional, \
     print_item, print_single_item, encodings, parse_args
 
-from styles_parser import Style, styles_grammar, print_style, text, style_id
+from styles_parser import Style, print_style
 
-from excel_parser import key_separator, number, excel_parser
 
-# codificación de los ficheros de entrada
-codec = pp.one_of(encodings, caseless=True)
-encoding = pp.CaselessLiteral('encoding').suppress() + codec('encoding')
+# la gramática se construye la primera vez que se necesita y no al importar el módulo
+# así no se paga su coste cuando la definición del informe se carga desde la caché
+@functools.cache
+def grammar():
 
-# estilo de formato para aplicar a cada campo 
-# es el estilo de la celda en la hoja de cálculo resultante
-style_def = pp.Suppress(key_separator) + style_id.set_results_name('style_id')
+    import pyparsing as pp
 
-# el tipo de campo extraído
-# indica que tipo de valor se ha extraído
-# dependiendo del tipo de campo el valor extraído será procesado de una forma u otra
-# puede que se convierta en un número, o se quiten los espacios en blanco,...
-column_type = pp.one_of(type_names(extracted_types), caseless=True).set_parse_action(store_type)
+    from styles_parser import styles_grammar, text, style_id
+    from excel_parser import key_separator, number, excel_parser
 
-integer = pp.common.integer
+    # codificación de los ficheros de entrada
+    codec = pp.one_of(encodings, caseless=True)
+    encoding = pp.CaselessLiteral('encoding').suppress() + codec('encoding')
 
-# cada línea del archivo original es una cadena de texto
-# índice izquierdo para extraer el valor
-left_index = integer
-# índice derecho para extraer el valor
-right_index = integer
-value = pp.Group(left_index + right_index)
+    # estilo de formato para aplicar a cada campo 
+    # es el estilo de la celda en la hoja de cálculo resultante
+    style_def = pp.Suppress(key_separator) + style_id.set_results_name('style_id')
 
-# campos extraídos
-# su valor se extrae del archivo de entrada entre los caraceteres
-# con índices left y right
-extracted_field = column_type('type') + value('value')
+    # el tipo de campo extraído
+    # indica que tipo de valor se ha extraído
+    # dependiendo del tipo de campo el valor extraído será procesado de una forma u otra
+    # puede que se convierta en un número, o se quiten los espacios en blanco,...
+    column_type = pp.one_of(type_names(extracted_types), caseless=True).set_parse_action(store_type)
 
-# campo en blanco, se usa para crear relleno
-# si no se especifica un valor solo se deja en blanco una celda
-# si se indica un valor se añadiran ese número de celdas en blanco
-empty_field = \
-    pp.CaselessLiteral('empty').set_parse_action(store_type).set_results_name('type') + \
-    pp.Opt(integer).set_parse_action(store_empty).set_results_name('value')
+    # formato de strptime de los campos de fecha, entre paréntesis: date(%d/%m/%Y)
+    date_format = pp.Suppress('(') + pp.CharsNotIn(')').set_results_name('format') + pp.Suppress(')')
 
-# campo de valor
-# el valor de la celda será el indicado en el campo
-# está pensado para títulos de encabezado, constantes,....
-const_field = \
-    pp.CaselessLiteral('const').set_parse_action(store_type).set_results_name('type') + \
-    (text | number).set_results_name('value')
+    integer = pp.common.integer
 
-# campo de fórmula
-# el valor del campo es una fórmula de excel
-# el valor final será el calculado por la fórmula
-calculated_field = \
-    pp.CaselessLiteral('function').set_parse_action(store_type).set_results_name('type') + \
-    excel_parser.set_results_name('value')
+    # cada línea del archivo original es una cadena de texto
+    # índice izquierdo para extraer el valor
+    left_index = integer
+    # índice derecho para extraer el valor
+    right_index = integer
+    value = pp.Group(left_index + right_index)
 
-# los campos especiales son aquellos cuyo valor no se extrae del listado original
-special_field = const_field | calculated_field | empty_field
+    # en los listados delimitados, índice de la columna de la línea de la que se extrae el valor: @N
+    column = pp.Group(pp.Suppress('@') + integer)
 
-# definición de los filtros de exclusión/inclusión
-filters = pp.delimited_list(text)
+    # campos extraídos
+    # su valor se extrae del archivo de entrada entre los caraceteres
+    # con índices left y right o de la columna N de la línea
+    extracted_field = column_type('type') + pp.Opt(date_format) + (value('value') | column('column'))
 
-# nombre del campo, opcional
-field_name = pp.CaselessLiteral('as') + pp.pyparsing_common.identifier.set_results_name('name')
+    # campo en blanco, se usa para crear relleno
+    # si no se especifica un valor solo se deja en blanco una celda
+    # si se indica un valor se añadiran ese número de celdas en blanco
+    empty_field = \
+        pp.CaselessLiteral('empty').set_parse_action(store_type).set_results_name('type') + \
+        pp.Opt(integer).set_parse_action(store_empty).set_results_name('value')
 
-# definición de campo estandar
-field_def = (extracted_field | special_field) + pp.Opt(field_name) + pp.Opt(style_def)
+    # campo de valor
+    # el valor de la celda será el indicado en el campo
+    # está pensado para títulos de encabezado, constantes,....
+    const_field = \
+        pp.CaselessLiteral('const').set_parse_action(store_type).set_results_name('type') + \
+        (text | number).set_results_name('value')
 
-# grupo de definiciones de campos
-field_defs = pp.OneOrMore(pp.Group(field_def))
+    # campo de fórmula
+    # el valor del campo es una fórmula de excel
+    # el valor final será el calculado por la fórmula
+    calculated_field = \
+        pp.CaselessLiteral('function').set_parse_action(store_type).set_results_name('type') + \
+        excel_parser.set_results_name('value')
 
-# hace que no se añada una nueva fila a la salida despúes de procesar la línea en curso
-# los campos de las siguientes líneas se situarán en la misma fila que los de la línea en curso
-keep_in_row = pp.Opt(pp.CaselessLiteral('keep_in_row')).set_parse_action(store_optional)
+    # los campos especiales son aquellos cuyo valor no se extrae del listado original
+    special_field = const_field | calculated_field | empty_field
 
-# fuerza a que los campos de la línea en curso se añadan en una nueva línea aunque se haya usado el flag keep_in_row
-new_row = pp.Opt(pp.CaselessLiteral('new_row')).set_parse_action(store_optional)
+    # definición de los filtros de exclusión/inclusión
+    filters = pp.delimited_list(text)
 
-# flags opcionales para el fieldSet
-field_flags = new_row('new_row') + keep_in_row('keep_in_row')
+    # nombre del campo, opcional
+    field_name = pp.CaselessLiteral('as') + pp.pyparsing_common.identifier.set_results_name('name')
 
-# Lista de filtros de inclusión
-# las líneas que concuerden con algún filtro de inclusión seran procesadas por
-# el fieldSet correspondiente
-include_filters = pp.CaselessLiteral('include_filters').suppress() + filters
+    # definición de campo estandar
+    field_def = (extracted_field | special_field) + pp.Opt(field_name) + pp.Opt(style_def)
 
-# los fieldsets se componen de una lista de campos (de cualquier tipo)
-# más información (flags) sobre como se procesan
-field_set = pp.CaselessLiteral('fieldset').suppress() + include_filters('include_filters') + \
-             field_flags + field_defs('fields')
-field_set_def = pp.OneOrMore(pp.Group(field_set))
+    # grupo de definiciones de campos
+    field_defs = pp.OneOrMore(pp.Group(field_def))
 
-body = pp.CaselessLiteral('body').suppress() + field_set_def('fieldsets*')
+    # hace que no se añada una nueva fila a la salida despúes de procesar la línea en curso
+    # los campos de las siguientes líneas se situarán en la misma fila que los de la línea en curso
+    keep_in_row = pp.Opt(pp.CaselessLiteral('keep_in_row')).set_parse_action(store_optional)
 
-# en el encabezado o en el pie solo se permiten campos especiales
-special_field_def = special_field + pp.Opt(field_name) + pp.Opt(style_def)
+    # fuerza a que los campos de la línea en curso se añadan en una nueva línea aunque se haya usado el flag keep_in_row
+    new_row = pp.Opt(pp.CaselessLiteral('new_row')).set_parse_action(store_optional)
 
-# grupo de definiciones de campos especiales
-special_field_defs = pp.OneOrMore(pp.Group(special_field_def))
+    # flags opcionales para el fieldSet
+    field_flags = new_row('new_row') + keep_in_row('keep_in_row')
 
-special_field_set = pp.CaselessLiteral('fieldset').suppress() + special_field_defs('fields')
-special_field_set_def = pp.OneOrMore(pp.Group(special_field_set))
+    # Lista de filtros de inclusión
+    # las líneas que concuerden con algún filtro de inclusión seran procesadas por
+    # el fieldSet correspondiente
+    include_filters = pp.CaselessLiteral('include_filters').suppress() + filters
 
-# pie de la sección (opcional)
-# son los pies de las columnas
-footer = pp.CaselessLiteral('footer').suppress() + special_field_set_def('fieldsets*')
-footer_def = pp.Opt(footer)
+    # los fieldsets se componen de una lista de campos (de cualquier tipo)
+    # más información (flags) sobre como se procesan
+    field_set = pp.CaselessLiteral('fieldset').suppress() + include_filters('include_filters') + \
+                 field_flags + field_defs('fields')
+    field_set_def = pp.OneOrMore(pp.Group(field_set))
 
-# encabezado de la sección (opcional)
-# son los encabezados de las columnas
-header = pp.CaselessLiteral('header').suppress() + special_field_set_def('fieldsets*')
-header_def = pp.Opt(header)
+    body = pp.CaselessLiteral('body').suppress() + field_set_def('fieldsets*')
 
-# añadir una línea (fila) en blanco despúes de la sección
-blank_row = pp.Opt(pp.CaselessLiteral('blank_row')).set_parse_action(store_optional)
+    # en el encabezado o en el pie solo se permiten campos especiales
+    special_field_def = special_field + pp.Opt(field_name) + pp.Opt(style_def)
 
-# la sección solo se procesa una vez
-# las sucesivas veces que se encuentren líneas del archivo de entrada susceptibles
-# de ser procesadas por esta sección, serán descartadas
-process_only_one_time = pp.Opt(pp.CaselessLiteral('process_only_one_time')).set_parse_action(store_optional)
+    # grupo de definiciones de campos especiales
+    special_field_defs = pp.OneOrMore(pp.Group(special_field_def))
 
-# flags globales para la sección (opcionales)
-section_flags = process_only_one_time('process_only_one_time') + blank_row('blank_row')
+    special_field_set = pp.CaselessLiteral('fieldset').suppress() + special_field_defs('fields')
+    special_field_set_def = pp.OneOrMore(pp.Group(special_field_set))
 
-# cada sección define como se procesa parte del archivo de entrada
+    # pie de la sección (opcional)
+    # son los pies de las columnas
+    footer = pp.CaselessLiteral('footer').suppress() + special_field_set_def('fieldsets*')
+    footer_def = pp.Opt(footer)
 
-section = pp.CaselessLiteral('section').suppress() + section_flags + \
-          header_def('header') + body('body') + footer_def('footer')
+    # encabezado de la sección (opcional)
+    # son los encabezados de las columnas
+    header = pp.CaselessLiteral('header').suppress() + special_field_set_def('fieldsets*')
+    header_def = pp.Opt(header)
 
-# lista de secciones
-sections = pp.OneOrMore(pp.Group(section))
+    # añadir una línea (fila) en blanco despúes de la sección
+    blank_row = pp.Opt(pp.CaselessLiteral('blank_row')).set_parse_action(store_optional)
 
-# lista de filtros de exclusión (opcional)
-# las líneas del listado original que concuerden con alguno de los filtros
-# serán descartadas inmediatamente sin ser procesadas
-exclude_filters = pp.CaselessLiteral('exclude_filters').suppress() + filters
-exclude_filters_def = pp.Opt(exclude_filters)
+    # la sección solo se procesa una vez
+    # las sucesivas veces que se encuentren líneas del archivo de entrada susceptibles
+    # de ser procesadas por esta sección, serán descartadas
+    process_only_one_time = pp.Opt(pp.CaselessLiteral('process_only_one_time')).set_parse_action(store_optional)
 
-# ancho de las columnas (opcional)
-# se define globalmente para todo el reporte (hoja de calculo)
-columns_width = pp.CaselessLiteral('columns_width').suppress() + \
-                pp.Group(pp.OneOrMore(integer)).set_results_name('columns_width')
+    # flags globales para la sección (opcionales)
+    section_flags = process_only_one_time('process_only_one_time') + blank_row('blank_row')
 
-# texto descriptivo sobre el listado (opcional)
-description = pp.QuotedString('description', end_quote_char='/description', multiline=True)
-description_def = pp.Opt(description)
+    # cada sección define como se procesa parte del archivo de entrada
 
-# título descriptivo del listado (requerido)
-title = pp.CaselessLiteral('title').suppress() + pp.rest_of_line.set_results_name('title')
+    section = pp.CaselessLiteral('section').suppress() + section_flags + \
+              header_def('header') + body('body') + footer_def('footer')
 
-styles_grammar_def = pp.Opt(styles_grammar)
+    # lista de secciones
+    sections = pp.OneOrMore(pp.Group(section))
 
-# raíz de la gramática
-report_grammar =  \
-    title + description_def('description') + pp.Opt(encoding) + pp.Opt(columns_width) + \
-    exclude_filters_def('exclude_filters') + styles_grammar_def + sections('sections')
+    # lista de filtros de exclusión (opcional)
+    # las líneas del listado original que concuerden con alguno de los filtros
+    # serán descartadas inmediatamente sin ser procesadas
+    exclude_filters = pp.CaselessLiteral('exclude_filters').suppress() + filters
+    exclude_filters_def = pp.Opt(exclude_filters)
 
-# los comentarios estilo python dentro de los archivos de configuración
-# están permitidos y son ignorados
-report_grammar.ignore(pp.python_style_comment)
+    # longitud de los registros de los ficheros de entrada sin separadores de línea (opcional)
+    # el fichero se divide en registros de ese número de bytes, que se procesan como si fueran líneas
+    record_length = pp.CaselessLiteral('record_length').suppress() + \
+        integer.copy().add_condition(lambda tokens: tokens[0] > 0, message='record_length debe ser mayor que 0') \
+        .set_results_name('record_length')
+
+    # separador de las columnas de los ficheros de entrada delimitados (opcional)
+    # tab es el tabulador, con quoted los valores pueden ir entre comillas y contener el separador
+    delimiter_char = pp.CaselessLiteral('tab').set_parse_action(lambda: '\t') | text
+    delimiter = pp.CaselessLiteral('delimiter').suppress() + delimiter_char('delimiter') + \
+        pp.Opt(pp.CaselessLiteral('quoted')).set_parse_action(store_optional)('quoted')
+
+    # ancho de las columnas (opcional)
+    # se define globalmente para todo el reporte (hoja de calculo)
+    columns_width = pp.CaselessLiteral('columns_width').suppress() + \
+                    pp.Group(pp.OneOrMore(integer)).set_results_name('columns_width')
+
+    # texto descriptivo sobre el listado (opcional)
+    description = pp.QuotedString('description', end_quote_char='/description', multiline=True)
+    description_def = pp.Opt(description)
+
+    # título descriptivo del listado (requerido)
+    title = pp.CaselessLiteral('title').suppress() + pp.rest_of_line.set_results_name('title')
+
+    styles_grammar_def = pp.Opt(styles_grammar)
+
+    # raíz de la gramática
+    report_grammar =  \
+        title + description_def('description') + pp.Opt(encoding) + pp.Opt(record_length) + pp.Opt(delimiter) + \
+        pp.Opt(columns_width) + exclude_filters_def('exclude_filters') + styles_grammar_def + sections('sections')
+
+    # los comentarios estilo python dentro de los archivos de configuración
+    # están permitidos y son ignorados
+    report_grammar.ignore(pp.python_style_comment)
+
+    return SimpleNamespace(report_grammar=report_grammar)
+
+
+# permite seguir importando la gramática como atributo del módulo (report_grammar)
+# solo se construye la gramática cuando se pide uno de sus elementos
+grammar_names = ('report_grammar',)
+
+
+def __getattr__(name):
+    if name in grammar_names:
+        return getattr(grammar(), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 def test_report_conf(report_file):
 
+    import pyparsing as pp
+
     from logger import get_logger
 
     # Inicia el sistema de log
@@ -175,8 +218,10 @@ def test_report_conf(report_file):
         for index, field in enumerate(fields):
             print_item('field', index, level)
             print_item('type', field.type.name, level+1)
-            print_item('value', field.value, level+1)
+            print_item('value', f'@{field.column[0]}' if field.column else field.value, level+1)
             print_item('name', field.name, level+1)
+            if field.format:
+                print_item('format', field.format, level+1)
             if field.style_id:
                 print_item('style', field.style_id, level+1)
 
@@ -187,7 +232,7 @@ def test_report_conf(report_file):
     try:
 
         with open(report_file) as report:
-            result = report_grammar.parse_file(report, parse_all=True)
+            result = grammar().report_grammar.parse_file(report, parse_all=True)
 
         print_item('title', result.title)
 
@@ -197,6 +242,13 @@ def test_report_conf(report_file):
         if result.encoding:
             print_item('encoding', result.encoding)
 
+        if result.record_length:
+            print_item('record_length', result.record_length)
+
+        if result.delimiter:
+            print_item('delimiter', repr(result.delimiter))
+            print_item('quoted', result.quoted)
+
         if result.columnsWidth:
             print_item('columns_width', result.columns_width)
 
@@ -0,0 +1,695 @@
+# comprueba que las distintas formas de procesar un listado y de escribir la salida dan el mismo resultado
+#
+# la referencia es el proceso de siempre: Report.process y Report.xlsx o las plantillas (process_report)
+# cada motor (ver engines) procesa los mismos listados con los mismos formatos y su salida se compara celda a
+# celda con la de la referencia:
+# - xlsx: se lee el libro con un lector propio (zipfile y xml), cada celda con su valor, fórmula y estilo
+# - json y xml: se interpretan los documentos y se comparan los valores de cada registro
+# - csv y html: se comparan línea a línea y, en csv, columna a columna
+# en csv se comprueba además que las filas de cada fichero de --partition-by son las de la salida completa con las
+# fórmulas evaluadas (ver partition_differences), y en xlsx que la preparación simplificada de las fórmulas da el
+# mismo resultado que xlsxwriter (ver formula_differences)
+# en csv se comprueba también que los pies calculados con los acumuladores de las secciones son los mismos que
+# recorriendo las celdas (ver aggregate_differences)
+# los listados son los de examples (el .txt de cada .conf), uno propio con filas continuadas (keep_in_row_conf)
+# y listados sintéticos generados con spool_generator.py
+#
+# cada ejecución se mide en un proceso nuevo (tiempo y pico de memoria) y se añade a un fichero de histórico
+# si un motor tarda o usa bastante más memoria que en las ejecuciones anteriores del histórico con el mismo
+# listado y formato, se considera una regresión
+# el programa termina con error si hay alguna diferencia o alguna regresión
+
+import argparse
+import csv
+import gzip
+import json
+import pathlib
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+import unittest.mock
+import zipfile
+import xml.etree.ElementTree as ElementTree
+
+from commons import app_version, output_formats, text_formats
+from redaxtor import Report, process_report, stream_report, merge_reports, partition_line, field_separator, \
+    PartitionNames
+from formula_evaluator import Evaluator
+from spool_generator import SpoolGenerator
+from xlsx_worksheet import simple_formula
+from xlsxwriter.worksheet import Worksheet as BaseWorksheet
+
+
+# carpeta donde están los módulos de redaxtor y las plantillas
+src_folder = pathlib.Path(__file__).parent.absolute()
+templates_folder = src_folder / 'templates'
+examples_folder = src_folder.parent / 'examples'
+
+default_history_file = 'equivalence_history.jsonl'
+
+# número de líneas de los listados generados
+default_generated_lines = 10000
+
+# una ejecución es una regresión si supera la mediana de las últimas history_runs ejecuciones del histórico
+# en más de tolerance (proporción) y, en el tiempo, en más de min_seconds
+default_tolerance = 0.25
+min_seconds = 0.05
+history_runs = 5
+
+# número máximo de diferencias que se muestran de cada comparación
+max_differences = 10
+
+spreadsheet_namespace = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+relationships_namespace = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+package_namespace = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+
+
+# motores
+
+# nombre -> (función, formatos que admite o None si admite todos)
+# la función recibe (conf_file, spool_file, output_format, output_folder, evaluate_formulas) y devuelve la
+# lista de ficheros generados
+engines = {}
+
+
+def engine(name, formats=None):
+    # registra una forma alternativa de procesar el listado y escribir la salida
+    def register(function):
+        engines[name] = (function, formats)
+        return function
+    return register
+
+
+@engine('reference')
+def reference_engine(conf_file, spool_file, output_format, output_folder, evaluate_formulas):
+    return process_report(
+        spool_file, Report(conf_file), templates_folder, output_format, output_folder,
+        evaluate_formulas=evaluate_formulas
+    )
+
+
+@engine('cache')
+def cache_engine(conf_file, spool_file, output_format, output_folder, evaluate_formulas):
+    # definición del informe cargada desde la caché de configuraciones
+    cache_folder = output_folder / 'cache'
+    cache_folder.mkdir(exist_ok=True)
+    Report(conf_file, cache_folder)
+    return process_report(
+        spool_file, Report(conf_file, cache_folder), templates_folder, output_format, output_folder,
+        evaluate_formulas=evaluate_formulas
+    )
+
+
+@engine('read_ahead')
+def read_ahead_engine(conf_file, spool_file, output_format, output_folder, evaluate_formulas):
+    return process_report(
+        spool_file, Report(conf_file), templates_folder, output_format, output_folder,
+        evaluate_formulas=evaluate_formulas, read_ahead=True
+    )
+
+
+@engine('gzip')
+def gzip_engine(conf_file, spool_file, output_format, output_folder, evaluate_formulas):
+    # listado comprimido, se descomprime según se lee
+    compressed = output_folder / f'{pathlib.Path(spool_file).name}.gz'
+    with open(spool_file, 'rb') as fin, gzip.open(compressed, 'wb') as fout:
+        shutil.copyfileobj(fin, fout)
+    return process_report(
+        str(compressed), Report(conf_file), templates_folder, output_format, output_folder,
+        evaluate_formulas=evaluate_formulas
+    )
+
+
+@engine('stream', formats=text_formats)
+def stream_engine(conf_file, spool_file, output_format, output_folder, evaluate_formulas):
+    # salida escrita durante el proceso (--stdout), a un fichero
+    output_file = output_folder / f'{pathlib.Path(spool_file).stem}.{output_format.name}'
+    with open(output_file, 'w') as fout:
+        stream_report(spool_file, Report(conf_file), templates_folder, output_format, evaluate_formulas, output=fout)
+    return [output_file]
+
+
+@engine('merge')
+def merge_engine(conf_file, spool_file, output_format, output_folder, evaluate_formulas):
+    # un único listado con --merge
+    report = Report(conf_file)
+    output_file = output_folder / f'{pathlib.Path(spool_file).stem}.{output_format.name}'
+    return merge_reports(
+        [spool_file], lambda input_file: report, templates_folder, output_file, output_format, evaluate_formulas
+    )
+
+
+# programa que se ejecuta en el proceso hijo para medir un motor
+run_program = '''
+import json, pathlib, sys, time
+from equivalence import engines
+from commons import output_formats
+from profiler import peak_memory
+
+name, conf_file, spool_file, output_format, output_folder, evaluate_formulas = sys.argv[1:7]
+function, _ = engines[name]
+
+start = time.perf_counter()
+output_files = function(
+    conf_file, spool_file, output_formats[output_format], pathlib.Path(output_folder), evaluate_formulas == '1'
+)
+seconds = time.perf_counter() - start
+
+print(json.dumps({
+    'seconds': seconds, 'peak_memory': peak_memory(), 'output_files': [str(f) for f in output_files]
+}))
+'''
+
+
+def run_engine(name, conf_file, spool_file, output_format, output_folder, evaluate_formulas):
+    # ejecuta el motor en un proceso nuevo y devuelve sus medidas y los ficheros generados
+    output_folder.mkdir(parents=True, exist_ok=True)
+    result = subprocess.run(
+        [sys.executable, '-c', run_program, name, str(conf_file), str(spool_file), output_format.name,
+         str(output_folder), '1' if evaluate_formulas else '0'],
+        cwd=src_folder, capture_output=True, text=True
+    )
+    if result.returncode:
+        raise RuntimeError(f'El motor {name} ha fallado con {spool_file}:\n{result.stderr}')
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+# partición de la salida csv (--partition-by)
+
+# campo por el que se divide la salida de los listados propios (ver keep_in_row_spools)
+partition_fields = {}
+
+
+def partition_field(report):
+    # campo por el que se divide la salida: el primer campo con nombre del cuerpo de las secciones, mejor si es
+    # de un fieldset con fórmulas para comprobarlas
+    fieldsets = sorted(
+        (fieldset for section in report.sections for fieldset in section.body),
+        key=lambda fieldset: not any(field.is_calculated for field in fieldset.fields)
+    )
+    return next((
+        field.name for fieldset in fieldsets for field in fieldset.fields if field.name and not field.is_calculated
+    ), None)
+
+
+def partition_differences(conf_file, spool_file, output_folder):
+    # comprueba que cada fila de los ficheros de la partición es la misma fila de la salida csv completa con las
+    # fórmulas evaluadas: las fórmulas se tienen que calcular con las celdas de su fila del listado y no con las
+    # de la fila que ocupa en su fichero. Las fórmulas que no se pueden evaluar se esperan vacías
+    # devuelve las diferencias (posición, valor esperado, valor del fichero)
+    reference_folder = output_folder / 'reference'
+    reference_folder.mkdir(parents=True, exist_ok=True)
+    [reference_file] = process_report(
+        spool_file, Report(conf_file), templates_folder, output_formats.csv, reference_folder, evaluate_formulas=True
+    )
+    with open(reference_file) as fin:
+        reference_lines = fin.read().splitlines()
+
+    # el listado procesado por separado, para saber qué líneas de la salida completa son del cuerpo y qué fórmulas
+    # se han podido evaluar
+    report = Report(conf_file)
+    report.process(spool_file, evaluate_formulas=True)
+    field_name = partition_fields.get(conf_file) or partition_field(report)
+    if field_name is None:
+        return []
+    partition_folder = output_folder / 'partition'
+    partition_folder.mkdir(parents=True, exist_ok=True)
+    partition_files = process_report(
+        spool_file, Report(conf_file), templates_folder, output_formats.csv, partition_folder, partition_by=field_name
+    )
+
+    # filas esperadas de cada fichero: las líneas de la salida completa de las filas del cuerpo con ese valor
+    lines = [line for cell_group in report.cell_groups for line in cell_group.lines]
+    if len(lines) != len(reference_lines):
+        return [('lineas', len(reference_lines), len(lines))]
+    headers = set()
+    expected = {}
+    names = PartitionNames()
+    for line, reference_line in zip(lines, reference_lines):
+        if line.is_header:
+            headers.add(partition_line(line).rstrip('\n'))
+        if not line.is_body:
+            continue
+        value = next((cell.output_value for cell in line if cell.field.name == field_name), None)
+        if value is None or value == '':
+            continue
+        # las fórmulas sin evaluar se escriben vacías en la partición
+        values = [
+            '' if cell.field.is_calculated and cell.computed is None else reference_value
+            for cell, reference_value in zip(line, reference_line.split(field_separator))
+        ]
+        expected.setdefault(names(str(value)), []).append(values)
+
+    found = []
+    for partition_file in partition_files:
+        value = partition_file.stem[len(pathlib.Path(spool_file).stem) + 1:]
+        with open(partition_file) as fin:
+            rows = [line.split(field_separator) for line in fin.read().splitlines() if line not in headers]
+        expected_rows = expected.pop(value, [])
+        for row in range(max(len(rows), len(expected_rows))):
+            row_values = rows[row] if row < len(rows) else []
+            expected_values = expected_rows[row] if row < len(expected_rows) else []
+            for col in range(max(len(row_values), len(expected_values))):
+                got = row_values[col] if col < len(row_values) else None
+                wanted = expected_values[col] if col < len(expected_values) else None
+                if got != wanted:
+                    found.append((f'{partition_file.name} fila {row + 1} columna {col + 1}', wanted, got))
+    found.extend((f'{value} sin fichero', expected_rows, None) for value, expected_rows in expected.items())
+    return found
+
+
+# evaluación de las fórmulas (--evaluate-formulas)
+
+class CellEvaluator(Evaluator):
+    # evaluador sin los acumuladores de las secciones: los rangos de los pies se recorren celda a celda
+
+    def add_group(self, cell_group):
+        pass
+
+
+def evaluated_values(conf_file, spool_file, evaluator_class):
+    # valor de cada celda del listado procesado con las fórmulas evaluadas por evaluator_class
+    report = Report(conf_file)
+    with unittest.mock.patch('redaxtor.Evaluator', evaluator_class):
+        report.process(spool_file, evaluate_formulas=True)
+    return {
+        f'seccion {cell_group.index} {cell.excel_cell}': str(cell.output_value)
+        for cell_group in report.cell_groups for line in cell_group.lines for cell in line
+    }
+
+
+def aggregate_differences(conf_file, spool_file):
+    # comprueba que los pies calculados con los acumuladores de las secciones (ver aggregates.py) son los mismos
+    # que recorriendo las celdas de sus rangos, también con las filas continuadas (keep_in_row)
+    # se comprueba aunque no se use -e
+    return differences(
+        evaluated_values(conf_file, spool_file, CellEvaluator), evaluated_values(conf_file, spool_file, Evaluator)
+    )
+
+
+# preparación de las fórmulas del xlsx (ver xlsx_worksheet.py)
+
+def formula_differences(conf_file, spool_file):
+    # comprueba que el atajo de xlsx_worksheet da el mismo resultado que xlsxwriter con las fórmulas del listado
+    # se comprueba aunque la versión instalada de xlsxwriter no esté en checked_versions, para poder añadirla
+    # devuelve las diferencias (celda, resultado de xlsxwriter, resultado del atajo)
+    report = Report(conf_file)
+    report.process(spool_file)
+    sheet = BaseWorksheet()
+    found = []
+    for cell_group in report.cell_groups:
+        for line in cell_group.lines:
+            for cell in line:
+                if not cell.field.is_calculated:
+                    continue
+                formula = cell.value
+                prepared = simple_formula(formula)
+                expected = sheet._prepare_formula(formula)
+                if prepared is not None and prepared != expected:
+                    found.append((f'{cell.excel_cell} {formula}', expected, prepared))
+    return found
+
+
+# lectura de las salidas
+
+def xlsx_cells(xlsx_file):
+    # celdas de cada hoja del libro: lista de hojas (nombre, {celda: (valor, fórmula, estilo)})
+    with zipfile.ZipFile(xlsx_file) as book:
+        shared_strings = []
+        if 'xl/sharedStrings.xml' in book.namelist():
+            root = ElementTree.fromstring(book.read('xl/sharedStrings.xml'))
+            for item in root.iter(f'{spreadsheet_namespace}si'):
+                shared_strings.append(''.join(text.text or '' for text in item.iter(f'{spreadsheet_namespace}t')))
+
+        relationships = ElementTree.fromstring(book.read('xl/_rels/workbook.xml.rels'))
+        targets = {
+            relationship.get('Id'): relationship.get('Target')
+            for relationship in relationships.iter(f'{package_namespace}Relationship')
+        }
+
+        sheets = []
+        workbook = ElementTree.fromstring(book.read('xl/workbook.xml'))
+        for sheet in workbook.iter(f'{spreadsheet_namespace}sheet'):
+            target = targets[sheet.get(f'{relationships_namespace}id')].lstrip('/')
+            root = ElementTree.fromstring(book.read(target if target.startswith('xl/') else f'xl/{target}'))
+            cells = {}
+            for cell in root.iter(f'{spreadsheet_namespace}c'):
+                value = cell.find(f'{spreadsheet_namespace}v')
+                value = value.text if value is not None else None
+                cell_type = cell.get('t')
+                if cell_type == 's':
+                    value = shared_strings[int(value)]
+                elif cell_type == 'inlineStr':
+                    value = ''.join(text.text or '' for text in cell.iter(f'{spreadsheet_namespace}t'))
+                formula = cell.find(f'{spreadsheet_namespace}f')
+                formula = formula.text if formula is not None else None
+                cells[cell.get('r')] = (value, formula, cell.get('s'))
+            sheets.append((sheet.get('name'), cells))
+        return sheets
+
+
+def xlsx_values(xlsx_file):
+    # las hojas se identifican por su posición: el nombre depende de cómo se haya generado (--merge)
+    return {
+        f'hoja {index + 1} {cell}': value
+        for index, (_, cells) in enumerate(xlsx_cells(xlsx_file)) for cell, value in cells.items()
+    }
+
+
+def csv_values(csv_file):
+    with open(csv_file, newline='') as fin:
+        return {
+            f'linea {row + 1} columna {col + 1}': value
+            for row, line in enumerate(csv.reader(fin, delimiter=';')) for col, value in enumerate(line)
+        }
+
+
+def json_values(json_file):
+    with open(json_file) as fin:
+        document = json.load(fin)
+    return {
+        f'seccion {section} fila {row} {name}': value
+        for section, rows in enumerate(document) for row, record in enumerate(rows) for name, value in record.items()
+    }
+
+
+def xml_values(xml_file):
+    root = ElementTree.parse(xml_file).getroot()
+    return {
+        f'seccion {section} fila {row} {name}': value
+        for section, recordset in enumerate(root) for row, record in enumerate(recordset)
+        for name, value in record.attrib.items()
+    }
+
+
+def text_values(text_file):
+    with open(text_file) as fin:
+        return {f'linea {row + 1}': line.rstrip('\n') for row, line in enumerate(fin)}
+
+
+readers = {
+    output_formats.xlsx: xlsx_values,
+    output_formats.csv: csv_values,
+    output_formats.json: json_values,
+    output_formats.xml: xml_values,
+    output_formats.html: text_values,
+}
+
+
+def output_values(output_files, output_format):
+    # valores de todos los ficheros de la salida, la salida xlsx puede dividirse en varios libros
+    values = {}
+    for index, output_file in enumerate(output_files):
+        try:
+            file_values = readers[output_format](output_file)
+        except (ValueError, ElementTree.ParseError):
+            # el documento no se puede interpretar (un texto con comillas en json,...), se compara como texto
+            file_values = text_values(output_file)
+        values.update({f'fichero {index + 1} {location}': value for location, value in file_values.items()})
+    return values
+
+
+def differences(reference, other):
+    # diferencias entre los valores de dos salidas: (posición, valor de la referencia, valor del motor)
+    return [
+        (location, reference.get(location), other.get(location))
+        for location in sorted(reference.keys() | other.keys())
+        if reference.get(location) != other.get(location)
+    ]
+
+
+# histórico de medidas
+
+def load_history(history_file):
+    if not history_file or not pathlib.Path(history_file).exists():
+        return []
+    with open(history_file) as fin:
+        return [json.loads(line) for line in fin if line.strip()]
+
+
+def regressions(history, run, tolerance):
+    # compara la ejecución con las anteriores del histórico con el mismo motor, listado y formato
+    previous = [
+        entry for entry in history
+        if all(entry.get(key) == run[key] for key in ('engine', 'conf', 'spool', 'lines', 'format', 'evaluate'))
+    ][-history_runs:]
+    if not previous:
+        return []
+
+    found = []
+    seconds = statistics.median(entry['seconds'] for entry in previous)
+    if run['seconds'] > seconds * (1 + tolerance) and run['seconds'] - seconds > min_seconds:
+        found.append(f'tiempo {run["seconds"]:.3f} s, mediana del historico {seconds:.3f} s')
+    peaks = [entry['peak_memory'] for entry in previous if entry.get('peak_memory')]
+    if peaks and run['peak_memory']:
+        peak = statistics.median(peaks)
+        if run['peak_memory'] > peak * (1 + tolerance):
+            found.append(
+                f'memoria {run["peak_memory"] / 2 ** 20:.1f} MB, mediana del historico {peak / 2 ** 20:.1f} MB'
+            )
+    return found
+
+
+# listados
+
+def example_spools():
+    # ficheros de configuración de examples con su listado
+    for conf_file in sorted(examples_folder.glob('*/*.conf')):
+        spool_file = conf_file.with_suffix('.txt')
+        if spool_file.exists():
+            yield conf_file, spool_file
+
+
+# listado propio con filas que continúan en varias líneas (keep_in_row): los ejemplos no tienen ninguno
+# la segunda línea de cada fila tiene una fórmula y los pies suman todas las columnas, así que con las fórmulas
+# evaluadas se usan los acumuladores de la sección con filas continuadas
+keep_in_row_conf = '''title Keep in row
+encoding utf-8
+section
+    header
+        fieldset
+            const "Code"
+            const "Customer"
+            const "Units"
+            const "Price"
+            const "Amount"
+    body
+        fieldset
+            include_filters "^A "
+            keep_in_row
+            integer 2 6 as code
+            string 7 20 as customer
+        fieldset
+            include_filters "^B "
+            integer 2 6 as units
+            float 7 15 as price
+            function =<col:-2><row>*<col:-1><row> as amount
+    footer
+        fieldset
+            function =counta(<col><startrow>:<col><row:-1>)
+            const "Total"
+            function =sum(<col><startrow>:<col><row:-1>)
+            function =sum(<col><startrow>:<col><row:-1>)
+            function =sum(<col><startrow>:<col><row:-1>)
+'''
+
+keep_in_row_spool = '''A 1    Peter Parker
+B 10   2.5
+A 2    Hank Pym
+B 3    10.0
+A 3    Peter Parker
+B 7    1.25
+A 4    Tony Stark
+B 1    99.0
+A 5    Peter/Parker
+B 2    4.0
+'''
+
+
+def keep_in_row_spools(folder):
+    # escribe el listado con filas continuadas y su configuración en folder
+    folder.mkdir(parents=True, exist_ok=True)
+    conf_file = folder / 'keep_in_row.conf'
+    spool_file = folder / 'keep_in_row.txt'
+    conf_file.write_text(keep_in_row_conf, encoding='utf-8')
+    spool_file.write_text(keep_in_row_spool, encoding='utf-8')
+    # la salida se divide por un campo de la primera línea de las filas continuadas, con dos valores
+    # (Peter Parker y Peter/Parker) que dan el mismo nombre de fichero
+    partition_fields[conf_file] = 'customer'
+    return [(conf_file, spool_file)]
+
+
+def count_lines(spool_file):
+    with open(spool_file, 'rb') as fin:
+        return sum(chunk.count(b'\n') for chunk in iter(lambda: fin.read(1 << 20), b''))
+
+
+def equivalence(
+        spools, work_folder, engine_names=None, formats=None, evaluate_formulas=False, history_file=None,
+        tolerance=default_tolerance
+):
+    # compara cada motor con la referencia en cada listado (conf_file, spool_file) y formato
+    # devuelve el número de comparaciones con diferencias y el de regresiones
+    engine_names = engine_names or [name for name in engines if name != 'reference']
+    formats = formats or list(output_formats)
+    history = load_history(history_file)
+    new_runs = []
+    failed = regressed = 0
+
+    for conf_file, spool_file in spools:
+        lines = count_lines(spool_file)
+        print(f'\n{conf_file.name} - {spool_file.name} ({lines} lineas)')
+        for output_format in formats:
+            reference_values = None
+            for name in ['reference'] + engine_names:
+                function, engine_formats = engines[name]
+                if engine_formats and output_format not in engine_formats:
+                    continue
+                output_folder = work_folder / spool_file.stem / output_format.name / name
+                measures = run_engine(name, conf_file, spool_file, output_format, output_folder, evaluate_formulas)
+                values = output_values(measures['output_files'], output_format)
+
+                if reference_values is None:
+                    reference_values = values
+                    found = []
+                else:
+                    found = differences(reference_values, values)
+
+                run = {
+                    'time': time.strftime('%Y-%m-%d %H:%M:%S'),
+                    'version': app_version,
+                    'engine': name,
+                    'conf': conf_file.name,
+                    'spool': spool_file.name,
+                    'lines': lines,
+                    'format': output_format.name,
+                    'evaluate': evaluate_formulas,
+                    'seconds': measures['seconds'],
+                    'peak_memory': measures['peak_memory'],
+                    'equal': not found,
+                }
+                slower = regressions(history, run, tolerance)
+                new_runs.append(run)
+
+                status = 'IGUAL' if not found else f'DIFERENTE ({len(found)} diferencias)'
+                if name == 'reference':
+                    status = 'referencia'
+                memory = f'{run["peak_memory"] / 2 ** 20:8.1f} MB' if run['peak_memory'] else f'{"-":>8} MB'
+                print(f'  {output_format.name:<5} {name:<12} {run["seconds"]:8.3f} s {memory}  {status}')
+                for location, expected, value in found[:max_differences]:
+                    print(f'        {location}: {expected!r} != {value!r}')
+                for message in slower:
+                    print(f'        REGRESION: {message}')
+                failed += bool(found)
+                regressed += bool(slower)
+
+            if output_format == output_formats.xlsx:
+                found = formula_differences(conf_file, spool_file)
+                status = 'IGUAL' if not found else f'DIFERENTE ({len(found)} diferencias)'
+                print(f'  {output_format.name:<5} {"formulas":<12} {"":>10} {"":>11}  {status}')
+                for location, expected, value in found[:max_differences]:
+                    print(f'        {location}: {expected!r} != {value!r}')
+                failed += bool(found)
+
+            if output_format == output_formats.csv:
+                found = aggregate_differences(conf_file, spool_file)
+                status = 'IGUAL' if not found else f'DIFERENTE ({len(found)} diferencias)'
+                print(f'  {output_format.name:<5} {"aggregates":<12} {"":>10} {"":>11}  {status}')
+                for location, expected, value in found[:max_differences]:
+                    print(f'        {location}: {expected!r} != {value!r}')
+                failed += bool(found)
+
+                found = partition_differences(conf_file, spool_file, work_folder / spool_file.stem / 'partition')
+                status = 'IGUAL' if not found else f'DIFERENTE ({len(found)} diferencias)'
+                print(f'  {output_format.name:<5} {"partition":<12} {"":>10} {"":>11}  {status}')
+                for location, expected, value in found[:max_differences]:
+                    print(f'        {location}: {expected!r} != {value!r}')
+                failed += bool(found)
+
+    if history_file:
+        with open(history_file, 'a') as fout:
+            for run in new_runs:
+                fout.write(json.dumps(run) + '\n')
+
+    return failed, regressed
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Comprueba que los distintos motores de redaxtor.py generan la misma salida que la referencia'
+    )
+    parser.add_argument(
+        '-c', '--conf-files', nargs='+', type=pathlib.Path,
+        help='Ficheros de configuracion. Por defecto los de examples, con su listado .txt'
+    )
+    parser.add_argument(
+        '-sf', '--spool-files', nargs='+', type=pathlib.Path,
+        help='Listado de cada fichero de configuracion de --conf-files. Por defecto solo se usan listados generados'
+    )
+    parser.add_argument(
+        '-n', '--generated-lines', type=int, default=default_generated_lines,
+        help=f'Lineas de los listados generados para cada fichero de configuracion, 0 para no generarlos. '
+             f'Por defecto: {default_generated_lines}'
+    )
+    parser.add_argument('-sd', '--seed', type=int, default=0, help='Semilla de los listados generados')
+    parser.add_argument(
+        '-en', '--engines', nargs='+', choices=[name for name in engines if name != 'reference'],
+        help='Motores que se comparan con la referencia. Por defecto todos'
+    )
+    parser.add_argument(
+        '-f', '--formats', nargs='+', choices=[f.name for f in output_formats],
+        help='Formatos de salida. Por defecto todos'
+    )
+    parser.add_argument('-e', '--evaluate-formulas', action='store_true', help='Calcula el valor de las formulas')
+    parser.add_argument(
+        '-hf', '--history-file', default=default_history_file,
+        help=f'Fichero de historico de las medidas, "" para no usarlo. Por defecto: {default_history_file}'
+    )
+    parser.add_argument(
+        '-to', '--tolerance', type=float, default=default_tolerance,
+        help=f'Aumento de tiempo o memoria respecto al historico que se considera una regresion. '
+             f'Por defecto: {default_tolerance}'
+    )
+    parser.add_argument('-k', '--keep-folder', type=pathlib.Path, help='Carpeta donde se guardan las salidas')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    cli_args = parse_args()
+
+    if cli_args.conf_files:
+        conf_files = [conf_file.absolute() for conf_file in cli_args.conf_files]
+        if cli_args.spool_files and len(cli_args.spool_files) != len(conf_files):
+            sys.exit('Tiene que haber un listado por cada fichero de configuracion')
+        spools = list(zip(conf_files, [spool.absolute() for spool in cli_args.spool_files or []]))
+    else:
+        spools = list(example_spools())
+
+    with tempfile.TemporaryDirectory() as temporary_folder:
+        folder = cli_args.keep_folder.absolute() if cli_args.keep_folder else pathlib.Path(temporary_folder)
+
+        if not cli_args.conf_files:
+            spools.extend(keep_in_row_spools(folder / 'keep_in_row'))
+            conf_files = [conf_file for conf_file, _ in spools]
+
+        if cli_args.generated_lines:
+            generated_folder = folder / 'generated'
+            generated_folder.mkdir(parents=True, exist_ok=True)
+            for conf_file in conf_files:
+                spool_file = generated_folder / f'{conf_file.stem}_{cli_args.generated_lines}.txt'
+                SpoolGenerator(Report(conf_file), cli_args.seed).write(spool_file, cli_args.generated_lines)
+                spools.append((conf_file, spool_file))
+
+        different, slower = equivalence(
+            spools, folder, cli_args.engines,
+            [output_formats[name] for name in cli_args.formats] if cli_args.formats else None,
+            cli_args.evaluate_formulas, cli_args.history_file, cli_args.tolerance
+        )
+
+    print(f'\nComparaciones con diferencias: {different}, regresiones: {slower}')
+    if different or slower:
+        sys.exit(1)
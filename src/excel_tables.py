@@ -0,0 +1,159 @@
+# secciones del listado como tablas de Excel
+#
+# una sección con encabezado se puede escribir como una tabla de Excel (add_table de xlsxwriter):
+# - la última fila del encabezado son los nombres de las columnas de la tabla
+# - las filas del cuerpo son los datos de la tabla
+# - los campos function del cuerpo cuyas referencias son todas a celdas de la misma fila se convierten en una
+#   columna calculada con referencias estructuradas: =<col:-2><row>/<col:-3><row> -> =[@[Taxes]]/[@[Amount]]
+# - la primera fila del pie, si está justo debajo del cuerpo, es la fila de totales de la tabla. Las fórmulas
+#   SUM, COUNTA, AVERAGE, MIN y MAX de toda la columna se convierten en funciones de totales (SUBTOTAL)
+#
+# si la sección no se puede representar como tabla (no hay encabezado, los nombres de las columnas no son
+# textos únicos, las filas no son consecutivas,...) se escribe celda a celda como hasta ahora
+
+import re
+
+from commons import field_style
+from formula_evaluator import same_row_references
+
+
+# fórmulas del pie que se convierten en funciones de la fila de totales
+total_regexp = re.compile(
+    r'^=(?P<function>sum|counta|average|min|max)\('
+    r'\$?(?P<first_col>[A-Z]{1,3})\$?(?P<first_row>\d+):\$?(?P<last_col>[A-Z]{1,3})\$?(?P<last_row>\d+)\)$',
+    re.IGNORECASE
+)
+
+# función de la fila de totales de xlsxwriter y número de la función SUBTOTAL de Excel
+total_functions = {
+    'sum': ('sum', 109),
+    'counta': ('count', 103),
+    'average': ('average', 101),
+    'min': ('min', 105),
+    'max': ('max', 104),
+}
+
+
+# escapa los caracteres especiales de los nombres de columna en las referencias estructuradas
+def escape_column_name(name):
+    return re.sub(r"(['#\[\]])", r"'\1", name)
+
+
+# convierte una fórmula del cuerpo en la fórmula de una columna calculada
+# devuelve None si la fórmula hace referencia a otras filas o a celdas fuera de la tabla
+def structured_formula(formula, col, names):
+    references = same_row_references(formula)
+    if not references:
+        return None
+
+    result = []
+    position = 0
+    for start, end, col_offset in references:
+        ref_col = col + col_offset
+        if col_offset == 0 or not 0 <= ref_col < len(names):
+            return None
+        # [#This Row] es la forma que se guarda en el fichero de las referencias [@columna] de Excel 2010
+        result.append(f'{formula[position:start]}[[#This Row],[{escape_column_name(names[ref_col])}]]')
+        position = end
+    result.append(formula[position:])
+    return ''.join(result)
+
+
+class ExcelTable:
+    # Disposición de una sección como tabla de Excel: rango, opciones de add_table y las fórmulas
+    # que sustituyen a las de las celdas (columnas calculadas y fila de totales)
+
+    def __init__(self, first_row, last_row, last_col, options, formulas):
+        self.first_row = first_row
+        self.last_row = last_row
+        self.last_col = last_col
+        self.options = options
+        self.formulas = formulas  # (fila, columna) -> fórmula
+
+    @classmethod
+    def from_cell_group(cls, cell_group, styles):
+        # devuelve la tabla correspondiente a la sección o None si no se puede representar como tabla
+        lines = cell_group.lines
+        header_lines = [line for line in lines if line.is_header]
+        body = [line for line in lines if line.is_body]
+        if not header_lines or not body:
+            return None
+
+        header = header_lines[-1]
+        names = [cell.value for cell in header]
+        if not all(isinstance(name, str) and name.strip() for name in names):
+            return None
+        # Excel exige nombres de columna únicos sin distinguir mayúsculas
+        if len({name.lower() for name in names}) != len(names):
+            return None
+
+        first_row = header.cells[0].row
+        last_row = first_row + len(body)
+        # las filas del cuerpo tienen que estar justo debajo del encabezado y no tener más columnas que él
+        if [line.cells[0].row for line in body] != list(range(first_row + 1, last_row + 1)):
+            return None
+        if any(len(line) > len(names) for line in body):
+            return None
+
+        formulas = {}
+        columns = []
+        for col, name in enumerate(names):
+            column = {'header': name, 'header_format': field_style(styles, header.cells[col].field)}
+            # la columna es calculada si todas las filas tienen en ella el mismo campo function
+            fields = {line.cells[col].field if col < len(line) else None for line in body}
+            field = fields.pop() if len(fields) == 1 else None
+            if field is not None:
+                column['format'] = field_style(styles, field)
+                if field.is_calculated:
+                    formula = structured_formula(field.value, col, names)
+                    if formula:
+                        column['formula'] = formula
+                        for line in body:
+                            formulas[(line.cells[col].row, col)] = formula
+            columns.append(column)
+
+        options = {'columns': columns, 'style': None}
+
+        footer = next((line for line in lines if line.is_footer), None)
+        if footer is not None and footer.cells[0].row == last_row + 1 and len(footer) <= len(names):
+            totals = cls._totals(footer, first_row + 2, last_row + 1, names)
+            if totals is not None:
+                for col, (total, formula) in enumerate(totals):
+                    columns[col].update(total)
+                    if formula:
+                        formulas[(last_row + 1, col)] = formula
+                options['total_row'] = True
+                last_row += 1
+
+        return cls(first_row, last_row, len(names) - 1, options, formulas)
+
+    @staticmethod
+    def _totals(footer, first_excel_row, last_excel_row, names):
+        # opciones de la fila de totales para cada columna y la fórmula de la celda
+        # devuelve None si alguna celda del pie no se puede poner en la fila de totales
+        totals = [({}, None)] * len(names)
+        for cell in footer:
+            value = cell.value
+            if value is None:
+                continue
+            if cell.field.is_calculated and isinstance(value, str) and value.startswith('='):
+                match = total_regexp.match(value)
+                if match and match.group('first_col').upper() == match.group('last_col').upper() == cell.excel_col \
+                        and int(match.group('first_row')) == first_excel_row \
+                        and int(match.group('last_row')) == last_excel_row:
+                    # función de toda la columna: función de totales de la tabla
+                    function, subtotal = total_functions[match.group('function').lower()]
+                    formula = f'=SUBTOTAL({subtotal},[{escape_column_name(names[cell.col])}])'
+                    total = {'total_function': function}
+                else:
+                    # cualquier otra fórmula se mantiene como fórmula personalizada de la fila de totales
+                    formula = value
+                    total = {'total_function': value}
+                if cell.computed is not None:
+                    total['total_value'] = cell.computed
+                totals[cell.col] = (total, formula)
+            elif isinstance(value, str):
+                totals[cell.col] = ({'total_string': value}, None)
+            else:
+                return None
+        return totals
@@ -0,0 +1,185 @@
+# modo seguimiento (opción --follow) de los listados a los que se van añadiendo líneas durante el día
+#
+# en vez de volver a procesar el listado entero en cada ejecución, se guarda junto a la salida csv un checkpoint
+# (<salida>.csv.checkpoint, en JSON) con la posición en bytes del listado, el número de línea, la última línea,
+# el tamaño de la salida y el estado del proceso: sección abierta, índice de fila, fila sin terminar (keep_in_row)
+# y secciones ya procesadas (ver Report.follow_state). La siguiente ejecución continúa desde esa posición
+# y añade a la salida solo las filas nuevas
+#
+# el checkpoint se guarda cada batch_lines líneas y al terminar, después de escribir y sincronizar la salida
+# si el proceso se interrumpe, la siguiente ejecución recorta la salida al tamaño guardado y repite
+# solo las líneas procesadas desde el último checkpoint, sin duplicar filas
+#
+# solo se leen líneas (o registros de record_length) completas: la última línea, si se está escribiendo todavía,
+# se procesa en la siguiente ejecución. Los pies de la última sección no se escriben mientras el listado
+# puede continuarla, se escriben cuando empieza otra sección o cuando el listado se rota o se trunca
+# (otro fichero con el mismo nombre o más pequeño que la posición guardada): entonces se cierra la sección abierta
+# y se procesa el nuevo listado desde el principio, añadiendo sus filas a la misma salida
+# si cambia el fichero de configuración (o la versión de la aplicación) se vuelve a generar la salida entera
+
+import json
+import locale
+import os
+import pathlib
+
+from commons import compression, input_buffer_size
+from logger import get_logger
+
+
+logger = get_logger()
+
+# versión del formato del checkpoint, los de otra versión se descartan
+checkpoint_version = 1
+
+# extensión del checkpoint, se añade al nombre de la salida
+checkpoint_extension = '.checkpoint'
+
+# cada cuántas líneas se guarda el checkpoint
+default_batch_lines = 10000
+
+
+class FollowException(Exception):
+    pass
+
+
+class Checkpoint:
+    # Posición en el listado y estado del proceso de la ejecución anterior, y salida a la que se añaden las filas
+    # format_row convierte una fila (Row) en su línea de la salida
+
+    def __init__(self, spool_file, output_file, conf_hash, format_row, batch_lines=default_batch_lines):
+        self.spool_file = pathlib.Path(spool_file)
+        self.output_file = pathlib.Path(output_file)
+        self.file = self.output_file.with_name(self.output_file.name + checkpoint_extension)
+        self.conf_hash = conf_hash
+        self.format_row = format_row
+        self.batch_lines = batch_lines
+
+        # posición en bytes y número de la siguiente línea a procesar, y la última línea procesada
+        self.offset = 0
+        self.line = 0
+        self.last_line = ''
+        # el listado se ha rotado o truncado desde la ejecución anterior
+        self.rotated = False
+        # sección y fila de la sección a partir de las que quedan filas por escribir (ver Report.follow_rows)
+        self.written = (0, 0)
+        self._identity = None
+        self._output = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if self._output:
+            self._output.close()
+            self._output = None
+
+    def _load(self):
+        # checkpoint de la ejecución anterior, None si no existe o no sirve
+        try:
+            with open(self.file, encoding='utf-8') as fin:
+                data = json.load(fin)
+        except FileNotFoundError:
+            return None
+        except (OSError, ValueError) as e:
+            logger.warning(f'No se ha podido leer el checkpoint {self.file}, se procesa el listado completo: {e}')
+            return None
+        if data.get('version') != checkpoint_version:
+            logger.warning(f'El checkpoint {self.file} es de otra version, se procesa el listado completo')
+            return None
+        if data.get('conf') != self.conf_hash:
+            logger.warning(f'La configuracion ha cambiado desde el checkpoint {self.file}, '
+                           f'se procesa el listado completo')
+            return None
+        try:
+            if os.path.getsize(self.output_file) < data['output_size']:
+                logger.warning(f'La salida {self.output_file} es menor que en el checkpoint, '
+                               f'se procesa el listado completo')
+                return None
+        except OSError:
+            logger.warning(f'No existe la salida {self.output_file}, se procesa el listado completo')
+            return None
+        return data
+
+    def start(self):
+        # prepara la salida y devuelve el estado del proceso guardado (None si se empieza desde el principio)
+        # la salida se recorta al tamaño que tenía al guardar el checkpoint
+        with open(self.spool_file, 'rb') as fin:
+            if compression(fin.peek(8)[:8]):
+                raise FollowException(f'El fichero {self.spool_file} esta comprimido, no se puede seguir con --follow')
+            stat = os.fstat(fin.fileno())
+        self._identity = [stat.st_dev, stat.st_ino]
+
+        data = self._load()
+        if data is None:
+            self._output = open(self.output_file, 'w')
+            return None
+
+        os.truncate(self.output_file, data['output_size'])
+        self._output = open(self.output_file, 'a')
+
+        if data['identity'] != self._identity or stat.st_size < data['offset']:
+            # la sección abierta del listado anterior se cierra con su última línea
+            logger.warning(f'El fichero {self.spool_file} se ha rotado o truncado, se procesa desde el principio')
+            self.rotated = True
+            self.last_line = data['last_line']
+        else:
+            self.offset = data['offset']
+            self.line = data['line']
+            self.last_line = data['last_line']
+        logger.info(f'Se continua el fichero {self.spool_file} desde la linea {self.line + 1} (byte {self.offset})')
+        return data['state']
+
+    def lines(self, record_length=None, encoding=None, on_open=None):
+        # líneas (o registros) completas del listado a partir de la posición guardada
+        # la posición avanza cuando se pide la línea siguiente, es decir, cuando se ha procesado la actual
+        encoding = encoding or locale.getpreferredencoding(False)
+        with open(self.spool_file, 'rb', buffering=input_buffer_size) as raw:
+            if on_open:
+                on_open(raw)
+            raw.seek(self.offset)
+            if record_length:
+                while True:
+                    record = raw.read(record_length)
+                    if len(record) < record_length:
+                        break
+                    line = record.decode(encoding)
+                    yield line
+                    self.offset += record_length
+                    self.line += 1
+                    self.last_line = line
+            else:
+                for raw_line in raw:
+                    if not raw_line.endswith(b'\n'):
+                        break
+                    line = raw_line.decode(encoding)
+                    if line.endswith('\r\n'):
+                        # igual que al leer el listado en modo texto
+                        line = line[:-2] + '\n'
+                    yield line
+                    self.offset += len(raw_line)
+                    self.line += 1
+                    self.last_line = line
+
+    def save(self, rows, state, written):
+        # añade las filas a la salida y guarda el checkpoint, siempre después de que la salida esté en disco
+        for row in rows:
+            self._output.write(self.format_row(row))
+        self._output.flush()
+        os.fsync(self._output.fileno())
+        self.written = written
+
+        data = {
+            'version': checkpoint_version,
+            'spool_file': str(self.spool_file),
+            'conf': self.conf_hash,
+            'identity': self._identity,
+            'offset': self.offset,
+            'line': self.line,
+            'last_line': self.last_line,
+            'output_size': os.fstat(self._output.fileno()).st_size,
+            'state': state,
+        }
+        temporary_file = self.file.with_name(f'.{self.file.name}.tmp')
+        with open(temporary_file, 'w', encoding='utf-8') as fout:
+            json.dump(data, fout, ensure_ascii=False)
+        os.replace(temporary_file, self.file)
@@ -0,0 +1,423 @@
+# evaluador de fórmulas de excel
+#
+# calcula el valor de las fórmulas de los campos function para que los consumidores que no son Excel
+# (csv, json, xml, html) vean los resultados y para guardarlos como valor en caché de las fórmulas del xlsx
+#
+# solo se evalúa un subconjunto de las fórmulas que acepta excel_parser, las que hacen referencia a celdas
+# de la propia hoja:
+#     números, celdas (A1, $A$1, <col:-1><row>,...), rangos (A1:B5), paréntesis
+#     operadores + - * / y - unario
+#     funciones SUM, COUNTA, AVERAGE, MEDIAN, MIN y MAX
+# las fórmulas con otras funciones, cadenas, nombres de rango o referencias a otras hojas o libros no se evalúan
+# y se escriben igual que hasta ahora, solo como fórmula
+#
+# como en Excel, los números se tratan como reales de doble precisión y los resultados se redondean a 15 cifras
+# significativas, las celdas vacías valen 0 en las operaciones y las funciones ignoran el texto de los rangos
+
+import re
+
+from functools import lru_cache
+from datetime import date
+
+from aggregates import RunningAggregate, numeric_types, excel_serial
+
+
+# excepción personalizada para las fórmulas que no se pueden evaluar
+class FormulaException(Exception):
+    pass
+
+
+# la fórmula depende de celdas que todavía no se han procesado, se evaluará más tarde
+class DeferredFormula(Exception):
+    pass
+
+
+# elementos de las fórmulas
+# las referencias relativas llegan como marcadores <COL:n> y <ROW:n>, se resuelven con la celda que contiene la fórmula
+token_regexp = re.compile(r'''\s*(?:
+    (?P<function>[A-Za-z_][A-Za-z0-9_.]*)\s*\(
+    |(?P<cell>(?P<col_abs>\$)?(?:<COL:(?P<col_offset>-?\d+)>|(?P<col_name>[A-Za-z]{1,3}))
+              (?P<row_abs>\$)?(?:<ROW:(?P<row_offset>-?\d+)>|(?P<row_number>\d+)))
+    |(?P<number>\d+(?:\.\d+)?)
+    |(?P<operator>[-+*/(),:])
+)''', re.VERBOSE)
+
+
+# convierte un valor de celda en un número para las operaciones aritméticas
+def to_float(value):
+    if value is None or value == '':
+        # las celdas vacías valen 0
+        return 0.0
+    if isinstance(value, numeric_types) and not isinstance(value, bool):
+        return float(value)
+    if isinstance(value, date):
+        # las fechas son números para Excel
+        return excel_serial(value)
+    raise FormulaException(f'El valor {value!r} no es numerico')
+
+
+# resultado de una fórmula con la precisión de Excel (15 cifras significativas)
+# los resultados enteros se devuelven como int para que se muestren sin decimales en los formatos de texto
+def to_result(value):
+    value = float(f'{value:.15g}')
+    return int(value) if value.is_integer() else value
+
+
+# índice de columna (empezando en 0) a partir de su nombre: A, B,..., Z, AA,...
+def name_to_col(name):
+    col = 0
+    for char in name.upper():
+        col = col * 26 + ord(char) - ord('A') + 1
+    return col - 1
+
+
+# funciones de Excel evaluables
+# reciben un RunningAggregate con los valores de sus argumentos
+def _sum(aggregate):
+    return aggregate.total
+
+
+def _counta(aggregate):
+    return aggregate.non_empty
+
+
+def _average(aggregate):
+    if not aggregate.count:
+        raise FormulaException('AVERAGE sin valores numericos (#DIV/0!)')
+    return aggregate.total / aggregate.count
+
+
+def _median(aggregate):
+    if not aggregate.count:
+        raise FormulaException('MEDIAN sin valores numericos (#NUM!)')
+    return aggregate.median()
+
+
+def _min(aggregate):
+    return aggregate.minimum if aggregate.count else 0
+
+
+def _max(aggregate):
+    return aggregate.maximum if aggregate.count else 0
+
+
+functions = {
+    'SUM': _sum,
+    'COUNTA': _counta,
+    'AVERAGE': _average,
+    'MEDIAN': _median,
+    'MIN': _min,
+    'MAX': _max,
+}
+
+
+class _Parser:
+    # analizador descendente recursivo para el subconjunto de fórmulas evaluables
+    # cada nodo se compila a una función node(context, row, col) donde row y col son
+    # la fila y la columna (empezando en 0) de la celda que contiene la fórmula
+
+    def __init__(self, formula):
+        self.tokens = []
+        position = 0
+        formula = formula.rstrip()
+        while position < len(formula):
+            match = token_regexp.match(formula, position)
+            if not match:
+                raise FormulaException(f'No se puede evaluar la formula "{formula}" a partir de "{formula[position:]}"')
+            self.tokens.append(match)
+            position = match.end()
+        self.index = 0
+
+    def _peek(self):
+        return self.tokens[self.index] if self.index < len(self.tokens) else None
+
+    def _next(self):
+        token = self._peek()
+        if token is None:
+            raise FormulaException('Fin inesperado de la formula')
+        self.index += 1
+        return token
+
+    def _is_operator(self, *operators):
+        token = self._peek()
+        return token is not None and token.group('operator') in operators
+
+    def _expect(self, operator):
+        if not self._is_operator(operator):
+            raise FormulaException(f'Se esperaba "{operator}"')
+        self.index += 1
+
+    def parse(self):
+        node = self.expression()
+        if self._peek() is not None:
+            raise FormulaException(f'Elemento inesperado "{self._peek().group().strip()}"')
+        return node
+
+    def expression(self):
+        # expression := term (('+' | '-') term)*
+        node = self.term()
+        while self._is_operator('+', '-'):
+            operator = self._next().group('operator')
+            node = self._binary(operator, node, self.term())
+        return node
+
+    def term(self):
+        # term := unary (('*' | '/') unary)*
+        node = self.unary()
+        while self._is_operator('*', '/'):
+            operator = self._next().group('operator')
+            node = self._binary(operator, node, self.unary())
+        return node
+
+    def unary(self):
+        # unary := ('-' | '+') unary | primary
+        if self._is_operator('-'):
+            self._next()
+            operand = self.unary()
+            return lambda context, row, col: -operand(context, row, col)
+        if self._is_operator('+'):
+            self._next()
+            return self.unary()
+        return self.primary()
+
+    def primary(self):
+        # primary := number | cell | function '(' arguments ')' | '(' expression ')'
+        token = self._next()
+        if token.group('number'):
+            number = float(token.group('number'))
+            return lambda context, row, col: number
+        if token.group('cell'):
+            if self._is_operator(':'):
+                raise FormulaException('Los rangos solo se pueden usar como argumentos de funciones')
+            position = self._reference(token)
+            return lambda context, row, col: to_float(context.value(*position(row, col)))
+        if token.group('function'):
+            return self._function(token.group('function'))
+        if token.group('operator') == '(':
+            node = self.expression()
+            self._expect(')')
+            return node
+        raise FormulaException(f'Elemento inesperado "{token.group().strip()}"')
+
+    @staticmethod
+    def _binary(operator, left, right):
+        if operator == '+':
+            return lambda context, row, col: left(context, row, col) + right(context, row, col)
+        if operator == '-':
+            return lambda context, row, col: left(context, row, col) - right(context, row, col)
+        if operator == '*':
+            return lambda context, row, col: left(context, row, col) * right(context, row, col)
+
+        def divide(context, row, col):
+            divisor = right(context, row, col)
+            if not divisor:
+                raise FormulaException('Division por cero (#DIV/0!)')
+            return left(context, row, col) / divisor
+
+        return divide
+
+    @staticmethod
+    def _reference(token):
+        # devuelve una función que calcula la fila y la columna de la celda referenciada
+        if token.group('col_offset') is not None:
+            col_offset = int(token.group('col_offset'))
+            col_position = lambda col: col + col_offset
+        else:
+            col_index = name_to_col(token.group('col_name'))
+            col_position = lambda col: col_index
+
+        if token.group('row_offset') is not None:
+            row_offset = int(token.group('row_offset'))
+            row_position = lambda row: row + row_offset
+        else:
+            # las filas de excel empiezan en 1
+            row_index = int(token.group('row_number')) - 1
+            row_position = lambda row: row_index
+
+        return lambda row, col: (row_position(row), col_position(col))
+
+    def _function(self, name):
+        function = functions.get(name.upper())
+        if function is None:
+            raise FormulaException(f'La funcion {name} no se puede evaluar')
+
+        arguments = []
+        while True:
+            arguments.append(self._argument())
+            if self._is_operator(','):
+                self._next()
+                continue
+            self._expect(')')
+            break
+
+        if len(arguments) == 1 and arguments[0][0]:
+            # un único rango: se intenta usar los acumuladores de las secciones en lugar de recorrerlo
+            cell_range = arguments[0][1]
+            exact_only = function is _median
+
+            def node(context, row, col):
+                aggregate = context.aggregate(*cell_range.bounds(row, col))
+                if aggregate is None or (exact_only and not aggregate.is_exact):
+                    aggregate = RunningAggregate(sketch_capacity=None)
+                    for value in cell_range(context, row, col):
+                        aggregate.add(value)
+                return function(aggregate)
+
+            return node
+
+        def node(context, row, col):
+            # acumulador sin límite de capacidad para que la mediana sea exacta
+            aggregate = RunningAggregate(sketch_capacity=None)
+            for is_range, argument in arguments:
+                if is_range:
+                    # en los rangos se ignoran el texto y las celdas vacías
+                    for value in argument(context, row, col):
+                        aggregate.add(value)
+                else:
+                    aggregate.add_number(argument(context, row, col))
+            return function(aggregate)
+
+        return node
+
+    def _argument(self):
+        # argument := cell ':' cell | expression
+        # devuelve (es_rango, nodo)
+        token = self._peek()
+        if token is not None and token.group('cell') and self.index + 2 < len(self.tokens) \
+                and self.tokens[self.index + 1].group('operator') == ':':
+            first = self._reference(self._next())
+            self._next()
+            last_token = self._next()
+            if not last_token.group('cell'):
+                raise FormulaException('Rango incorrecto')
+            last = self._reference(last_token)
+
+            def bounds(row, col):
+                # filas y columnas primera y última del rango
+                first_row, first_col = first(row, col)
+                last_row, last_col = last(row, col)
+                return min(first_row, last_row), min(first_col, last_col), \
+                    max(first_row, last_row), max(first_col, last_col)
+
+            def cell_range(context, row, col):
+                first_row, first_col, last_row, last_col = bounds(row, col)
+                for range_row in range(first_row, last_row + 1):
+                    for range_col in range(first_col, last_col + 1):
+                        yield context.value(range_row, range_col)
+
+            cell_range.bounds = bounds
+            return True, cell_range
+        return False, self.expression()
+
+
+# devuelve las referencias de una fórmula (con los marcadores de fila y columna relativas) si todas son
+# a celdas de la misma fila con columna relativa: [(inicio, fin, desplazamiento de columna), ...]
+# devuelve None si alguna referencia es absoluta, a otra fila o a un rango, o si la fórmula no se puede analizar
+def same_row_references(formula):
+    if not formula.startswith('='):
+        return None
+    references = []
+    position = 1
+    formula = formula.rstrip()
+    while position < len(formula):
+        match = token_regexp.match(formula, position)
+        if not match or match.group('operator') == ':':
+            return None
+        if match.group('cell'):
+            if match.group('col_abs') or match.group('row_abs') or match.group('col_offset') is None \
+                    or match.group('row_offset') is None or int(match.group('row_offset')) != 0:
+                return None
+            references.append((match.start('cell'), match.end('cell'), int(match.group('col_offset'))))
+        position = match.end()
+    return references
+
+
+# compila una fórmula (con los marcadores de fila y columna relativas) en una función evaluable
+# las fórmulas de los campos del body son iguales en todas las filas, así que se compilan una sola vez
+@lru_cache(maxsize=4096)
+def compile_formula(formula):
+    if not formula.startswith('='):
+        raise FormulaException(f'"{formula}" no es una formula')
+    return _Parser(formula[1:]).parse()
+
+
+class Evaluator:
+    # Evalúa las fórmulas de las celdas a medida que se procesa el listado
+    # Guarda las celdas procesadas indexadas por su posición para resolver las referencias
+    # Las fórmulas que dependen de celdas que todavía no existen (filas posteriores o celdas a la derecha
+    # en la fila en curso) se aplazan y se evalúan al terminar de procesar el listado
+    # Los rangos que cubren columnas completas del cuerpo de una sección se resuelven con los acumuladores
+    # de la sección (CellGroup) sin recorrer sus celdas
+
+    def __init__(self):
+        self.cells = {}  # (fila, columna) -> celda
+        self.pending = []  # celdas con fórmulas aplazadas
+        self._in_progress = set()  # celdas que se están evaluando, para detectar referencias circulares
+        self._open_row = 0  # primera fila que todavía puede recibir celdas
+        self._final = False  # se ha terminado de procesar el listado
+        self.groups = {}  # primera fila del cuerpo -> sección (CellGroup) con los acumuladores de sus columnas
+
+    def add_row(self, row_index, cells):
+        # registra las celdas de una fila y evalúa sus fórmulas
+        self._open_row = row_index
+        for cell in cells:
+            self.cells[(cell.row, cell.col)] = cell
+        for cell in cells:
+            if cell.field.is_calculated and not cell.evaluated:
+                try:
+                    self.evaluate(cell)
+                except DeferredFormula:
+                    self.pending.append(cell)
+
+    def add_group(self, cell_group):
+        # registra una sección cuyo cuerpo tiene acumuladores por columna
+        self.groups[cell_group.first_body_row] = cell_group
+
+    def aggregate(self, first_row, first_col, last_row, last_col):
+        # acumulador de los valores del rango, si el rango cubre exactamente el cuerpo de una sección
+        # devuelve None si hay que recorrer las celdas del rango
+        cell_group = self.groups.get(first_row)
+        if cell_group is None or not (self._final or last_row < self._open_row):
+            # la última fila del rango todavía puede recibir celdas
+            return None
+        return cell_group.range_aggregate(first_row, first_col, last_row, last_col)
+
+    def finish(self):
+        # evalúa las fórmulas aplazadas, las celdas que no existen ya se consideran vacías
+        self._final = True
+        for cell in self.pending:
+            if not cell.evaluated:
+                self.evaluate(cell)
+        self.pending = []
+
+    def value(self, row, col):
+        # valor de la celda en la posición indicada
+        cell = self.cells.get((row, col))
+        if cell is None:
+            if not self._final and row >= self._open_row:
+                raise DeferredFormula
+            return None
+        if cell.field.is_calculated:
+            if not cell.evaluated:
+                self.evaluate(cell)
+            if cell.computed is None:
+                raise FormulaException(f'La celda {cell.excel_cell} no se ha podido evaluar')
+            return cell.computed
+        return cell.value
+
+    def evaluate(self, cell):
+        # calcula el valor de la fórmula de la celda y lo guarda en cell.computed
+        # si no se puede evaluar, cell.computed queda como None
+        if id(cell) in self._in_progress:
+            raise FormulaException(f'Referencia circular en la celda {cell.excel_cell}')
+
+        self._in_progress.add(id(cell))
+        try:
+            cell.computed = to_result(compile_formula(cell.original_value)(self, cell.row, cell.col))
+        except FormulaException:
+            cell.computed = None
+        finally:
+            self._in_progress.discard(id(cell))
+
+        cell.evaluated = True
+        return cell.computed
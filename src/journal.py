@@ -0,0 +1,104 @@
+# diario de los lotes de ficheros (opciones --journal y --resume) para poder continuar un lote interrumpido
+#
+# por cada fichero de entrada terminado se añade al diario una línea JSON con el fichero, su tamaño y fecha de
+# modificación, los ficheros de salida generados y el error si ha fallado. Cada línea se escribe de una vez y se
+# sincroniza con el disco antes de seguir con el siguiente fichero: si el proceso muere, el diario tiene todos los
+# ficheros terminados y como mucho una última línea incompleta, que se ignora al leerlo
+# con --resume se saltan los ficheros que el diario da por terminados sin error, si no han cambiado desde
+# entonces y sus salidas siguen existiendo; los que fallaron se vuelven a procesar
+
+import json
+import os
+import pathlib
+
+from logger import get_logger
+
+
+logger = get_logger()
+
+
+def input_stamp(input_file):
+    # tamaño y fecha de modificación del fichero de entrada, para saber si ha cambiado desde que se procesó
+    stat = os.stat(input_file)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class Journal:
+    # Diario de los ficheros terminados de un lote
+    # con resume se leen los ficheros terminados en la ejecución anterior y se sigue añadiendo al diario,
+    # si no se empieza un diario nuevo
+
+    def __init__(self, journal_file, resume=False):
+        self.journal_file = pathlib.Path(journal_file)
+        self.completed = {}  # fichero de entrada -> entrada del diario
+        self.skipped = 0
+
+        # con resume, si el diario termina con una línea incompleta se cierra antes de añadir nada
+        incomplete = False
+        if resume:
+            try:
+                with open(self.journal_file, encoding='utf-8') as fin:
+                    for line in fin:
+                        incomplete = not line.endswith('\n')
+                        try:
+                            entry = json.loads(line)
+                        except ValueError:
+                            # línea incompleta, el proceso murió mientras se escribía
+                            continue
+                        if entry.get('error'):
+                            self.completed.pop(entry['file'], None)
+                        else:
+                            self.completed[entry['file']] = entry
+            except FileNotFoundError:
+                logger.warning(f'No existe el diario {self.journal_file}, se procesan todos los ficheros')
+
+        self._journal = open(self.journal_file, 'a' if resume else 'w', encoding='utf-8')
+        if incomplete:
+            self._journal.write('\n')
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._journal:
+            self._journal.close()
+            self._journal = None
+
+    @staticmethod
+    def _key(input_file):
+        return str(pathlib.Path(input_file).absolute())
+
+    def done(self, input_file):
+        # salidas del fichero si ya se procesó sin error y sigue igual, si no None
+        entry = self.completed.get(self._key(input_file))
+        if entry is None:
+            return None
+        try:
+            if input_stamp(input_file) != entry['stamp']:
+                return None
+        except OSError:
+            return None
+        outputs = [pathlib.Path(output_file) for output_file in entry['outputs']]
+        if not all(output.exists() for output in outputs):
+            return None
+        self.skipped += 1
+        return outputs
+
+    def record(self, input_file, output_files=(), error=None):
+        # añade el fichero terminado al diario, con una sola escritura sincronizada con el disco
+        try:
+            stamp = input_stamp(input_file)
+        except OSError:
+            stamp = None
+        entry = {
+            'file': self._key(input_file),
+            'stamp': stamp,
+            'outputs': [str(pathlib.Path(output_file).absolute()) for output_file in output_files],
+            'error': error,
+        }
+        self._journal.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        self._journal.flush()
+        os.fsync(self._journal.fileno())
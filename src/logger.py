@@ -1,15 +1,23 @@
+import atexit
+import json
 import logging
-from logging.handlers import TimedRotatingFileHandler
+import queue
+import sys
+import time
+
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 
 # configuración común del logging para todos los módulos
 
 # formato de los registro del log
 LOG_FORMAT = '%(asctime)s %(levelname)s: %(message)s'
 
-# nivel de regstro del log
-# FIXME: el nivel de logging deberia especificarse en un archivo de configuracion
+# nivel de registro del log por defecto, se puede cambiar desde la línea de comandos (ver configure_logging)
 LOG_LEVEL = logging.INFO
 
+# niveles que se pueden indicar en la línea de comandos
+LOG_LEVELS = ('DEBUG', 'INFO', 'WARNING', 'ERROR', 'CRITICAL')
+
 # número de ficheros de logs a guardar
 BACKUP_COUNT = 5
 
@@ -19,6 +27,30 @@ INTERVAL_CATEGORY = 'D'  # dias
 # intervalo para crear un archivo de log
 INTERVAL = 1
 
+# campos añadidos a los registros del log (extra) que se incluyen en el formato JSON
+JSON_EXTRA_FIELDS = ('progress',)
+
+# hilo que escribe los registros del log asíncrono (ver configure_logging)
+_listener = None
+
+
+class JsonFormatter(logging.Formatter):
+    # Formato estructurado: un objeto JSON por registro, para los sistemas de recogida de logs
+
+    def format(self, record):
+        entry = {
+            'time': time.strftime('%Y-%m-%dT%H:%M:%S', time.localtime(record.created)) + f'.{int(record.msecs):03d}',
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+        }
+        for field in JSON_EXTRA_FIELDS:
+            if hasattr(record, field):
+                entry[field] = getattr(record, field)
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
 
 # crea un log por consola
 # si se proporciona un nombre de fichero también vuelca el log a ese fichero
@@ -45,3 +77,52 @@ def get_logger(log_file=None, log_level=LOG_LEVEL, log_format=LOG_FORMAT):
             raise e
 
     return logger
+
+
+def stop_logging():
+    # escribe los registros pendientes del log asíncrono y termina su hilo
+    global _listener
+    if _listener:
+        _listener.stop()
+        _listener = None
+
+
+# los registros pendientes del log asíncrono se escriben al terminar el programa
+atexit.register(stop_logging)
+
+
+# configura el log de todos los módulos: nivel, formato (texto o JSON) y fichero de log
+# con asynchronous=True los módulos solo dejan los registros en una cola (QueueHandler) y un hilo aparte
+# (QueueListener) los formatea y los escribe en la consola y el fichero, así el proceso de los listados
+# no espera a que se escriba el log aunque el disco del log sea lento
+def configure_logging(log_level=LOG_LEVEL, log_file=None, json_format=False, asynchronous=False):
+
+    stop_logging()
+
+    formatter = JsonFormatter() if json_format else logging.Formatter(LOG_FORMAT)
+
+    handlers = [logging.StreamHandler(sys.stderr)]
+    if log_file:
+        handlers.append(TimedRotatingFileHandler(
+            log_file, when=INTERVAL_CATEGORY, interval=INTERVAL, backupCount=BACKUP_COUNT
+        ))
+    for handler in handlers:
+        handler.setFormatter(formatter)
+
+    logger = logging.getLogger()
+    for handler in logger.handlers[:]:
+        logger.removeHandler(handler)
+        handler.close()
+    logger.setLevel(log_level)
+
+    if asynchronous:
+        global _listener
+        log_queue = queue.SimpleQueue()
+        _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+        _listener.start()
+        logger.addHandler(QueueHandler(log_queue))
+    else:
+        for handler in handlers:
+            logger.addHandler(handler)
+
+    return logger
@@ -0,0 +1,212 @@
+# métricas de cada ejecución para los procesos por lotes (opción --metrics-file)
+#
+# por cada fichero de entrada: bytes leídos, líneas (total, excluidas, sin filtro de inclusión y procesadas),
+# filas escritas de cada sección, fallos de conversión, duración y líneas y bytes por segundo
+# y los totales de la ejecución
+# se escriben en formato JSON o en el formato de ficheros de texto de Prometheus (textfile collector de
+# node_exporter), según la extensión del fichero. El fichero se escribe de una vez (se escribe uno temporal
+# y se renombra) para que el recolector nunca lea un fichero a medias
+
+import json
+import os
+import pathlib
+import time
+import types
+
+from contextlib import contextmanager, nullcontext
+
+from commons import stdin_name
+
+
+# prefijo de los nombres de las métricas de Prometheus
+metric_prefix = 'redaxtor'
+
+# métricas de cada fichero: nombre, campo de FileMetrics y descripción
+file_metrics = (
+    ('input_bytes', 'bytes', 'Bytes leidos del fichero de entrada'),
+    ('lines', 'lines', 'Lineas del fichero de entrada'),
+    ('excluded_lines', 'excluded_lines', 'Lineas descartadas por los filtros de exclusion'),
+    ('unmatched_lines', 'unmatched_lines', 'Lineas que no concuerdan con ningun filtro de inclusion'),
+    ('matched_lines', 'matched_lines', 'Lineas que concuerdan con algun filtro de inclusion'),
+    ('conversion_failures', 'conversion_failures', 'Lineas cuyos campos no se han podido convertir a su tipo'),
+    ('rows', 'rows', 'Filas escritas'),
+    ('duration_seconds', 'seconds', 'Duracion del proceso y la escritura del fichero'),
+    ('lines_per_second', 'lines_per_second', 'Lineas procesadas por segundo'),
+    ('bytes_per_second', 'bytes_per_second', 'Bytes procesados por segundo'),
+    ('success', 'success', '1 si el fichero se ha procesado sin errores'),
+)
+
+
+def escape_label(value):
+    # valor de una etiqueta de Prometheus: se escapan \\, " y los saltos de línea
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class FileMetrics:
+    # Métricas del proceso de un fichero de entrada
+
+    def __init__(self, spool_file):
+        self.file = str(spool_file)
+        self.conf = None
+        self.bytes = 0
+        self.lines = 0
+        self.excluded_lines = 0
+        self.unmatched_lines = 0
+        self.conversion_failures = 0
+        self.section_rows = {}  # índice de la sección -> filas escritas
+        self.seconds = 0.0
+        self.error = None
+        # informe que procesa el fichero, sus contadores se recogen al terminar
+        self.report = None
+
+    @property
+    def matched_lines(self):
+        return self.lines - self.excluded_lines - self.unmatched_lines
+
+    @property
+    def rows(self):
+        return sum(self.section_rows.values())
+
+    @property
+    def lines_per_second(self):
+        return self.lines / self.seconds if self.seconds else 0.0
+
+    @property
+    def bytes_per_second(self):
+        return self.bytes / self.seconds if self.seconds else 0.0
+
+    @property
+    def success(self):
+        return 0 if self.error else 1
+
+    def collect(self, report):
+        # recoge los contadores del informe que ha procesado el fichero
+        self.conf = str(report.conf_file)
+        self.lines = report.lines
+        self.excluded_lines = report.excluded_lines
+        self.unmatched_lines = report.unmatched_lines
+        self.conversion_failures = report.conversion_failures
+        sections = {id(section): index for index, section in enumerate(report.sections)}
+        for cell_group in report.cell_groups:
+            index = sections[id(cell_group.section)]
+            self.section_rows[index] = self.section_rows.get(index, 0) + len(cell_group.lines)
+
+    def as_dict(self):
+        result = {'file': self.file, 'conf': self.conf}
+        result.update((name, getattr(self, attribute)) for name, attribute, _ in file_metrics)
+        result['section_rows'] = {str(index): rows for index, rows in sorted(self.section_rows.items())}
+        result['error'] = self.error
+        return result
+
+
+class RunMetrics:
+    # Métricas de todos los ficheros de una ejecución
+
+    def __init__(self):
+        self.files = []
+        self.start = time.time()
+        self.end = None
+
+    @contextmanager
+    def measure(self, spool_file):
+        # mide el proceso y la escritura de un fichero de entrada, hay que asignar a report del objeto devuelto
+        # el informe que lo procesa. Si se produce un error se registra el fichero como fallido y se vuelve a lanzar
+        metrics = FileMetrics(spool_file)
+        if spool_file != stdin_name and os.path.isfile(spool_file):
+            metrics.bytes = os.path.getsize(spool_file)
+        self.files.append(metrics)
+        start = time.perf_counter()
+        try:
+            yield metrics
+        except Exception as e:
+            metrics.error = str(e) or type(e).__name__
+            raise
+        finally:
+            metrics.seconds = time.perf_counter() - start
+            if metrics.report is not None:
+                metrics.collect(metrics.report)
+                # no se guarda el informe para no retener sus celdas en memoria
+                metrics.report = None
+            self.end = time.time()
+
+    def totals(self):
+        seconds = (self.end or time.time()) - self.start
+        lines = sum(metrics.lines for metrics in self.files)
+        input_bytes = sum(metrics.bytes for metrics in self.files)
+        return {
+            'files': len(self.files),
+            'failed_files': sum(1 for metrics in self.files if metrics.error),
+            'input_bytes': input_bytes,
+            'lines': lines,
+            'excluded_lines': sum(metrics.excluded_lines for metrics in self.files),
+            'unmatched_lines': sum(metrics.unmatched_lines for metrics in self.files),
+            'matched_lines': sum(metrics.matched_lines for metrics in self.files),
+            'conversion_failures': sum(metrics.conversion_failures for metrics in self.files),
+            'rows': sum(metrics.rows for metrics in self.files),
+            'duration_seconds': seconds,
+            'lines_per_second': lines / seconds if seconds else 0.0,
+            'bytes_per_second': input_bytes / seconds if seconds else 0.0,
+            'last_run_timestamp_seconds': self.end or time.time(),
+        }
+
+    def as_dict(self):
+        return {'files': [metrics.as_dict() for metrics in self.files], 'totals': self.totals()}
+
+    def latest(self):
+        # última medida de cada fichero con cada configuración, en el orden de la primera
+        # en Prometheus no puede haber dos muestras con las mismas etiquetas (el textfile collector descarta el fichero)
+        latest = {}
+        for metrics in self.files:
+            latest[(metrics.file, metrics.conf or '')] = metrics
+        return list(latest.values())
+
+    def prometheus(self):
+        # texto en el formato de exposición de Prometheus, todas las métricas son gauges
+        # si un fichero se ha procesado más de una vez con la misma configuración solo se escribe la última medida
+        output = []
+        files = self.latest()
+
+        def metric(name, description, samples):
+            output.append(f'# HELP {metric_prefix}_{name} {description}')
+            output.append(f'# TYPE {metric_prefix}_{name} gauge')
+            for labels, value in samples:
+                labels = ','.join(f'{key}="{escape_label(label)}"' for key, label in labels.items())
+                output.append(f'{metric_prefix}_{name}{{{labels}}} {value}' if labels else
+                              f'{metric_prefix}_{name} {value}')
+
+        for name, attribute, description in file_metrics:
+            metric(
+                f'file_{name}', description,
+                [({'file': metrics.file, 'conf': metrics.conf or ''}, getattr(metrics, attribute))
+                 for metrics in files]
+            )
+        metric(
+            'file_section_rows', 'Filas escritas de cada seccion',
+            [({'file': metrics.file, 'conf': metrics.conf or '', 'section': index}, rows)
+             for metrics in files for index, rows in sorted(metrics.section_rows.items())]
+        )
+        for name, value in self.totals().items():
+            metric(f'batch_{name}', f'Total de la ejecucion: {name}', [({}, value)])
+        return '\n'.join(output) + '\n'
+
+    def write(self, metrics_file):
+        # con extensión .json en formato JSON, si no en el formato de Prometheus
+        metrics_file = pathlib.Path(metrics_file)
+        if metrics_file.suffix.lower() == '.json':
+            content = json.dumps(self.as_dict(), indent=2)
+        else:
+            content = self.prometheus()
+        temporary_file = metrics_file.with_name(f'.{metrics_file.name}.tmp')
+        with open(temporary_file, 'w', encoding='utf-8') as fout:
+            fout.write(content)
+        os.replace(temporary_file, metrics_file)
+
+
+class NullMetrics:
+    # Métricas que no miden nada, para no tener que comprobar en cada fichero si se están midiendo
+
+    def measure(self, spool_file):
+        return nullcontext(types.SimpleNamespace())
+
+
+null_metrics = NullMetrics()
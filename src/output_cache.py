@@ -0,0 +1,148 @@
+# caché de las salidas por contenido (opción --output-cache) para volver a lanzar un lote sin reprocesar
+# los listados que no han cambiado
+#
+# el manifiesto (JSON) guarda por cada clave los ficheros de salida que se generaron con ella. La clave es el hash
+# del contenido del listado, de la configuración (o de todas las de --conf-folder), de la plantilla, del formato
+# y de las opciones que cambian la salida. Si las salidas siguen en disco sin cambios (mismo tamaño y fecha de
+# modificación), el listado no se vuelve a procesar; si el mismo contenido se procesó con otro nombre de fichero,
+# se copian sus salidas con el nombre que corresponde
+# para no leer los listados sin cambios, se guarda también el tamaño y la fecha de modificación de cada listado
+# con su hash: solo se vuelve a calcular el hash si han cambiado
+
+import hashlib
+import json
+import os
+import pathlib
+import shutil
+
+from commons import app_version
+from logger import get_logger
+
+
+logger = get_logger()
+
+# versión del formato del manifiesto, los de otra versión se descartan
+manifest_version = 1
+
+# tamaño de los bloques al calcular el hash de un listado
+hash_block_size = 1 << 20
+
+
+def file_hash(file_name):
+    # hash del contenido de un fichero
+    digest = hashlib.sha256()
+    with open(file_name, 'rb') as fin:
+        while block := fin.read(hash_block_size):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def file_stamp(file_name):
+    # tamaño y fecha de modificación de un fichero, para saber sin leerlo si ha cambiado
+    stat = os.stat(file_name)
+    return [stat.st_size, stat.st_mtime_ns]
+
+
+class OutputCache:
+    # Manifiesto de las salidas generadas en las ejecuciones anteriores
+    # conf_hash identifica la configuración y options las opciones que afectan a la salida
+
+    def __init__(self, manifest_file, conf_hash, options):
+        self.manifest_file = pathlib.Path(manifest_file)
+        digest = hashlib.sha256(app_version.encode())
+        digest.update(conf_hash.encode())
+        digest.update(json.dumps(options, sort_keys=True, default=str).encode())
+        self.settings_hash = digest.hexdigest()
+        self.inputs = {}  # listado -> {'stamp': [tamaño, fecha], 'hash': hash del contenido}
+        self.entries = {}  # clave -> [{'name': nombre base de las salidas, 'outputs': [[fichero, tamaño, fecha]]}]
+        self.hits = self.copies = 0
+
+        try:
+            with open(self.manifest_file, encoding='utf-8') as fin:
+                manifest = json.load(fin)
+            if manifest.get('version') == manifest_version:
+                self.inputs = manifest['inputs']
+                self.entries = manifest['entries']
+            else:
+                logger.warning(f'El manifiesto {self.manifest_file} es de otra version, se descarta')
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError) as e:
+            logger.warning(f'No se ha podido leer el manifiesto {self.manifest_file}, se descarta: {e}')
+
+    def key(self, input_file):
+        # clave del listado con la configuración y las opciones actuales
+        # solo se lee el listado si su tamaño o su fecha de modificación no son los del manifiesto
+        path = str(pathlib.Path(input_file).absolute())
+        stamp = file_stamp(input_file)
+        known = self.inputs.get(path)
+        if known and known['stamp'] == stamp:
+            content_hash = known['hash']
+        else:
+            content_hash = file_hash(input_file)
+            self.inputs[path] = {'stamp': stamp, 'hash': content_hash}
+        return hashlib.sha256(f'{content_hash}:{self.settings_hash}'.encode()).hexdigest()
+
+    @staticmethod
+    def _valid(entry):
+        # las salidas siguen en disco tal como se generaron
+        try:
+            return all(file_stamp(output_file) == [size, mtime] for output_file, size, mtime in entry['outputs'])
+        except OSError:
+            return False
+
+    def lookup(self, input_file, output_folder, name):
+        # salidas ya generadas para el listado, None si hay que procesarlo
+        # name es el nombre base de las salidas (el del listado), las salidas de un listado con el mismo contenido
+        # y otro nombre se copian cambiando su nombre base
+        entries = [entry for entry in self.entries.get(self.key(input_file), []) if self._valid(entry)]
+        if not entries:
+            return None
+
+        output_folder = pathlib.Path(output_folder).absolute()
+        for entry in entries:
+            outputs = [pathlib.Path(output_file) for output_file, _, _ in entry['outputs']]
+            if entry['name'] == name and all(output.parent == output_folder for output in outputs):
+                self.hits += 1
+                return outputs
+
+        entry = entries[0]
+        copies = []
+        for output_file, _, _ in entry['outputs']:
+            output_file = pathlib.Path(output_file)
+            copy = output_folder / f'{name}{output_file.name[len(entry["name"]):]}'
+            shutil.copyfile(output_file, copy)
+            copies.append(copy)
+        self.store(input_file, name, copies)
+        self.copies += 1
+        return copies
+
+    def store(self, input_file, name, output_files):
+        # registra las salidas generadas para el listado, sustituyendo las anteriores con el mismo nombre
+        # si no se ha llegado a escribir alguna de las salidas (una plantilla sin contenido) no se registra
+        outputs = [pathlib.Path(output_file).absolute() for output_file in output_files]
+        try:
+            entry = {'name': name, 'outputs': [[str(output), *file_stamp(output)] for output in outputs]}
+        except OSError:
+            return
+        entries = self.entries.setdefault(self.key(input_file), [])
+        entries[:] = [
+            other for other in entries
+            if not {output_file for output_file, _, _ in other['outputs']} & {str(output) for output in outputs}
+        ]
+        entries.append(entry)
+
+    def save(self):
+        # el manifiesto se escribe en un fichero temporal que se renombra, para no dejarlo nunca a medias
+        # solo se guardan los listados que siguen existiendo y las salidas que no han cambiado
+        self.inputs = {path: known for path, known in self.inputs.items() if os.path.exists(path)}
+        for key, entries in list(self.entries.items()):
+            entries[:] = [entry for entry in entries if self._valid(entry)]
+            if not entries:
+                del self.entries[key]
+        manifest = {'version': manifest_version, 'inputs': self.inputs, 'entries': self.entries}
+        temporary_file = self.manifest_file.with_name(f'.{self.manifest_file.name}.tmp')
+        with open(temporary_file, 'w', encoding='utf-8') as fout:
+            json.dump(manifest, fout, indent=1)
+        os.replace(temporary_file, self.manifest_file)
+        logger.info(f'Cache de salidas: {self.hits} ficheros sin cambios, {self.copies} copiados')
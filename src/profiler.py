@@ -0,0 +1,310 @@
+# medición del coste de cada fase del proceso de un listado (opción --profile)
+#
+# para que no haya ningún coste cuando no se usa, el código del proceso no tiene ninguna medición:
+# mientras se procesa un listado con el perfilador activo se sustituyen los métodos y funciones que se quieren
+# medir por versiones que miden el tiempo y cuentan sus llamadas, y al terminar se restauran los originales
+#
+# se mide el tiempo real (perf_counter) y el de CPU (process_time) de cada fase. Las fases se solapan:
+# el tiempo de 'process' incluye el de 'read', 'store row',..., el de 'store row' incluye el de 'to_number' y
+# 'to_date' y el de 'write' el de 'Cell.value'
+# además se cuentan las evaluaciones y aciertos de cada filtro, las líneas procesadas por cada fieldset,
+# las celdas creadas y los bytes leídos
+
+import json
+import os
+import sys
+import time
+
+from contextlib import contextmanager, nullcontext
+
+from commons import stdin_name
+
+
+def peak_memory():
+    # pico de memoria residente del proceso en bytes (None si no se puede saber)
+    # en Linux se lee VmHWM porque ru_maxrss se conserva al hacer exec y en un proceso hijo puede ser el del padre
+    try:
+        with open('/proc/self/status') as fin:
+            for line in fin:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss está en KB salvo en macOS, que está en bytes
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+
+class Stage:
+    # Tiempo acumulado de una fase del proceso
+
+    __slots__ = ('wall', 'cpu', 'calls')
+
+    def __init__(self):
+        self.wall = 0.0
+        self.cpu = 0.0
+        self.calls = 0
+
+    def add(self, wall, cpu):
+        self.wall += wall
+        self.cpu += cpu
+        self.calls += 1
+
+    def as_dict(self):
+        return {'wall': self.wall, 'cpu': self.cpu, 'calls': self.calls}
+
+
+class FilterStats:
+    # Evaluaciones, aciertos y tiempo de un filtro de inclusión o exclusión
+
+    __slots__ = ('evaluations', 'hits', 'wall')
+
+    def __init__(self):
+        self.evaluations = 0
+        self.hits = 0
+        self.wall = 0.0
+
+    def as_dict(self):
+        return {'evaluations': self.evaluations, 'hits': self.hits, 'wall': self.wall}
+
+
+class Profiler:
+    # Recoge las medidas de todos los listados procesados
+
+    def __init__(self):
+        self.stages = {}  # nombre -> Stage, en el orden en que se miden por primera vez
+        self.exclude_filters = {}  # patrón -> FilterStats
+        self.include_filters = {}  # patrón -> FilterStats
+        self.fieldsets = {}  # descripción del fieldset -> líneas procesadas
+        self.counters = {'files': 0, 'lines': 0, 'cells': 0, 'bytes': 0}
+
+    def _stage(self, name):
+        stage = self.stages.get(name)
+        if stage is None:
+            stage = self.stages[name] = Stage()
+        return stage
+
+    @contextmanager
+    def stage(self, name):
+        # mide el bloque de código como una llamada a la fase name
+        stage = self._stage(name)
+        wall, cpu = time.perf_counter(), time.process_time()
+        try:
+            yield
+        finally:
+            stage.add(time.perf_counter() - wall, time.process_time() - cpu)
+
+    def timed(self, name, function):
+        # versión de function que mide cada llamada como la fase name
+        stage = self._stage(name)
+        perf_counter, process_time = time.perf_counter, time.process_time
+
+        def wrapper(*args, **kwargs):
+            wall, cpu = perf_counter(), process_time()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                stage.add(perf_counter() - wall, process_time() - cpu)
+
+        return wrapper
+
+    def timed_lines(self, name, lines):
+        # mide el tiempo de obtener cada línea del generador lines como la fase name y cuenta las líneas
+        stage = self._stage(name)
+        perf_counter, process_time = time.perf_counter, time.process_time
+        iterator = iter(lines)
+        try:
+            while True:
+                wall, cpu = perf_counter(), process_time()
+                try:
+                    line = next(iterator)
+                except StopIteration:
+                    return
+                finally:
+                    stage.add(perf_counter() - wall, process_time() - cpu)
+                self.counters['lines'] += 1
+                yield line
+        finally:
+            lines.close()
+
+    @staticmethod
+    @contextmanager
+    def _replaced(replacements):
+        # sustituye los atributos (owner, nombre, valor) mientras se ejecuta el bloque
+        replaced = []
+        try:
+            for owner, name, value in replacements:
+                replaced.append((owner, name, owner.__dict__.get(name), name in owner.__dict__))
+                setattr(owner, name, value)
+            yield
+        finally:
+            for owner, name, value, existed in reversed(replaced):
+                if existed:
+                    setattr(owner, name, value)
+                else:
+                    delattr(owner, name)
+
+    @contextmanager
+    def instrument(self, report, module):
+        # sustituye los métodos del informe y las funciones del módulo redaxtor que se miden
+        # mientras se procesa un listado. Al terminar cuenta las celdas creadas
+
+        # filtros de exclusión
+        exclude_filters = [
+            (exclude_filter, self._filter(self.exclude_filters, exclude_filter))
+            for exclude_filter in report.exclude_filters
+        ]
+        exclude_stage = self._stage('exclude filters')
+
+        def exclude_line(line):
+            start = time.perf_counter()
+            try:
+                for exclude_filter, stats in exclude_filters:
+                    filter_start = time.perf_counter()
+                    matched = exclude_filter.match(line)
+                    stats.wall += time.perf_counter() - filter_start
+                    stats.evaluations += 1
+                    if matched:
+                        stats.hits += 1
+                        return True
+                return False
+            finally:
+                exclude_stage.add(time.perf_counter() - start, 0.0)
+
+        # filtros de inclusión
+        include_filters = [
+            (item, self._filter(self.include_filters, item[0])) for item in report.include_filters
+        ]
+        include_stage = self._stage('include filters')
+
+        def match_include_filters(line):
+            start = time.perf_counter()
+            try:
+                for item, stats in include_filters:
+                    filter_start = time.perf_counter()
+                    matched = item[0].match(line)
+                    stats.wall += time.perf_counter() - filter_start
+                    stats.evaluations += 1
+                    if matched:
+                        stats.hits += 1
+                        return item
+                return None, None, None
+            finally:
+                include_stage.add(time.perf_counter() - start, 0.0)
+
+        # líneas procesadas por cada fieldset
+        names = self._fieldset_names(report)
+        store_row = self.timed('store row', report._store_row)
+
+        def count_store_row(fields_group, *args):
+            name = names[id(fields_group)]
+            self.fieldsets[name] = self.fieldsets.get(name, 0) + 1
+            return store_row(fields_group, *args)
+
+        def read_lines(report_file, *args, **kwargs):
+            self.counters['files'] += 1
+            if report_file != stdin_name and os.path.isfile(report_file):
+                self.counters['bytes'] += os.path.getsize(report_file)
+            return self.timed_lines('read', read_lines_original(report_file, *args, **kwargs))
+
+        read_lines_original = report.read_lines
+        replacements = [
+            (report, 'read_lines', read_lines),
+            (report, '_exclude_line', exclude_line),
+            (report, '_match_include_filters', match_include_filters),
+            (report, '_store_row', count_store_row),
+        ] + [
+            (module, function, self.timed(function, getattr(module, function))) for function in ('to_number', 'to_date')
+        ]
+
+        try:
+            with self._replaced(replacements):
+                yield
+        finally:
+            self.counters['cells'] += sum(len(line) for cell_group in report.cell_groups for line in cell_group.lines)
+
+    def instrument_output(self, module):
+        # mide el valor de las celdas al escribir la salida, que incluye la sustitución de los marcadores
+        # de fila y columna de las fórmulas
+        cell_value = module.Cell.__dict__['value']
+        return self._replaced([(module.Cell, 'value', property(self.timed('Cell.value', cell_value.fget)))])
+
+    @staticmethod
+    def _filter(filters, compiled_filter):
+        stats = filters.get(compiled_filter.pattern)
+        if stats is None:
+            stats = filters[compiled_filter.pattern] = FilterStats()
+        return stats
+
+    @staticmethod
+    def _fieldset_names(report):
+        # nombre de cada fieldset del informe para el resumen: sección, parte y número de fieldset
+        names = {}
+        title = report.title.strip()
+        for section_index, section in enumerate(report.sections):
+            for part in ('header', 'body', 'footer'):
+                for index, fieldset in enumerate(getattr(section, part)):
+                    filters = ' '.join(f'"{f.pattern}"' for f in fieldset.include_filters)
+                    name = f'{title}: section {section_index} {part} {index}'
+                    names[id(fieldset)] = f'{name} {filters}' if filters else name
+        return names
+
+    def as_dict(self):
+        return {
+            'counters': dict(self.counters),
+            'stages': {name: stage.as_dict() for name, stage in self.stages.items()},
+            'exclude_filters': {pattern: stats.as_dict() for pattern, stats in self.exclude_filters.items()},
+            'include_filters': {pattern: stats.as_dict() for pattern, stats in self.include_filters.items()},
+            'fieldsets': dict(self.fieldsets),
+        }
+
+    def summary(self, output=None):
+        # escribe el resumen de las medidas, por defecto en la salida de error
+        output = output or sys.stderr
+        counters = self.counters
+        print('Perfil del proceso:', file=output)
+        print(f'  ficheros: {counters["files"]}, lineas: {counters["lines"]}, celdas: {counters["cells"]}, '
+              f'bytes: {counters["bytes"]}', file=output)
+        print(f'  {"fase":<20} {"real (s)":>10} {"cpu (s)":>10} {"llamadas":>12}', file=output)
+        for name, stage in self.stages.items():
+            if not stage.calls:
+                continue
+            cpu = f'{stage.cpu:10.3f}' if stage.cpu else f'{"-":>10}'
+            print(f'  {name:<20} {stage.wall:10.3f} {cpu} {stage.calls:12d}', file=output)
+        for title, filters in (('filtros de exclusion', self.exclude_filters),
+                               ('filtros de inclusion', self.include_filters)):
+            if filters:
+                print(f'  {title:<40} {"evaluaciones":>12} {"aciertos":>10} {"real (s)":>10}', file=output)
+                for pattern, stats in filters.items():
+                    print(f'  {pattern[:40]:<40} {stats.evaluations:12d} {stats.hits:10d} {stats.wall:10.3f}',
+                          file=output)
+        if self.fieldsets:
+            print(f'  {"fieldsets":<60} {"lineas":>10}', file=output)
+            for name, lines in self.fieldsets.items():
+                print(f'  {name[:60]:<60} {lines:10d}', file=output)
+
+    def dump(self, json_file):
+        with open(json_file, 'w') as fout:
+            json.dump(self.as_dict(), fout, indent=2)
+
+
+class NullProfiler:
+    # Perfilador que no mide nada, para no tener que comprobar en cada fase si se está midiendo
+
+    def stage(self, name):
+        return nullcontext()
+
+    def instrument(self, report, module):
+        return nullcontext()
+
+    def instrument_output(self, module):
+        return nullcontext()
+
+    def timed(self, name, function):
+        return function
+
+
+null_profiler = NullProfiler()
@@ -0,0 +1,140 @@
+# informe del avance del proceso de los listados grandes (opción --progress)
+#
+# Report.process llama a update cada cierto número de líneas (redaxtor.progress_lines) y solo se informa cuando
+# ha pasado el intervalo indicado, así sin --progress el bucle de las líneas solo comprueba que no hay informe
+# el avance se mide por la posición en el fichero tal como está en disco: en un fichero comprimido es la posición
+# en el fichero comprimido, que es lo que se compara con su tamaño para calcular el porcentaje y el tiempo restante
+# se informa en la salida de error (terminal) o con registros del log (log), que llevan los valores en el campo
+# progress para que el formato JSON del log (logger.JsonFormatter) los incluya
+
+import os
+import sys
+import time
+
+from commons import stdin_name
+from logger import get_logger
+
+
+logger = get_logger()
+
+# salidas del informe de avance
+progress_outputs = ('terminal', 'log')
+
+# segundos entre dos informes de avance
+default_progress_interval = 5.0
+
+
+def human_time(seconds):
+    # tiempo en formato h:mm:ss
+    minutes, seconds = divmod(int(seconds), 60)
+    hours, minutes = divmod(minutes, 60)
+    return f'{hours}:{minutes:02d}:{seconds:02d}'
+
+
+class Progress:
+    # Informe del avance del proceso de cada fichero de entrada: líneas y MB por segundo, filas generadas,
+    # porcentaje leído y tiempo restante estimado
+
+    def __init__(self, interval=default_progress_interval, output='terminal', stream=None):
+        self.interval = interval
+        self.output = output
+        self.stream = stream or sys.stderr
+        # en un terminal cada informe sustituye al anterior en la misma línea
+        self._same_line = output == 'terminal' and self.stream.isatty()
+        self._report = None
+        self._raw = None
+
+    def start(self, report, report_file, offset=0):
+        # empieza el proceso de un fichero, el tamaño no se conoce si es la entrada estándar
+        # offset es la posición desde la que se lee el fichero (ver follow.py)
+        self._report = report
+        self._offset = offset
+        self._raw = None
+        self.file = str(report_file)
+        self.size = None
+        if report_file != stdin_name and os.path.isfile(report_file):
+            self.size = os.path.getsize(report_file)
+        # las filas de las secciones ya contadas, para no recorrer en cada informe todas las secciones
+        self._counted_groups = 0
+        self._counted_rows = 0
+        self._start = time.perf_counter()
+        self._next = self._start + self.interval
+
+    def opened(self, raw):
+        # fichero de entrada tal como está en disco (ver commons.open_binary)
+        self._raw = raw
+
+    def position(self):
+        # bytes leídos del fichero de entrada, None si no se puede saber (una tubería)
+        try:
+            return self._raw.tell() if self._raw else None
+        except (OSError, ValueError):
+            return None
+
+    def rows(self):
+        # filas generadas hasta ahora, solo se vuelven a contar las secciones que pueden seguir creciendo
+        cell_groups = self._report.cell_groups
+        closed = max(len(cell_groups) - 1, self._counted_groups)
+        for cell_group in cell_groups[self._counted_groups:closed]:
+            self._counted_rows += len(cell_group.lines)
+        self._counted_groups = closed
+        return self._counted_rows + sum(len(cell_group.lines) for cell_group in cell_groups[closed:])
+
+    def update(self, lines):
+        # se llama cada cierto número de líneas, solo informa si ha pasado el intervalo
+        now = time.perf_counter()
+        if now >= self._next:
+            self._next = now + self.interval
+            self._emit(lines, now, final=False)
+
+    def finish(self, lines):
+        # informe final del fichero, solo si se ha informado de su avance o ha tardado más que el intervalo
+        now = time.perf_counter()
+        if now - self._start >= self.interval:
+            self._emit(lines, now, final=True)
+        self._report = self._raw = None
+
+    def measure(self, lines, now):
+        # valores del informe de avance
+        seconds = now - self._start
+        position = self.size if self._raw and self._raw.closed else self.position()
+        read = position - self._offset if position is not None else None
+        values = {
+            'file': self.file,
+            'lines': lines,
+            'rows': self.rows(),
+            'seconds': round(seconds, 3),
+            'lines_per_second': round(lines / seconds) if seconds else 0,
+            'bytes': position,
+            'size': self.size,
+            'mb_per_second': round(read / seconds / 2 ** 20, 2) if read is not None and seconds else None,
+            'percent': None,
+            'eta_seconds': None,
+        }
+        if position is not None and self.size:
+            values['percent'] = round(min(position / self.size, 1) * 100, 1)
+            if read and seconds:
+                values['eta_seconds'] = round(max(self.size - position, 0) * seconds / read, 1)
+        return values
+
+    def _emit(self, lines, now, final):
+        values = self.measure(lines, now)
+        message = f'{values["file"]}: {values["lines"]} lineas ({values["lines_per_second"]} lineas/s'
+        if values['mb_per_second'] is not None:
+            message += f', {values["mb_per_second"]:.2f} MB/s'
+        message += f'), {values["rows"]} filas'
+        if values['percent'] is not None:
+            message += f', {values["percent"]:.1f}%'
+        if final:
+            message += f', terminado en {human_time(values["seconds"])}'
+        elif values['eta_seconds'] is not None:
+            message += f', quedan {human_time(values["eta_seconds"])}'
+
+        if self.output == 'log':
+            logger.info(f'Avance: {message}', extra={'progress': values})
+        elif self._same_line:
+            self.stream.write(f'\r\x1b[K{message}' + ('\n' if final else ''))
+            self.stream.flush()
+        else:
+            self.stream.write(message + '\n')
+            self.stream.flush()
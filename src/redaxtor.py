@@ -1,20 +1,42 @@
+import os
+import hashlib
+import logging
 import pathlib
 import re
+import sys
 import argparse
-import xlsxwriter
-
-from xlsxwriter.utility import xl_rowcol_to_cell, xl_col_to_name
-from pyparsing import ParseException
-from jinja2 import Environment, FileSystemLoader
-
-from commons import field_types, special_types, extracted_types, calculated_fields, numeric_fields, \
-    need_transform_types, default_encoding, output_formats, default_format, file_by_line, \
-    time_mark, app_name, to_number, string_list
+import copy
+import csv
+import itertools
+import types
+
+from functools import lru_cache
+
+from commons import field_types, special_types, extracted_types, calculated_fields, numeric_fields, date_fields, \
+    default_date_formats, excel_date_formats, to_date, field_style, \
+    need_transform_types, default_encoding, output_formats, default_format, text_formats, file_by_line, \
+    file_by_record, time_mark, app_name, to_number, string_list, col_to_name, rowcol_to_cell, FilePool, \
+    compressed_suffixes, stdin_name, work_folder, publish_files
 from styles_parser import Style
-from config_parser import report_grammar
+from config_parser import grammar as config_grammar
+from config_cache import load_config, save_config, config_hash
+from formula_evaluator import Evaluator
+from aggregates import RunningAggregate
+from excel_tables import ExcelTable
+from profiler import Profiler, null_profiler
+from metrics import RunMetrics, null_metrics
+from progress import Progress, progress_outputs, default_progress_interval
+from follow import Checkpoint, default_batch_lines
+from output_cache import OutputCache, file_hash
+from journal import Journal
+from rejects import ErrorPolicy, RejectedLine, on_error_actions, default_on_error
  
-from logger import get_logger
+from logger import get_logger, configure_logging, LOG_LEVELS
+
 
+# Las librerías pesadas (pyparsing, xlsxwriter y jinja2) se importan solo cuando se necesitan:
+# pyparsing al interpretar el fichero de configuración (no si se carga desde la caché),
+# xlsxwriter al generar la salida xlsx y jinja2 al generar el resto de formatos
 
 # Procesa listados de texto
 # El programa es siempre el mismo, pero puede procesar distintos listados
@@ -38,25 +60,78 @@ from logger import get_logger
 # Inicia el sistema de log
 logger = get_logger()
 
+if __name__ == '__main__':
+    # al ejecutarse como script, el módulo también debe estar disponible como redaxtor
+    # la caché de configuraciones busca ahí las clases de la definición del informe
+    sys.modules.setdefault('redaxtor', sys.modules[__name__])
+
 # separador por defecto de los campos (csv)
 field_separator = ';'
 
+# número de líneas de cada fichero de entrada que se usan para elegir su definición de informe
+default_sample_lines = 100
+
+# número máximo de filas de una hoja de Excel
+excel_max_rows = 1048576
+
+# número máximo de ficheros abiertos a la vez al dividir la salida por el valor de un campo
+default_max_open_files = 64
+
+# cada cuántas líneas se comprueba si hay que informar del avance del proceso (--progress)
+progress_lines = 1024
+
+# formas de dividir la salida xlsx que no cabe en una hoja: en varias hojas o en varios libros
+split_modes = ('sheet', 'book')
+default_split = 'sheet'
+
 # expresiones regulares usadas para sustituir indices relativos a la celda actual de filas y columnas
 row_index_regexp = re.compile(r'<ROW:(?P<offset>-?\d+)>')
 col_index_regexp = re.compile(r'<COL:(?P<offset>-?\d+)>')
 
 
+# convierte una fórmula con marcadores de fila y columna relativas en una cadena de formato
+# las columnas ya se resuelven aquí, las filas quedan como {0}, {1},... junto con sus desplazamientos
+# las fórmulas de un campo del cuerpo son iguales en todas las filas, así que se convierten una sola vez
+@lru_cache(maxsize=1024)
+def formula_template(formula, col):
+    offsets = []
+
+    def row_marker(match_object):
+        offsets.append(int(match_object.group('offset')))
+        return f'{{{len(offsets) - 1}}}'
+
+    template = formula.replace('{', '{{').replace('}', '}}')
+    template = row_index_regexp.sub(row_marker, template)
+    template = col_index_regexp.sub(
+        lambda match_object: col_to_name(col + int(match_object.group('offset'))),
+        template
+    )
+    return template, tuple(offsets)
+
+
 # excepción personalizada para alertar de errores en el archivo de configuración
 class FieldException(Exception):
     pass
 
 
+# excepción personalizada para alertar de que no se puede elegir la definición de informe de un fichero
+class RouteException(Exception):
+    pass
+
+
+class BatchException(Exception):
+    # algunos ficheros del lote han fallado con --keep-going, output_files son los ficheros generados por los demás
+    def __init__(self, message, output_files):
+        super().__init__(message)
+        self.output_files = output_files
+
+
 class Field:
     # Descripción de un campo
     # Los campos pueden ser extraídos o calculados
     # Los campos extraídos obtienen su valor del listado que está siendo procesado
     # extrayendo su valor de la línea a procesar, entre las columnas izquierda y derecha
-    # indicadas en la definición del campo
+    # indicadas en la definición del campo, o de la columna indicada (@N) si el listado es delimitado
     # Los no extraídos (campos especiales) pueder ser campos vacíos, campos valor o campos calculados (fórmula de excel)
 
     def __init__(self, field, index):
@@ -64,7 +139,21 @@ class Field:
         self.type = field.type
         self.style_id = field.style_id if hasattr(field, 'style_id') else None
         self.name = field.name if field.name else None
-        if self.is_extracted:
+        # formato de entrada de los campos de fecha
+        self.format = None
+        date_format = getattr(field, 'format', None)
+        if self.type in date_fields:
+            self.format = date_format or default_date_formats[self.type]
+        elif date_format:
+            message = f'Columna {self.index}: solo los campos de fecha tienen formato ({field.format})'
+            logger.error(message)
+            raise FieldException(message)
+        # columna de la línea, empezando en 0, de los campos extraídos de un listado delimitado
+        self.column = None
+        if self.is_extracted and field.get('column'):
+            self.column = field.column[0]
+            self.value = None
+        elif self.is_extracted:
             self.value = tuple(field.value)
             if self.left < 0:
                 message = f'Columna {self.index}: Limite izquierdo (left={self.left}) inferior a 0'
@@ -83,6 +172,8 @@ class Field:
         value = f'"{self.value}"' if isinstance(self.value, str) else self.value
         style_id = f'"{self.style_id}"' if self.style_id else None
         name = f'"{self.name}"' if self.name else None
+        if self.column is not None:
+            value = f'"@{self.column}"'
         return f'Field(type="{self.type.name}", index={self.index}, name={name}, value={value}, style_id={style_id})'
 
     def __repr__(self):
@@ -111,9 +202,14 @@ class Field:
     def is_numeric(self):
         return self.type in numeric_fields
 
+    @property
+    def by_column(self):
+        # campo extraído de una columna de un listado delimitado
+        return self.column is not None
+
     @property
     def left(self):
-        if self.is_extracted:
+        if self.is_extracted and not self.by_column:
             return self.value[0]
         else:
             message = 'El campo no es extraible y no tiene el atributo "left"'
@@ -122,7 +218,7 @@ class Field:
 
     @property
     def right(self):
-        if self.is_extracted:
+        if self.is_extracted and not self.by_column:
             return self.value[1]
         else:
             message = 'El campo no es extraible y no tiene el atributo "right"'
@@ -130,6 +226,12 @@ class Field:
             raise FieldException(message)
 
 
+# campo de la columna con el fichero de origen de cada fila (opción --source-column)
+source_field = Field(
+    types.SimpleNamespace(type=field_types.const, name='source', value='', style_id=None), 0
+)
+
+
 class Fieldset:
     # Definición de fieldset
     # Guarda la información sobre como debe procesarse una determinada sección del listado
@@ -215,6 +317,11 @@ class Cell:
     # Esto es un campo ya procesado y es el que realmente contiene información
     # Cada Cell guarda una referencia al Field que lo define
 
+    # resultado de la fórmula de los campos calculados cuando se evalúan (None si no se ha podido evaluar)
+    # se definen en la clase para no ocupar memoria en el resto de celdas
+    computed = None
+    evaluated = False
+
     def __init__(self, col, row, field, original_value):
         self._row = row  # fila del campo, empezando en cero
         self._col = col  # columna del campo, empezando en cero
@@ -234,6 +341,9 @@ class Cell:
             elif field_type in numeric_fields:
                 # campo numérico
                 self._value = to_number(stripped_value, field_type)
+            elif field_type in date_fields:
+                # campo de fecha
+                self._value = to_date(stripped_value, field.format, field_type)
 
     @property
     def original_value(self):
@@ -271,12 +381,12 @@ class Cell:
     @property
     def excel_col(self):
         # Devuelve el nombre de la columna de excel a partir de su índice: A, B,.., Z, AB, AC,...
-        return xl_col_to_name(self.col)
+        return col_to_name(self.col)
 
     @property
     def excel_cell(self):
         # nombre de la celda en formato excel: A1, D2, AA3, BC45, ....
-        return xl_rowcol_to_cell(self._row, self._col)
+        return rowcol_to_cell(self._row, self._col)
 
     @property
     def value(self):
@@ -296,18 +406,22 @@ class Cell:
             # <startrow> es la fila inicial de la sección actual (sin inlcuir el posible encabezado)
             # <rows> es el número de filas totales del listado (incluye encabezados y pies)
 
-            val = row_index_regexp.sub(
-                lambda match_object: f'{self.excel_row + int(match_object.group("offset"))}',
-                self._value
-            )
-            val = col_index_regexp.sub(
-                lambda match_object: xl_col_to_name(self.col + int(match_object.group('offset'))),
-                val
-            )
-            return val
+            template, offsets = formula_template(self._value, self._col)
+            excel_row = self.excel_row
+            return template.format(*[excel_row + offset for offset in offsets])
         else:
             return self._value
 
+    @property
+    def output_value(self):
+        # valor para los formatos de texto: el resultado de la fórmula si se ha evaluado, si no el valor de la celda
+        # las fechas en formato ISO 8601
+        if self.computed is not None:
+            return self.computed
+        if self.field.type in date_fields and self._value is not None:
+            return self._value.isoformat()
+        return self.value
+
     def __str__(self):
         value = f'"{self.value}"' if isinstance(self.value, str) else self.value
         return f'Cell(address="{self.excel_cell}", type="{self.field.type.name}", value={value})'
@@ -358,13 +472,21 @@ class Row:
 
 class CellGroup:
     # Guarda la información que se va recolectando al procesar una sección
-    def __init__(self, index=0, start_row=0, section=None):
+    def __init__(self, index=0, start_row=0, section=None, part=0):
         self.index = index  # índice de la seccion
         self._start_row = start_row  # fila de comienzo de la sección
         self.section = section  # referencia a la definicion de la sección
+        # parte (hoja o libro) de la salida xlsx a la que pertenece la sección, ver Report.process
+        # las filas de cada parte empiezan en 0
+        self.part = part
         # contiene las líneas de la sección que formarán la salida
         # incluye, si existen, la línea de encabezados y pies de la sección
         self.lines = []
+        # acumuladores por columna de los valores de las filas del cuerpo, para evaluar las fórmulas de los pies
+        # sin recorrer la sección. Solo se mantienen cuando se evalúan las fórmulas
+        self.first_body_row = None
+        self.last_body_row = None
+        self.aggregates = {}  # columna -> RunningAggregate
 
     @property
     def start_row(self):
@@ -376,6 +498,38 @@ class CellGroup:
         # excel cuenta las filas desde 1 en vez desde 0
         return self.start_row + 1
 
+    def add_body_cells(self, row_index, cells):
+        # acumula los valores de las celdas de una fila del cuerpo
+        # las fórmulas ya tienen que estar evaluadas, si no, su columna no se puede resolver con el acumulador
+        if self.first_body_row is None:
+            self.first_body_row = row_index
+        self.last_body_row = row_index
+        for cell in cells:
+            aggregate = self.aggregates.get(cell.col)
+            if aggregate is None:
+                aggregate = self.aggregates[cell.col] = RunningAggregate()
+            if not cell.field.is_calculated:
+                aggregate.add(cell.value)
+            elif cell.computed is not None:
+                aggregate.add(cell.computed)
+            else:
+                aggregate.complete = False
+
+    def range_aggregate(self, first_row, first_col, last_row, last_col):
+        # acumulador con los valores del rango si el rango cubre exactamente las filas del cuerpo de la sección
+        # si no, o si alguna de sus columnas no tiene todos sus valores, devuelve None
+        if first_row != self.first_body_row or last_row != self.last_body_row:
+            return None
+        if first_col == last_col:
+            aggregate = self.aggregates.get(first_col, RunningAggregate())
+        else:
+            # varias columnas: se combinan sus acumuladores
+            aggregate = RunningAggregate(sketch_capacity=None)
+            for col in range(first_col, last_col + 1):
+                if col in self.aggregates:
+                    aggregate.merge(self.aggregates[col])
+        return aggregate if aggregate.complete else None
+
     def __str__(self):
         cells = [f'{line}' for line in self.lines]
         return f'CellGroup(\nindex={self.index},\nstart_row={self.start_row},\nlines=[\n{string_list(cells)}\n]\n)'
@@ -387,24 +541,76 @@ class CellGroup:
 class Report:
     # Clase para procesar los listados
 
-    def __init__(self, config_file):
+    # atributos que forman la definición del informe
+    # son los que se guardan en la caché de configuraciones
+    definition_attributes = (
+        'sections', 'styles', 'exclude_filters', 'columns_width', 'encoding', 'record_length', 'delimiter', 'quoted',
+        'title', 'description', 'include_filters'
+    )
+
+    def __init__(self, config_file, cache_folder=None):
         # carga el fichero de configuración para procesar el listado
+        # si se indica una carpeta de caché, se intenta cargar la definición ya construida desde ella
 
         self._same_row = False
-        
-        # definición de los parámetros de cada sección del listado
-        self.sections = []
-        
-        self.styles = {}
+
+        # evaluador de fórmulas, solo existe mientras se procesa un listado con evaluate_formulas
+        self._evaluator = None
+
+        # fichero de configuración del que procede la definición
+        self.conf_file = config_file
         
         # grupos procesados
         self.cell_groups = []
         
         # contador de filas
         self.rows = 0
+
+        # número de partes (hojas o libros de Excel) en las que se ha dividido la salida
+        self.parts = 1
+
+        # informe del avance del proceso (ver progress.py), None si no se informa
+        self.progress = None
+
+        # qué se hace con los valores que no se pueden convertir (ver rejects.py), None para detener el proceso
+        self.error_policy = None
+        # campos que no se han podido convertir en la línea en curso: (campo, valor, motivo)
+        self._rejected = []
+        # campos que sustituyen a los que no se han podido convertir, por campo y acción
+        self._substitute_fields = {}
+
+        # líneas del último listado procesado: total, descartadas por los filtros de exclusión y que no concuerdan
+        # con ningún filtro de inclusión, y líneas cuyos campos no se han podido convertir a su tipo
+        self.lines = 0
+        self.excluded_lines = 0
+        self.unmatched_lines = 0
+        self.conversion_failures = 0
+
+        definition = load_config(config_file, cache_folder) if cache_folder else None
+
+        if definition:
+            for attribute in self.definition_attributes:
+                setattr(self, attribute, definition[attribute])
+        else:
+            self._load_config(config_file)
+            if cache_folder:
+                save_config(config_file, cache_folder, self.definition)
+
+    @property
+    def definition(self):
+        # definición del informe, sin los datos procesados
+        return {attribute: getattr(self, attribute) for attribute in self.definition_attributes}
+
+    def _load_config(self, config_file):
+        # construye la definición del informe a partir del fichero de configuración
+
+        # definición de los parámetros de cada sección del listado
+        self.sections = []
+        
+        self.styles = {}
         
         # lee el archivo de configuración
-        report_config = report_grammar.parse_file(config_file, parse_all=True)
+        report_config = config_grammar().report_grammar.parse_file(config_file, parse_all=True)
         
         # creamos un estilo por defecto sin opciones para las celdas que no definan ningún estilo
         # self.styles[None] = {}
@@ -418,11 +624,19 @@ class Report:
         self.exclude_filters = [re.compile(exclude_filter) for exclude_filter in report_config.exclude_filters]
         
         # Ancho de las columnas
-        self.columns_width = report_config.columns_width
+        self.columns_width = list(report_config.columns_width)
 
         # si no se especifica ningún encoding, se usa utf-16 por defecto
         self.encoding = report_config.get('encoding', default_encoding)
 
+        # longitud de los registros si los ficheros de entrada no tienen separadores de línea
+        self.record_length = report_config.get('record_length')
+
+        # separador de las columnas si los ficheros de entrada son delimitados (csv, tsv,...)
+        # con quoted los valores pueden ir entre comillas
+        self.delimiter = report_config.get('delimiter')
+        self.quoted = bool(report_config.get('quoted'))
+
         # título del listado
         self.title = report_config.title
 
@@ -456,7 +670,12 @@ class Report:
                     include_filters=fieldset.include_filters
                 )
                 for index, field in enumerate(fieldset.fields):
-                    current_fieldset.fields.append(Field(field, index))
+                    current_field = Field(field, index)
+                    if current_field.by_column and not self.delimiter:
+                        message = f'Columna {index}: los campos @N necesitan la directiva delimiter'
+                        logger.error(message)
+                        raise FieldException(message)
+                    current_fieldset.fields.append(current_field)
 
                 for include_filter in current_fieldset.include_filters:
                     self.include_filters.append((include_filter, current_section, current_fieldset))
@@ -470,6 +689,10 @@ class Report:
         result += f'title="{self.title}",\n'
         result += f'description="{self.description}",\n'
         result += f'encoding="{self.encoding}",\n'
+        result += f'record_length={self.record_length},\n'
+        delimiter = f'"{self.delimiter}"' if self.delimiter else None
+        result += f'delimiter={delimiter},\n'
+        result += f'quoted={self.quoted},\n'
         result += f'columns_width={self.columns_width},\n'
         patterns = [f'"{exclude_filter.pattern}"' for exclude_filter in self.exclude_filters]
         result += f'exclude_filters=[{string_list(patterns, " ")}],\n'
@@ -508,6 +731,7 @@ class Report:
 
         new_row = fields_group.new_row if hasattr(fields_group, 'new_row') else False
         keep_in_row = fields_group.keep_in_row if hasattr(fields_group, 'keep_in_row') else False
+        same_row = self._same_row
 
         if self._same_row and not new_row:
             # mantenerse en la línea actual
@@ -519,15 +743,23 @@ class Report:
                 self._same_row = False
             row = []
 
-        col_index = len(row)
+        col_index = first_col = len(row)
+
+        # columnas de la línea si el listado es delimitado, se divide una sola vez para todos los campos
+        columns = None
 
         for field in fields_group.fields:
 
             if field.is_extracted:
                 # extraemos los campos de la línea actual
-                # los campos son de longitud fija
-                left, right = field.value
-                original_value = line[left:right]
+                if field.column is None:
+                    # los campos son de longitud fija
+                    left, right = field.value
+                    original_value = line[left:right]
+                else:
+                    if columns is None:
+                        columns = self.split_line(line)
+                    original_value = columns[field.column] if field.column < len(columns) else ''
             elif field.type == field_types.empty:
                 # insertamos celdas vacías
                 for i in range(field.value):
@@ -542,7 +774,17 @@ class Report:
                 else:
                     original_value = field.value
 
-            row.append(Cell(col_index, r_index, field, original_value))
+            try:
+                cell = Cell(col_index, r_index, field, original_value)
+            except ValueError as e:
+                # el valor no se puede convertir al tipo del campo (ver rejects.py)
+                cell = self._rejected_cell(col_index, r_index, field, original_value, e)
+                if cell is None:
+                    # se descarta la línea: quitamos de la fila en curso las celdas que ya se habían añadido
+                    del (row.cells if isinstance(row, Row) else row)[first_col:]
+                    self._same_row = same_row
+                    raise RejectedLine(str(e))
+            row.append(cell)
             col_index += 1
 
         # guardamos la lista de campos como una tupla
@@ -551,6 +793,16 @@ class Report:
                 self.cell_groups[g_index].lines[-1] = Row(fields_group, row)
             else:
                 self.cell_groups[g_index].lines.append(Row(fields_group, row))
+            if self._evaluator:
+                # evaluamos las fórmulas de la fila según se procesa el listado
+                self._evaluator.add_row(r_index, row)
+                if not (fields_group.is_header or fields_group.is_footer):
+                    # acumulamos los valores del cuerpo para resolver los pies de la sección
+                    cell_group = self.cell_groups[g_index]
+                    # si la fila continúa una anterior (keep_in_row), solo se acumulan las celdas nuevas
+                    cells = row.cells if isinstance(row, Row) else row
+                    cell_group.add_body_cells(r_index, cells[first_col:])
+                    self._evaluator.add_group(cell_group)
             if keep_in_row:
                 self._same_row = True
             else:
@@ -559,22 +811,270 @@ class Report:
 
         return r_index
 
-    def process(self, report_file):
+    def _rejected_cell(self, col_index, r_index, field, original_value, error):
+        # celda de un valor que no se puede convertir al tipo de su campo, según la política de errores:
+        # una celda vacía (empty) o con el texto del listado (raw), None si se descarta la línea (skip)
+        # sin política (fail) se lanza el error
+        policy = self.error_policy
+        if policy is None or policy.on_error == 'fail':
+            raise error
+        self._rejected.append((field, original_value, str(error)))
+        if policy.on_error == 'skip':
+            return None
+        substitute = self._substitute_field(field, policy.on_error)
+        return Cell(col_index, r_index, substitute, original_value if policy.on_error == 'raw' else None)
+
+    def _substitute_field(self, field, action):
+        # campo de las celdas que sustituyen a los valores de field que no se pueden convertir, mantiene el nombre
+        # y el estilo del original: de texto (raw) o vacío (empty)
+        substitute = self._substitute_fields.get((field, action))
+        if substitute is None:
+            substitute = copy.copy(field)
+            if action == 'raw':
+                substitute.type = field_types.string
+            else:
+                substitute.type = field_types.empty
+                substitute.value = 1
+            self._substitute_fields[(field, action)] = substitute
+        return substitute
+
+    def _reject_line(self, report_file, number_line, section, fieldset, line):
+        # registra la línea en curso, con los campos que no se han podido convertir
+        self.conversion_failures += 1
+        self.error_policy.reject(
+            report_file, number_line, self.sections.index(section), section.body.index(fieldset), line,
+            list(self._rejected), self.conversion_failures
+        )
+        self._rejected.clear()
+
+    def _start_cell_group(self, section, line, row_index, group_index, part):
+        # comienza una nueva sección en el listado, con su fila de encabezados si existe
+        # las secciones anteriores ya están terminadas
+        self._emit_cell_groups()
+        cell_group = CellGroup(group_index, row_index, section, part)
+        self.cell_groups.append(cell_group)
+
+        for header in section.header:
+            row_index = self._store_row(header, line, row_index, cell_group.index)
+
+        return cell_group, row_index
+
+    def _close_cell_group(self, cell_group, line, row_index):
+        #  ponemos los pies de columna de la sección, si existen
+        for footer in cell_group.section.footer:
+            row_index = self._store_row(footer, line, row_index, cell_group.index)
+        return row_index
+
+    def _emit_cell_groups(self, final=False):
+        # pasa a on_cell_group (ver process) las secciones terminadas que todavía no se le han pasado
+        # si hay fórmulas aplazadas, pueden depender de filas posteriores y se espera a que se evalúen
+        if not self._on_cell_group:
+            return
+        if not final and self._evaluator and any(not cell.evaluated for cell in self._evaluator.pending):
+            return
+        done = len(self.cell_groups)
+        for cell_group in self.cell_groups[self._emitted:done]:
+            self._on_cell_group(cell_group)
+        self._emitted = done
+
+    def _definition_refs(self):
+        # referencias de los fieldsets y campos de la definición: [sección, parte, fieldset(, campo)]
+        # para guardar en el checkpoint del modo seguimiento las filas sin terminar (ver follow.py)
+        refs = {}
+        for section_index, section in enumerate(self.sections):
+            for part in ('header', 'body', 'footer'):
+                for fieldset_index, fieldset in enumerate(getattr(section, part)):
+                    refs[id(fieldset)] = [section_index, part, fieldset_index]
+                    for field_index, field in enumerate(fieldset.fields):
+                        refs[id(field)] = [section_index, part, fieldset_index, field_index]
+        # los campos que sustituyen a valores que no se han podido convertir (ver _rejected_cell)
+        for (field, action), substitute in self._substitute_fields.items():
+            refs[id(substitute)] = refs[id(field)] + [action]
+        return refs
+
+    def _definition_object(self, ref):
+        # fieldset o campo de una referencia de _definition_refs
+        section_index, part, fieldset_index, *field_ref = ref
+        fieldset = getattr(self.sections[section_index], part)[fieldset_index]
+        if not field_ref:
+            return fieldset
+        field = fieldset.fields[field_ref[0]]
+        return self._substitute_field(field, field_ref[1]) if len(field_ref) > 1 else field
+
+    def follow_state(self, cell_group, row_index):
+        # estado del proceso para continuarlo en otra ejecución: sección abierta, fila actual, fila sin terminar
+        # (la siguiente línea puede continuarla, ver keep_in_row) y secciones ya procesadas
+        state = {
+            'row_index': row_index,
+            'same_row': self._same_row,
+            'processed': [index for index, section in enumerate(self.sections) if section.processed],
+            'cell_group': None,
+        }
+        if cell_group.section:
+            refs = self._definition_refs()
+            pending = None
+            if self._same_row and cell_group.lines:
+                row = cell_group.lines[-1]
+                pending = {
+                    'fieldset': refs[id(row.fieldset)],
+                    'cells': [[refs[id(cell.field)], cell.col, cell.row, cell.original_value] for cell in row],
+                }
+            state['cell_group'] = {
+                'section': self.sections.index(cell_group.section),
+                'start_row': cell_group._start_row,
+                'pending': pending,
+            }
+        return state
+
+    def restore_follow_state(self, state):
+        # recupera el estado guardado con follow_state, devuelve la sección abierta, la fila actual
+        # y el índice de la siguiente sección
+        if not state:
+            return CellGroup(), 0, 0
+        self._same_row = state['same_row']
+        for index in state['processed']:
+            self.sections[index].processed = True
+        group = state['cell_group']
+        if not group:
+            return CellGroup(), state['row_index'], 0
+        cell_group = CellGroup(0, group['start_row'], self.sections[group['section']])
+        self.cell_groups.append(cell_group)
+        pending = group['pending']
+        if pending:
+            cells = [
+                Cell(col, row, self._definition_object(ref), original_value)
+                for ref, col, row, original_value in pending['cells']
+            ]
+            cell_group.lines.append(Row(self._definition_object(pending['fieldset']), cells))
+        return cell_group, state['row_index'], 1
+
+    def follow_checkpoint(self, follow, cell_group, row_index):
+        # pasa al checkpoint las filas terminadas que todavía no se han escrito y el estado del proceso
+        # la última fila de la sección abierta no está terminada si la siguiente línea puede continuarla
+        rows = []
+        group_position, row_position = written = follow.written
+        for position in range(group_position, len(self.cell_groups)):
+            lines = self.cell_groups[position].lines
+            end = len(lines)
+            if self._same_row and lines and self.cell_groups[position] is cell_group:
+                end -= 1
+            rows.extend(lines[row_position if position == group_position else 0:end])
+            written = position, end
+        follow.save(rows, self.follow_state(cell_group, row_index), written)
+
+    def _new_part(self):
+        # las filas de la nueva parte empiezan en 0, las fórmulas pendientes de la parte anterior
+        # ya no pueden depender de ninguna otra celda
+        if self._evaluator:
+            self._evaluator.finish()
+            self._evaluator = Evaluator()
+
+    def split_line(self, line):
+        # columnas de una línea de un listado delimitado
+        line = line.rstrip('\r\n')
+        if self.quoted:
+            # los valores pueden estar entre comillas y contener el delimitador
+            return next(csv.reader((line,), delimiter=self.delimiter), [])
+        return line.split(self.delimiter)
+
+    def read_lines(self, report_file, read_ahead=False, errors=None, on_open=None):
+        # líneas del listado: las líneas del fichero o, si se ha definido record_length, sus registros
+        # on_open recibe el fichero abierto tal como está en disco (ver commons.open_binary)
+        if self.record_length:
+            return file_by_record(
+                report_file, self.record_length, encoding=self.encoding, errors=errors, read_ahead_thread=read_ahead,
+                on_open=on_open
+            )
+        return file_by_line(
+            report_file, encoding=self.encoding, errors=errors, read_ahead_thread=read_ahead, on_open=on_open
+        )
+
+    def process(
+            self, report_file, evaluate_formulas=False, max_rows=None, read_ahead=False, on_cell_group=None,
+            follow=None
+    ):
         # procesa el listado
+        # el listado puede estar comprimido (ver commons.open_input), con read_ahead se lee en un hilo aparte
+        # si se indica on_cell_group, se le llama con cada sección en cuanto está terminada, para escribir la salida
+        # mientras se procesa el listado
+        # si se indica follow (un follow.Checkpoint), solo se procesan las líneas añadidas desde la ejecución
+        # anterior, continuando con su estado, y las filas se añaden a la salida del checkpoint
+        # si evaluate_formulas es True, se calcula el valor de las fórmulas de los campos function
+        # si se indica max_rows, la salida se divide en partes (hojas o libros de Excel) de como mucho max_rows filas:
+        # cuando una fila del cuerpo de una sección no cabe en la parte actual, se ponen los pies de la sección
+        # (que resumen las filas de esa parte) y la sección continúa en una nueva parte repitiendo sus encabezados
+
+        # la misma definición puede procesar varios listados, reiniciamos el estado del anterior
+        self._same_row = False
+        self.rows = 0
+        self.parts = 1
+        self.conversion_failures = 0
+        for section in self.sections:
+            section.processed = False
+
+        self._evaluator = Evaluator() if evaluate_formulas else None
+        self._on_cell_group = on_cell_group
+        self._emitted = 0
+
+        # campos que no se han podido convertir en la línea en curso, solo con una política de errores
+        rejected = self._rejected
+        rejected.clear()
 
         # contendrá las líneas del listado una vez procesado
         self.cell_groups = []
         current_cell_group = CellGroup()
         group_index = 0
+        part = 0
 
         # iteramos sobre el listado
         row_index = 0
 
+        if follow:
+            # continuamos donde terminó la ejecución anterior (ver follow.py)
+            current_cell_group, row_index, group_index = self.restore_follow_state(follow.start())
+            if follow.rotated and current_cell_group.section:
+                # el listado anterior ya no va a continuar su última sección, ponemos sus pies
+                row_index = self._close_cell_group(current_cell_group, follow.last_line, row_index)
+                if current_cell_group.section.blank_row:
+                    row_index += 1
+                self._same_row = False
+                for section in self.sections:
+                    section.processed = False
+                current_cell_group = CellGroup()
+
+        # el avance se comprueba cada progress_lines líneas, sin informe solo cuesta comprobar que no lo hay
+        progress = self.progress
+        if progress:
+            progress.start(self, report_file, follow.offset if follow else 0)
+        on_open = progress.opened if progress else None
+
+        if follow:
+            lines = follow.lines(self.record_length, self.encoding, on_open)
+            first_line = follow.line
+        else:
+            lines = self.read_lines(report_file, read_ahead=read_ahead, on_open=on_open)
+            first_line = 0
+        number_line = first_line
+        excluded_lines = unmatched_lines = 0
+
+        # diagnóstico de cada línea descartada, solo con el nivel de log DEBUG
+        debug = logger.isEnabledFor(logging.DEBUG)
+
         try:
-            for number_line, line in enumerate(file_by_line(report_file, encoding=self.encoding), 1):
+            for number_line, line in enumerate(lines, first_line + 1):
+
+                if progress and not number_line % progress_lines:
+                    progress.update(number_line - first_line)
+
+                if follow and not number_line % follow.batch_lines:
+                    # el checkpoint se guarda con el estado de la línea anterior
+                    self.follow_checkpoint(follow, current_cell_group, row_index)
 
                 # descartamos las líneas que coinciden con algún filtro de exlcusión
                 if self._exclude_line(line):
+                    excluded_lines += 1
+                    if debug:
+                        logger.debug(f'{report_file}:{number_line}: linea excluida: {line.rstrip()!r}')
                     continue
 
                 # Probamos cada línea contra todos los include_filters de todas las secciones
@@ -583,6 +1083,9 @@ class Report:
 
                 if not include_filter:
                     # avanzamos a la siguiente linea
+                    unmatched_lines += 1
+                    if debug:
+                        logger.debug(f'{report_file}:{number_line}: linea sin filtro de inclusion: {line.rstrip()!r}')
                     continue
 
                 if not (section.process_only_one_time and section.processed):
@@ -592,57 +1095,134 @@ class Report:
 
                         if current_cell_group.section:
                             #  ponemos los pies de columna de la sección actual, si existen
-                            for footer in current_cell_group.section.footer:
-                                row_index = self._store_row(
-                                    footer,
-                                    line,
-                                    row_index,
-                                    current_cell_group.index
-                                )
+                            row_index = self._close_cell_group(current_cell_group, line, row_index)
 
                             if current_cell_group.section.blank_row:
                                 # línea en blanco al final de la sección
                                 row_index += 1
 
+                        if max_rows and row_index and \
+                                row_index + len(section.header) + 1 + len(section.footer) > max_rows:
+                            # la sección no cabe en la parte actual
+                            part += 1
+                            row_index = 0
+                            self._new_part()
+
                         # hemos terminado con la sección anterior, comenzamos una nueva
-                        current_cell_group = CellGroup(group_index, row_index, section)
-                        self.cell_groups.append(current_cell_group)
+                        current_cell_group, row_index = self._start_cell_group(
+                            section, line, row_index, group_index, part
+                        )
                         group_index += 1
 
-                        # ponemos la fila de encabezados de la nueva sección, si existe
-                        for header in current_cell_group.section.header:
-                            row_index = self._store_row(
-                                header,
-                                line,
-                                row_index,
-                                current_cell_group.index
-                            )
+                    elif max_rows and not (self._same_row and not fieldset.new_row) and \
+                            row_index > len(section.header) and row_index + 1 + len(section.footer) > max_rows:
+                        # la línea no cabe en la parte actual, cerramos la sección en esta parte
+                        # y la continuamos en la siguiente
+                        self._close_cell_group(current_cell_group, line, row_index)
+                        self._same_row = False
+                        part += 1
+                        row_index = 0
+                        self._new_part()
+                        current_cell_group, row_index = self._start_cell_group(
+                            section, line, row_index, group_index, part
+                        )
+                        group_index += 1
 
                     # guardamos la línea actual
-                    row_index = self._store_row(fieldset, line, row_index, current_cell_group.index)
+                    try:
+                        row_index = self._store_row(fieldset, line, row_index, current_cell_group.index)
+                    except RejectedLine:
+                        # la línea tiene valores que no se pueden convertir y se descarta
+                        self._reject_line(report_file, number_line, section, fieldset, line)
+                        continue
+                    if rejected:
+                        self._reject_line(report_file, number_line, section, fieldset, line)
                     self.rows = row_index  # actualizamos el contador de filas
 
                     # marcamos la sección actual como procesada por si solo hay que procesarla una vez
                     section.processed = True
 
+        except BrokenPipeError:
+            # la salida estándar se ha cerrado mientras se escribía el listado (ver stream_report)
+            raise
         except Exception as e:
+            if isinstance(e, ValueError):
+                # algún campo de la línea no se ha podido convertir a su tipo
+                self.conversion_failures += 1
             logger.error('Error: Ha ocurrido un error inesperado')
             logger.error(f'Error: Fichero: {report_file} - Numero de linea: {number_line}')
             raise e
+        finally:
+            # termina el hilo de lectura anticipada si el proceso se interrumpe
+            lines.close()
+            self.lines = number_line - first_line
+            self.excluded_lines = excluded_lines
+            self.unmatched_lines = unmatched_lines
+
+        if progress:
+            progress.finish(self.lines)
+
+        if follow:
+            # la última sección puede continuar en la siguiente ejecución, no se ponen sus pies
+            self.follow_checkpoint(follow, current_cell_group, row_index)
+            self._on_cell_group = None
+            return
 
         # insertamos el pie de la última sección, si existe
-        if current_cell_group:
-            #  ponemos los pies de columna de la sección actual, si existen
-            for footer in current_cell_group.section.footer:
-                row_index = self._store_row(
-                    footer,
-                    line,
-                    row_index,
-                    current_cell_group.index
-                )
+        # si ninguna línea del listado se ha procesado no hay sección
+        if current_cell_group.section:
+            self._close_cell_group(current_cell_group, line, row_index)
 
-    def xlsx(self, file_name, sheet_name=None):
+        # número de partes de la salida
+        self.parts = part + 1
+
+        if self._evaluator:
+            # evaluamos las fórmulas que dependían de celdas posteriores
+            self._evaluator.finish()
+
+        self._emit_cell_groups(final=True)
+        self._on_cell_group = None
+
+    def xlsx(self, file_name, sheet_name=None, tables=False, split_books=False):
         # listado de salida en formato XLS
+        # si tables es True, las secciones con encabezado se escriben como tablas de Excel
+        # si la salida se ha dividido en partes (ver process), cada parte se escribe en una hoja del libro
+        # o, si split_books es True, en un libro distinto: fichero.xlsx, fichero_2.xlsx, fichero_3.xlsx,...
+        # devuelve la lista de ficheros generados
+
+        parts = [[] for _ in range(self.parts)]
+        for cell_group in self.cell_groups:
+            parts[cell_group.part].append(cell_group)
+
+        file_name = pathlib.Path(file_name)
+        files = []
+        book = styles = None
+
+        for part, cell_groups in enumerate(parts):
+            if book is None or split_books:
+                if book:
+                    book.close()
+                part_file = file_name.with_name(f'{file_name.stem}_{part + 1}{file_name.suffix}') if part else file_name
+                book, styles = self.xlsx_book(part_file)
+                files.append(part_file)
+
+            if split_books or not part:
+                part_sheet_name = sheet_name
+            else:
+                # con un nombre de hoja indicado, las hojas siguientes se numeran; si no, xlsxwriter las llama Sheet2,...
+                part_sheet_name = f'{sheet_name} ({part + 1})' if sheet_name else None
+
+            self.xlsx_sheet(book, styles, part_sheet_name, cell_groups, tables)
+
+        # salvamos el fichero
+        book.close()
+
+        return files
+
+    def xlsx_book(self, file_name):
+        # crea un libro de Excel vacío con los estilos del informe
+
+        import xlsxwriter
 
         book = xlsxwriter.Workbook(file_name)  # libro vacio
         # añadimos el autor y el nombre de la aplicación al libro de Excel
@@ -650,116 +1230,729 @@ class Report:
         book.set_properties(properties)
         book.set_custom_property('Aplicación', app_name)
 
-        sheet = book.add_worksheet(sheet_name)  # creamos una hoja de cálculo
+        return book, self.xlsx_styles(book)
 
+    def xlsx_styles(self, book):
+        # registra los estilos del informe en el libro y los devuelve indexados por su identificador
         styles = {}
 
         for style_id in self.styles.keys():
             style = Style(self.styles[style_id])
             styles[style_id] = book.add_format(style.style)
 
+        # los campos de fecha cuyo estilo no tiene formato numérico se mostrarían como números en Excel
+        # usan su estilo con el formato de fecha por defecto (ver commons.field_style)
+        for field in self.fields():
+            key = (field.style_id, field.type)
+            if field.type in date_fields and key not in styles:
+                style = Style(self.styles[field.style_id]).style if field.style_id in self.styles else {}
+                if 'num_format' not in style:
+                    styles[key] = book.add_format({**style, 'num_format': excel_date_formats[field.type]})
+
+        return styles
+
+    def fields(self):
+        # todos los campos de la definición del informe
+        for section in self.sections:
+            for fieldset in itertools.chain(section.header, section.body, section.footer):
+                yield from fieldset.fields
+
+    def add_source_column(self, source, cell_groups=None):
+        # añade al final de las filas del cuerpo una columna con el fichero de origen del listado
+        # y su título al final de la última fila de encabezados de cada sección
+        # por defecto en todas las secciones del listado
+        for cell_group in self.cell_groups if cell_groups is None else cell_groups:
+            headers = [line for line in cell_group.lines if line.is_header]
+            for line in cell_group.lines:
+                if line.is_body:
+                    line.append(Cell(len(line), line.cells[0].row, source_field, source))
+                elif headers and line is headers[-1]:
+                    line.append(Cell(len(line), line.cells[0].row, source_field, source_field.name))
+
+    def xlsx_sheet(self, book, styles, sheet_name, cell_groups, tables):
+        # escribe las secciones indicadas en una nueva hoja del libro
+
+        # creamos una hoja de cálculo, con la preparación de fórmulas simplificada para las que no llaman a funciones
+        from xlsx_worksheet import Worksheet
+        sheet = book.add_worksheet(sheet_name, worksheet_class=Worksheet)
+
         for column, column_width in enumerate(self.columns_width):
             sheet.set_column(column, column, column_width)
 
-        for cell_group in self.cell_groups:
+        # método de escritura y formato de las celdas de cada campo, se resuelven una sola vez por campo
+        writers = {field: (xlsx_writer(sheet, field), field_style(styles, field)) for field in self.fields()}
+        writers[source_field] = (xlsx_writer(sheet, source_field), None)
+
+        for cell_group in cell_groups:
+            table = ExcelTable.from_cell_group(cell_group, styles) if tables else None
+            if table:
+                sheet.add_table(table.first_row, 0, table.last_row, table.last_col, table.options)
+                # las celdas de la tabla se vuelven a escribir con su estilo y, en las columnas calculadas
+                # y la fila de totales, con las fórmulas de la tabla
+                formulas = table.formulas
+            else:
+                formulas = None
             for line in cell_group.lines:
                 for cell in line:
-                    style = styles[cell.field.style_id] if cell.field.style_id in styles else None
-                    if cell.field.is_calculated and cell.value.startswith("="):
-                        # campos con fórmulas
-                        sheet.write_formula(cell.row, cell.col, cell.value, style)
+                    try:
+                        write, style = writers[cell.field]
+                    except KeyError:
+                        # campos que no son de la definición: los que sustituyen a valores que no se han podido
+                        # convertir (ver rejects.py) o los de otro informe al unir listados
+                        write, style = writers[cell.field] = (
+                            xlsx_writer(sheet, cell.field), field_style(styles, cell.field)
+                        )
+                    if formulas and (cell.row, cell.col) in formulas:
+                        # fórmulas de la tabla (columnas calculadas y fila de totales)
+                        computed = cell.computed if cell.computed is not None else 0
+                        sheet.write_formula(cell.row, cell.col, formulas[(cell.row, cell.col)], style, computed)
                     else:
-                        # campos normales
-                        sheet.write(cell.row, cell.col, cell.value, style)
+                        write(cell, style)
 
-        # salvamos el fichero
-        book.close()
+
+def xlsx_writer(sheet, field):
+    # elige el método de xlsxwriter con el que se escriben las celdas de un campo
+    # así no hay que averiguar el tipo del valor de cada celda al escribirla (como hace sheet.write)
+
+    if field.is_calculated and isinstance(field.value, str) and field.value.startswith('='):
+        # campos con fórmulas
+        def write(cell, style):
+            # si se ha evaluado la fórmula, guardamos su resultado como valor en caché
+            computed = cell.computed
+            sheet.write_formula(cell.row, cell.col, cell.value, style, 0 if computed is None else computed)
+
+    elif field.type == field_types.empty:
+        def write(cell, style):
+            sheet.write_blank(cell.row, cell.col, None, style)
+
+    elif field.is_numeric:
+        def write(cell, style):
+            sheet.write_number(cell.row, cell.col, cell.value, style)
+
+    elif field.type in date_fields:
+        def write(cell, style):
+            value = cell.value
+            if value is None:
+                sheet.write_blank(cell.row, cell.col, None, style)
+            else:
+                sheet.write_datetime(cell.row, cell.col, value, style)
+
+    elif field.type in (field_types.string, field_types.fixed) or isinstance(field.value, str):
+        def write(cell, style):
+            value = cell.value
+            if value and value[0] not in '={' and ':' not in value:
+                sheet.write_string(cell.row, cell.col, value, style)
+            else:
+                # cadenas vacías y las que pueden ser fórmulas o enlaces, xlsxwriter decide cómo escribirlas
+                sheet.write(cell.row, cell.col, value, style)
+
+    else:
+        # resto de campos (constantes numéricas,...)
+        def write(cell, style):
+            sheet.write(cell.row, cell.col, cell.value, style)
+
+    return write
+
+
+def load_report(conf_file, cache_folder=None):
+    # carga la definición de un informe informando de los errores del fichero de configuración
+    try:
+        return Report(conf_file, cache_folder)
+    except Exception as e:
+        # pyparsing solo está importado si se ha interpretado el fichero de configuración
+        from pyparsing import ParseException
+        if isinstance(e, ParseException):
+            logger.error(f'Ha ocurrido un error interpretando el archivo {conf_file}')
+            logger.error(f'Linea {e.lineno}, Columna {e.col}:\n"{e.line}"')
+        raise e
+
+
+class ReportRouter:
+    # Elige la definición de informe que corresponde a cada fichero de entrada
+    # Carga todas las definiciones de una carpeta y las reutiliza para todos los ficheros
+    # Para decidir, lee las primeras líneas de cada fichero y cuenta cuántas procesaría cada definición:
+    # las que no descartan sus filtros de exclusión y concuerdan con alguno de sus filtros de inclusión
+    # y cuyos campos extraídos se pueden convertir al tipo indicado (una línea de otro informe suele fallar)
+    # Los filtros que aceptan una línea vacía (".*") aceptan cualquier línea y no dicen nada del tipo de fichero,
+    # las líneas que concuerdan con ellos solo cuentan si ninguna otra definición procesa alguna línea
+    # Si hay empate, se prefiere la definición cuyo título aparece en esas líneas
+
+    def __init__(self, conf_folder, cache_folder=None, sample_lines=default_sample_lines, pattern='*.conf'):
+        self.sample_lines = sample_lines
+        self.reports = []
+
+        for conf_file in sorted(pathlib.Path(conf_folder).glob(pattern)):
+            try:
+                self.reports.append(load_report(conf_file, cache_folder))
+            except Exception as e:
+                logger.warning(f'Se ignora el fichero {conf_file}, no es una definicion de informe valida: {e}')
+
+        if not self.reports:
+            message = f'No hay ninguna definicion de informe valida en la carpeta {conf_folder}'
+            logger.error(message)
+            raise RouteException(message)
+
+    def _sample(self, input_file, report):
+        # primeras líneas del fichero de entrada leídas como las lee la definición de informe
+        # los caracteres que no se puedan decodificar se sustituyen para no fallar con codificaciones ajenas
+        lines = report.read_lines(input_file, errors='replace')
+        try:
+            return list(itertools.islice(lines, self.sample_lines))
+        finally:
+            lines.close()
+
+    @staticmethod
+    def _converts(report, fieldset, line):
+        # comprueba que los campos extraídos de la línea se pueden convertir a su tipo
+        columns = report.split_line(line) if report.delimiter else []
+        try:
+            for field in fieldset.fields:
+                if field.by_column:
+                    Cell(0, 0, field, columns[field.column] if field.column < len(columns) else '')
+                elif field.is_extracted:
+                    Cell(0, 0, field, line[field.left:field.right])
+        except ValueError:
+            return False
+        return True
+
+    def score(self, report, sample):
+        # puntuación de una definición de informe para las líneas de muestra
+        # (líneas procesadas por filtros específicos, el título aparece en las líneas, líneas procesadas)
+        matched = specific = 0
+        for line in sample:
+            if report._exclude_line(line):
+                continue
+            include_filter, _, fieldset = report._match_include_filters(line)
+            if include_filter and self._converts(report, fieldset, line):
+                matched += 1
+                if not include_filter.match(''):
+                    specific += 1
+        title = report.title.strip()
+        return specific, bool(title) and any(title in line for line in sample), matched
+
+    def route(self, input_file):
+        # devuelve la definición de informe que mejor encaja con el fichero de entrada
+
+        samples = {}
+        scores = []
+        for report in self.reports:
+            # las definiciones que leen el fichero de la misma forma comparten las líneas de muestra
+            key = (report.encoding, report.record_length)
+            if key not in samples:
+                samples[key] = self._sample(input_file, report)
+            scores.append((self.score(report, samples[key]), report))
+
+        best_score = max(score for score, _ in scores)
+        best = [report for score, report in scores if score == best_score]
+
+        if not best_score[-1]:
+            message = f'Ninguna definicion de informe procesa las primeras {self.sample_lines} lineas ' \
+                      f'del fichero {input_file}'
+            logger.error(message)
+            raise RouteException(message)
+
+        if len(best) > 1:
+            candidates = string_list((report.conf_file for report in best), ' ')
+            message = f'El fichero {input_file} encaja igual de bien con varias definiciones de informe: {candidates}'
+            logger.error(message)
+            raise RouteException(message)
+
+        logger.info(f'Fichero {input_file}: se usa la definicion {best[0].conf_file}')
+        return best[0]
+
+
+def get_template(templates_folder, output_format):
+    # plantilla de jinja para los formatos de texto
+
+    from jinja2 import Environment, FileSystemLoader
+
+    templates = {
+        output_formats.csv: 'csv.jinja',
+        output_formats.html: 'html.jinja',
+        output_formats.xml: 'xml.jinja',
+        output_formats.json: 'json.jinja'
+    }
+
+    file_loader = FileSystemLoader(templates_folder)
+    env = Environment(loader=file_loader, trim_blocks=True, lstrip_blocks=True)
+    return env.get_template(templates[output_format])
+
+
+def input_path(spool_file):
+    # ruta del fichero de entrada sin la extensión de compresión: listado.txt.gz -> listado.txt
+    # la entrada estándar se llama stdin
+    if spool_file == stdin_name:
+        return pathlib.Path('stdin')
+    in_file = pathlib.Path(spool_file)
+    return in_file.with_suffix('') if in_file.suffix.lower() in compressed_suffixes else in_file
 
 
 def process_report(
         spool_file, report, templates_folder, output_format=default_format,
-        output_folder=".", time_stamp=False, keep_extension=False
+        output_folder=".", time_stamp=False, keep_extension=False, evaluate_formulas=False, excel_tables=False,
+        max_rows=excel_max_rows, split=default_split, source_column=False, partition_by=None,
+        max_open_files=default_max_open_files, read_ahead=False, profiler=null_profiler
 ):
     # Procesa un listado y genera otro con el formato de salida solicitado
+    # devuelve la lista de ficheros generados, la salida xlsx puede dividirse en varios libros (ver Report.xlsx)
+    # y la salida csv en un fichero por cada valor del campo partition_by (ver partition_report)
+    # los ficheros se escriben en una carpeta temporal y solo se mueven a output_folder cuando están completos,
+    # si el proceso falla no queda ninguna salida a medias
+    # profiler mide el coste de cada fase (ver profiler.py)
 
     # procesa el listado de entrada
-    report.process(spool_file)
+    # el límite de filas solo afecta a la salida xlsx
+    # con partition_by siempre se evalúan las fórmulas: en los ficheros de la partición las filas no son las del
+    # listado completo y las referencias de las fórmulas no servirían (ver partition_report)
+    with profiler.instrument(report, sys.modules[__name__]), profiler.stage('process'):
+        report.process(
+            spool_file, evaluate_formulas or bool(partition_by),
+            max_rows if output_format == output_formats.xlsx else None, read_ahead
+        )
 
-    in_file = pathlib.Path(spool_file)
+    in_file = input_path(spool_file)
 
     output_file_name = f'{time_mark() if time_stamp else ""}{in_file.stem}' \
                        f'{in_file.suffix if keep_extension else ""}.{output_format.name}'
 
-    # el fichero de salida tendrá el mismo nombre que el fichero de entrada
-    # más la extension del formato de salida
-    output_file = pathlib.Path.joinpath(output_folder, output_file_name)
+    if source_column:
+        # columna con el fichero de origen
+        report.add_source_column(in_file.name)
 
-    if output_format in (output_formats.csv, output_formats.html, output_formats.xml, output_formats.json):
+    with profiler.instrument_output(sys.modules[__name__]), profiler.stage('write'), \
+            work_folder(output_folder) as temporary_folder:
 
-        templates = {
-            output_formats.csv: 'csv.jinja', 
-            output_formats.html: 'html.jinja', 
-            output_formats.xml: 'xml.jinja', 
-            output_formats.json: 'json.jinja'
-        }
+        # el fichero de salida tendrá el mismo nombre que el fichero de entrada
+        # más la extension del formato de salida
+        output_file = pathlib.Path.joinpath(temporary_folder, output_file_name)
 
-        template_file = templates[output_format]
- 
-        file_loader = FileSystemLoader(templates_folder)
-        env = Environment(loader=file_loader, trim_blocks=True, lstrip_blocks=True)
-        template = env.get_template(template_file)
+        if partition_by:
+            # un fichero csv por cada valor del campo
+            output_files = partition_report(report, partition_by, temporary_folder, output_file.stem, max_open_files)
+
+        elif output_format in text_formats:
+
+            template = get_template(templates_folder, output_format)
+
+            rendered_template = template.render(report=report)
+            if rendered_template:
+                with open(output_file, 'w') as fout:
+                    fout.write(rendered_template)
+
+            output_files = [output_file]
+
+        else:
+            # por defecto, salida en formato xlsx
+            output_files = report.xlsx(output_file, tables=excel_tables, split_books=split == 'book')
+
+        output_files = publish_files(output_files, output_folder)
+
+    for _file in output_files:
+        logger.info(f'Generado fichero {_file}')
+    return output_files
+
+
+def csv_line(line):
+    # línea csv de una fila, igual que la genera la plantilla csv
+    return field_separator.join(str(cell.output_value) if cell.output_value else '' for cell in line) + '\n'
+
+
+class PartitionNames:
+    # Nombre del fichero de cada valor del campo de partition_report
+    # los caracteres que no pueden ir en un nombre de fichero se cambian por _, así que dos valores distintos
+    # (A/B y A B) pueden dar el mismo nombre: el segundo lleva además un resumen de su valor (A_B_1a2b3c4d)
+    # los nombres se comparan sin distinguir mayúsculas, como en los sistemas de ficheros que no las distinguen
+
+    def __init__(self):
+        self._names = {}  # valor -> nombre
+        self._values = {}  # nombre en minúsculas -> valor
+
+    def __call__(self, value):
+        name = self._names.get(value)
+        if name is None:
+            name = re.sub(r'[^\w.-]', '_', value)
+            other = self._values.get(name.casefold(), value)
+            if other != value:
+                name = f'{name}_{hashlib.sha1(value.encode()).hexdigest()[:8]}'
+                logger.warning(f'Los valores "{other}" y "{value}" tienen el mismo nombre de fichero, '
+                               f'para "{value}" se usa {name}')
+            self._names[value] = name
+            self._values[name.casefold()] = value
+        return name
+
+
+def partition_line(line):
+    # línea csv de una fila de un fichero de partition_report, con el resultado de las fórmulas
+    # las fórmulas que no se han podido evaluar se dejan vacías: sus referencias son a las filas del listado completo
+    return field_separator.join(
+        '' if cell.field.is_calculated and cell.computed is None else
+        str(cell.output_value) if cell.output_value else ''
+        for cell in line
+    ) + '\n'
+
+
+def partition_report(report, field_name, output_folder, stem, max_open_files=default_max_open_files):
+    # Escribe las filas del cuerpo de un listado ya procesado en un fichero csv por cada valor del campo
+    # field_name: <stem>_<valor>.csv
+    # cada fichero lleva los encabezados de las secciones de las que tiene filas, los pies no se escriben
+    # porque resumen todas las filas de la sección. Las filas sin el campo no se escriben en ningún fichero
+    # el listado se tiene que haber procesado evaluando las fórmulas (ver partition_line)
+    # los ficheros se mantienen abiertos en un FilePool con como mucho max_open_files abiertos a la vez
+    # devuelve la lista de ficheros generados
+
+    fields = {
+        field for section in report.sections for fieldset in section.body for field in fieldset.fields
+        if field.name == field_name
+    }
+    if not fields:
+        message = f'Error: no existe ningun campo con el nombre {field_name}'
+        logger.error(message)
+        raise FieldException(message)
+
+    names = PartitionNames()
+    with FilePool(max_open_files) as pool:
+        last_group = {}  # fichero -> índice de la última sección de la que se han escrito filas
+        for cell_group in report.cell_groups:
+            headers = [line for line in cell_group.lines if line.is_header]
+            for line in cell_group.lines:
+                if not line.is_body:
+                    continue
+                value = next((cell.output_value for cell in line if cell.field in fields), None)
+                if value is None or value == '':
+                    continue
+                output_file = pathlib.Path.joinpath(output_folder, f'{stem}_{names(str(value))}.csv')
+                fout = pool.get(output_file)
+                if last_group.get(output_file) != cell_group.index:
+                    last_group[output_file] = cell_group.index
+                    for header in headers:
+                        fout.write(partition_line(header))
+                fout.write(partition_line(line))
+
+    return pool.opened
+
+
+def stream_report(
+        spool_file, report, templates_folder, output_format, evaluate_formulas=False, source_column=False,
+        read_ahead=False, output=None, profiler=null_profiler
+):
+    # Procesa un listado y escribe la salida en un formato de texto en output (por defecto la salida estándar)
+    # csv: cada sección se escribe en cuanto está terminada, mientras se procesa el listado
+    # json, xml y html: el documento se escribe por partes según lo genera la plantilla, al terminar el proceso
+
+    output = output or sys.stdout
+    template = get_template(templates_folder, output_format)
+    source = input_path(spool_file).name
+
+    if output_format == output_formats.csv:
 
-        rendered_template = template.render(report=report)
-        if rendered_template:
-            with open(output_file, 'w') as fout:
-                fout.write(rendered_template)
+        def write_cell_group(cell_group):
+            if source_column:
+                report.add_source_column(source, [cell_group])
+            output.write(template.render(report=types.SimpleNamespace(cell_groups=[cell_group])))
+            output.flush()
+
+        # las secciones se escriben durante el proceso, su escritura se mide como parte de él
+        with profiler.instrument(report, sys.modules[__name__]), profiler.instrument_output(sys.modules[__name__]), \
+                profiler.stage('process'):
+            report.process(spool_file, evaluate_formulas, read_ahead=read_ahead, on_cell_group=write_cell_group)
 
     else:
-        # por defecto, salida en formato xlsx
-        report.xlsx(output_file)
+        with profiler.instrument(report, sys.modules[__name__]), profiler.stage('process'):
+            report.process(spool_file, evaluate_formulas, read_ahead=read_ahead)
+        with profiler.instrument_output(sys.modules[__name__]), profiler.stage('write'):
+            if source_column:
+                report.add_source_column(source)
+            for chunk in template.generate(report=report):
+                output.write(chunk)
+            output.flush()
 
-    logger.info(f'Generado fichero {output_file}')
-    return output_file
+    logger.info(f'Procesado fichero {spool_file}')
+
+
+def follow_report(
+        spool_file, report, output_folder=".", keep_extension=False, batch_lines=default_batch_lines,
+        profiler=null_profiler
+):
+    # Procesa solo las líneas añadidas a un listado desde la ejecución anterior y añade sus filas a la salida csv
+    # el estado para continuar se guarda en un checkpoint junto a la salida (ver follow.py)
+    # devuelve la lista de ficheros generados
+
+    in_file = input_path(spool_file)
+    output_file = pathlib.Path.joinpath(
+        output_folder, f'{in_file.stem}{in_file.suffix if keep_extension else ""}.{output_formats.csv.name}'
+    )
+
+    with Checkpoint(spool_file, output_file, config_hash(report.conf_file), csv_line, batch_lines) as checkpoint, \
+            profiler.instrument(report, sys.modules[__name__]), profiler.stage('process'):
+        report.process(spool_file, follow=checkpoint)
+
+    logger.info(f'Actualizado fichero {output_file} con {report.lines} lineas nuevas')
+    return [output_file]
 
   
-def report_processor(args):
+class MergedReport:
+    # Vista de varios listados ya procesados como si fueran uno solo, para las plantillas
+    # de los formatos que no se pueden concatenar (json, xml y html)
+
+    def __init__(self):
+        self.cell_groups = []
+
+    def add(self, report):
+        self.cell_groups.extend(report.cell_groups)
+
+
+def sheet_name(name, used_names):
+    # nombre de hoja válido para Excel y distinto de los ya usados:
+    # como mucho 31 caracteres, sin []:*?/\\ y sin distinguir mayúsculas
+    name = re.sub(r'[\[\]:*?/\\]', '_', name).strip("'")[:31] or 'Sheet'
+    candidate = name
+    number = 1
+    while candidate.lower() in used_names:
+        number += 1
+        suffix = f' ({number})'
+        candidate = f'{name[:31 - len(suffix)]}{suffix}'
+    used_names.add(candidate.lower())
+    return candidate
+
+
+def merge_reports(
+        spool_files, report_for, templates_folder, output_file, output_format=default_format,
+        evaluate_formulas=False, excel_tables=False, max_rows=excel_max_rows, source_column=False, read_ahead=False,
+        profiler=null_profiler, metrics=null_metrics
+):
+    # Procesa varios listados y los escribe en un único fichero de salida
+    # report_for devuelve la definición de informe con la que se procesa cada listado
+    # xlsx: un libro con una hoja por listado (o varias si el listado supera max_rows), los estilos de cada
+    #       definición de informe se registran una sola vez en el libro
+    # csv: los listados se escriben uno detrás de otro según se procesan
+    # json, xml y html: un único documento con las secciones de todos los listados
+    # metrics recoge las métricas de cada listado (ver metrics.py)
+    # devuelve la lista de ficheros generados
+
+    if output_format == output_formats.xlsx:
+        book = None
+        styles = {}  # definición de informe -> estilos registrados en el libro
+        used_names = set()
+        for spool_file in spool_files:
+            with metrics.measure(spool_file) as measured:
+                report = measured.report = report_for(spool_file)
+                with profiler.instrument(report, sys.modules[__name__]), profiler.stage('process'):
+                    report.process(spool_file, evaluate_formulas, max_rows, read_ahead)
+                in_file = input_path(spool_file)
+                with profiler.instrument_output(sys.modules[__name__]), profiler.stage('write'):
+                    if source_column:
+                        report.add_source_column(in_file.name)
+                    if book is None:
+                        book, styles[report] = report.xlsx_book(output_file)
+                    elif report not in styles:
+                        styles[report] = report.xlsx_styles(book)
+                    parts = [[] for _ in range(report.parts)]
+                    for cell_group in report.cell_groups:
+                        parts[cell_group.part].append(cell_group)
+                    for cell_groups in parts:
+                        report.xlsx_sheet(
+                            book, styles[report], sheet_name(in_file.stem, used_names), cell_groups, excel_tables
+                        )
+            logger.info(f'Procesado fichero {spool_file}')
+        with profiler.stage('write'):
+            book.close()
+
+    else:
+        template = get_template(templates_folder, output_format)
+        merged = MergedReport()
+        with open(output_file, 'w') as fout:
+            for spool_file in spool_files:
+                with metrics.measure(spool_file) as measured:
+                    report = measured.report = report_for(spool_file)
+                    with profiler.instrument(report, sys.modules[__name__]), profiler.stage('process'):
+                        report.process(spool_file, evaluate_formulas, read_ahead=read_ahead)
+                    if source_column:
+                        report.add_source_column(input_path(spool_file).name)
+                    if output_format == output_formats.csv:
+                        with profiler.instrument_output(sys.modules[__name__]), profiler.stage('write'):
+                            fout.write(template.render(report=report))
+                    else:
+                        merged.add(report)
+                logger.info(f'Procesado fichero {spool_file}')
+            if output_format != output_formats.csv:
+                with profiler.instrument_output(sys.modules[__name__]), profiler.stage('write'):
+                    fout.write(template.render(report=merged))
+
+    logger.info(f'Generado fichero {output_file}')
+    return [output_file]
+
+
+def report_processor(args, profiler=null_profiler, metrics=null_metrics, progress=None, error_policy=None):
     # Función principal
     # procesa la línea de comandos si existe y procesa los listados indicados
+    # profiler mide el coste de cada fase (ver profiler.py), metrics recoge las métricas de cada listado
+    # (ver metrics.py), progress informa del avance de cada listado (ver progress.py) y error_policy decide qué
+    # se hace con los valores que no se pueden convertir (ver rejects.py)
 
     output_format = args.format  # formato de salida == extensión del fichero de salida
     output_folder = args.output_folder
     templates_folder = args.templates_folder
     time_stamp = args.time_stamp
     keep_extension = args.keep_extension
+    evaluate_formulas = args.evaluate_formulas
+    excel_tables = args.excel_tables
+    max_rows = args.max_rows
+    split = args.split
     conf_file = args.conf_file
+    conf_folder = args.conf_folder
+    cache_folder = args.cache_folder
 
     output_files = []
 
-    # carga el fichero de configuración adecuado para el reporte
-    report = Report(conf_file)
+    if conf_folder:
+        # carga todas las definiciones de la carpeta, cada fichero usará la que mejor le encaje
+        with profiler.stage('load conf'):
+            router = ReportRouter(conf_folder, cache_folder, args.sample_lines)
+        route = profiler.timed('route', router.route)
+        report = None
+    else:
+        # carga el fichero de configuración adecuado para el reporte
+        router = None
+        with profiler.stage('load conf'):
+            report = load_report(conf_file, cache_folder)
+
+    for loaded_report in router.reports if router else [report]:
+        loaded_report.progress = progress
+        loaded_report.error_policy = error_policy
+
+    if args.merge:
+        # todos los listados en un único fichero de salida
+        output_file = pathlib.Path.joinpath(
+            output_folder, f'{time_mark() if time_stamp else ""}{args.merge}.{output_format}'
+        )
+        return merge_reports(
+            args.files, route if router else lambda input_file: report, templates_folder, output_file,
+            output_formats[output_format], evaluate_formulas, excel_tables, max_rows, args.source_column,
+            args.read_ahead, profiler, metrics
+        )
+
+    if args.stdout:
+        # la salida de todos los listados a la salida estándar, uno detrás de otro
+        try:
+            for input_file in args.files:
+                with metrics.measure(input_file) as measured:
+                    if router:
+                        report = route(input_file)
+                    measured.report = report
+                    stream_report(
+                        input_file, report, templates_folder, output_formats[output_format], evaluate_formulas,
+                        args.source_column, args.read_ahead, profiler=profiler
+                    )
+        except BrokenPipeError:
+            # el proceso que lee la salida ha terminado antes (| head), no es un error
+            # la salida estándar se redirige a devnull para que no falle al cerrarse
+            os.dup2(os.open(os.devnull, os.O_WRONLY), sys.stdout.fileno())
+        return output_files
+
+    output_cache = None
+    if args.output_cache:
+        # las salidas de los listados que no han cambiado se reutilizan (ver output_cache.py)
+        conf_hash = config_hash(conf_file) if conf_file else '-'.join(
+            config_hash(loaded_report.conf_file) for loaded_report in router.reports
+        )
+        output_cache = OutputCache(args.output_cache, conf_hash, {
+            'format': output_format,
+            'template': file_hash(pathlib.Path(templates_folder) / f'{output_format}.jinja')
+            if output_formats[output_format] in text_formats else None,
+            'evaluate_formulas': evaluate_formulas,
+            'excel_tables': excel_tables,
+            'max_rows': max_rows if output_format == output_formats.xlsx.name else None,
+            'split': split,
+            'source_column': args.source_column,
+            'partition_by': args.partition_by,
+            'on_error': args.on_error,
+        })
+
+    # ficheros terminados del lote, para poder continuarlo si se interrumpe (ver journal.py)
+    journal = Journal(args.journal, args.resume) if args.journal else None
+    failed_files = []
 
     # procesa todos los nombres de archivos pasados como argumentos
-    for input_file in args.files:
+    try:
+        for input_file in args.files:
+
+            if journal:
+                journaled_files = journal.done(input_file)
+                if journaled_files is not None:
+                    logger.info(f'El fichero {input_file} ya se proceso en la ejecucion anterior, se salta')
+                    output_files.extend(journaled_files)
+                    continue
 
-        try:
-            # procesa el listado
-            output_file = process_report(
-                input_file, report, templates_folder,
-                output_formats[output_format], output_folder, time_stamp, keep_extension
-            )
-            output_files.append(output_file)
-        except ParseException as e:
-            logger.error(f'Ha ocurrido un error interpretando el archivo {conf_file}')
-            logger.error(f'Linea {e.lineno}, Columna {e.col}:\n"{e.line}"')
+            if output_cache:
+                in_file = input_path(input_file)
+                output_name = f'{in_file.stem}{in_file.suffix if keep_extension else ""}'
+                cached_files = output_cache.lookup(input_file, output_folder, output_name)
+                if cached_files is not None:
+                    logger.info(f'El fichero {input_file} no ha cambiado, se reutiliza su salida')
+                    output_files.extend(cached_files)
+                    if journal:
+                        journal.record(input_file, cached_files)
+                    continue
 
-        except Exception as e:
-            logger.error(f'Error inesperado mientras se procesaba el fichero {input_file}')
-            logger.error(f'Exception: {str(e)}')
-            raise e
+            try:
+                with metrics.measure(input_file) as measured:
+                    if router:
+                        report = route(input_file)
+                    measured.report = report
+
+                    if args.follow:
+                        # solo las líneas nuevas del listado
+                        generated_files = follow_report(
+                            input_file, report, output_folder, keep_extension, args.follow_batch_lines, profiler
+                        )
+                    else:
+                        # procesa el listado
+                        generated_files = process_report(
+                            input_file, report, templates_folder,
+                            output_formats[output_format], output_folder, time_stamp, keep_extension,
+                            evaluate_formulas, excel_tables, max_rows, split, args.source_column, args.partition_by,
+                            args.max_open_files, args.read_ahead, profiler
+                        )
+            except Exception as e:
+                logger.error(f'Error inesperado mientras se procesaba el fichero {input_file}')
+                logger.error(f'Exception: {str(e)}')
+                if journal:
+                    journal.record(input_file, error=str(e) or type(e).__name__)
+                if not args.keep_going:
+                    raise e
+                # el error solo afecta a este fichero, se sigue con los demás
+                failed_files.append(input_file)
+                continue
+
+            output_files.extend(generated_files)
+            if output_cache:
+                output_cache.store(input_file, output_name, generated_files)
+            if journal:
+                journal.record(input_file, generated_files)
+    finally:
+        if output_cache:
+            # el manifiesto se guarda también si algún fichero falla
+            output_cache.save()
+        if journal:
+            journal.close()
+
+    if failed_files:
+        raise BatchException(
+            f'No se han podido procesar {len(failed_files)} de {len(args.files)} ficheros: '
+            f'{", ".join(map(str, failed_files))}', output_files
+        )
 
     return output_files
 
 
+def max_rows_type(value):
+    # valida el número máximo de filas de cada hoja
+    max_rows = int(value)
+    if not 1 <= max_rows <= excel_max_rows:
+        raise argparse.ArgumentTypeError(f'debe estar entre 1 y {excel_max_rows}')
+    return max_rows
+
+
 def parse_args():
     # Gestor de los parámetros de la línea de comandos
     parser = argparse.ArgumentParser(description=f'Convierte un fichero de texto tabulado a formato XLSX, CSV, JSON, XML o HTML.')
@@ -768,13 +1961,31 @@ def parse_args():
     templates_folder = pathlib.Path.joinpath(current_folder, 'templates')
 
     # Parametros de la línea de comandos
-    parser.add_argument(
+    conf = parser.add_mutually_exclusive_group(required=True)
+
+    conf.add_argument(
         '-c',
         '--conf-file',
-        required=True,
         help='Fichero de configuracion para transformar el listado'
     )
 
+    conf.add_argument(
+        '-cd',
+        '--conf-folder',
+        type=pathlib.Path,
+        help='Carpeta con ficheros de configuracion (*.conf). '
+             'Cada fichero de entrada se procesa con la configuracion que mejor encaja con sus primeras lineas'
+    )
+
+    parser.add_argument(
+        '-sl',
+        '--sample-lines',
+        type=int,
+        default=default_sample_lines,
+        help=f'Numero de lineas de cada fichero que se usan para elegir su configuracion con --conf-folder. '
+             f'Por defecto: {default_sample_lines}'
+    )
+
     parser.add_argument(
         '-o',
         '--output-folder',
@@ -791,6 +2002,14 @@ def parse_args():
         help=f'Carpeta donde estan las plantillas para los formatos csv, json, xml y html. Por defecto: {templates_folder}'
     )
 
+    parser.add_argument(
+        '-cf',
+        '--cache-folder',
+        type=pathlib.Path,
+        help='Carpeta donde se guardan las definiciones de los informes ya procesadas. '
+             'Si se indica, solo se vuelve a interpretar el fichero de configuracion cuando cambia'
+    )
+
     parser.add_argument(
         '-t',
         '--time-stamp',
@@ -805,6 +2024,229 @@ def parse_args():
         help='Mantiene las extensiones de los ficheros de entradas en los nombres de los ficheros de salida generados'
     )
 
+    parser.add_argument(
+        '-e',
+        '--evaluate-formulas',
+        action='store_true',
+        help='Calcula el valor de las formulas (SUM, COUNTA, AVERAGE, MEDIAN, MIN, MAX y operaciones aritmeticas). '
+             'En xlsx se guarda como valor de la formula y en el resto de formatos sustituye a la formula'
+    )
+
+    parser.add_argument(
+        '-xt',
+        '--excel-tables',
+        action='store_true',
+        help='En formato xlsx, escribe las secciones con encabezado como tablas de Excel, '
+             'con columnas calculadas y fila de totales'
+    )
+
+    parser.add_argument(
+        '-mr',
+        '--max-rows',
+        type=max_rows_type,
+        default=excel_max_rows,
+        help=f'Numero maximo de filas de cada hoja en formato xlsx. Las secciones que no caben continuan en una '
+             f'nueva hoja o libro, repitiendo sus encabezados. Por defecto: {excel_max_rows}'
+    )
+
+    parser.add_argument(
+        '-sp',
+        '--split',
+        choices=split_modes,
+        default=default_split,
+        help=f'Si la salida xlsx supera --max-rows, continua en una nueva hoja (sheet) o en un nuevo libro (book). '
+             f'Por defecto: {default_split}'
+    )
+
+    parser.add_argument(
+        '-m',
+        '--merge',
+        metavar='OUTPUT_NAME',
+        help='Escribe todos los ficheros de entrada en un unico fichero de salida OUTPUT_NAME con la extension del '
+             'formato. En xlsx, una hoja por fichero de entrada'
+    )
+
+    parser.add_argument(
+        '-sc',
+        '--source-column',
+        action='store_true',
+        help='Anade al final de cada fila del cuerpo una columna con el nombre del fichero de entrada'
+    )
+
+    parser.add_argument(
+        '-pb',
+        '--partition-by',
+        metavar='FIELD_NAME',
+        help='Escribe las filas del cuerpo en un fichero csv por cada valor del campo FIELD_NAME. Solo con el '
+             'formato csv. Las formulas se escriben evaluadas y las que no se pueden evaluar se dejan vacias'
+    )
+
+    parser.add_argument(
+        '-mo',
+        '--max-open-files',
+        type=int,
+        default=default_max_open_files,
+        help=f'Numero maximo de ficheros abiertos a la vez con --partition-by. Por defecto: {default_max_open_files}'
+    )
+
+    parser.add_argument(
+        '-ra',
+        '--read-ahead',
+        action='store_true',
+        help='Lee (y descomprime) los ficheros de entrada en un hilo aparte mientras se procesan'
+    )
+
+    parser.add_argument(
+        '-so',
+        '--stdout',
+        action='store_true',
+        help='Escribe la salida en la salida estandar en lugar de en ficheros. Solo con los formatos csv, json, xml '
+             'y html'
+    )
+
+    parser.add_argument(
+        '-pr',
+        '--profile',
+        action='store_true',
+        help='Mide el tiempo de cada fase del proceso, los filtros y los fieldsets y muestra un resumen al terminar'
+    )
+
+    parser.add_argument(
+        '-pj',
+        '--profile-json',
+        metavar='JSON_FILE',
+        help='Como --profile, y ademas guarda las medidas en JSON_FILE en formato JSON'
+    )
+
+    parser.add_argument(
+        '-mf',
+        '--metrics-file',
+        action='append',
+        metavar='METRICS_FILE',
+        help='Guarda las metricas de la ejecucion en METRICS_FILE: en formato JSON si la extension es .json, si no '
+             'en el formato de ficheros de texto de Prometheus (.prom). Se puede indicar varias veces'
+    )
+
+    parser.add_argument(
+        '-oe',
+        '--on-error',
+        choices=on_error_actions,
+        default=default_on_error,
+        help='Que se hace con los valores que no se pueden convertir al tipo de su campo: fail detiene el proceso '
+             'del fichero, skip descarta la linea, empty deja la celda vacia y raw escribe el texto del listado. '
+             f'Por defecto: {default_on_error}'
+    )
+
+    parser.add_argument(
+        '-rj',
+        '--rejected-file',
+        type=pathlib.Path,
+        help='Registra en este fichero (JSON, un objeto por linea) las lineas con valores que no se pueden convertir: '
+             'fichero, numero de linea, seccion, fieldset, campos, motivo y texto de la linea'
+    )
+
+    parser.add_argument(
+        '-me',
+        '--max-errors',
+        type=int,
+        help='Numero maximo de lineas con valores que no se pueden convertir en cada fichero, si hay mas se detiene '
+             'su proceso. Por defecto no hay limite'
+    )
+
+    parser.add_argument(
+        '-jf',
+        '--journal',
+        type=pathlib.Path,
+        metavar='JOURNAL_FILE',
+        help='Diario del lote: por cada fichero terminado guarda sus ficheros de salida o su error, para poder '
+             'continuar el lote con --resume si se interrumpe'
+    )
+
+    parser.add_argument(
+        '-rs',
+        '--resume',
+        action='store_true',
+        help='Continua el lote del diario de --journal: salta los ficheros ya procesados sin error que no han '
+             'cambiado'
+    )
+
+    parser.add_argument(
+        '-kg',
+        '--keep-going',
+        action='store_true',
+        help='Si falla un fichero, registra el error y sigue con los demas. Al terminar sale con codigo 1 '
+             'si algun fichero ha fallado'
+    )
+
+    parser.add_argument(
+        '-oc',
+        '--output-cache',
+        type=pathlib.Path,
+        metavar='MANIFEST_FILE',
+        help='Manifiesto (JSON) de las salidas generadas. Los ficheros cuyo contenido, configuracion y opciones no '
+             'han cambiado no se vuelven a procesar: se reutiliza su salida o se copia la de otro fichero igual'
+    )
+
+    parser.add_argument(
+        '-fw',
+        '--follow',
+        action='store_true',
+        help='Modo seguimiento de listados que siguen creciendo: solo procesa las lineas anadidas desde la '
+             'ejecucion anterior y anade sus filas a la salida csv. El estado se guarda en <salida>.csv.checkpoint'
+    )
+
+    parser.add_argument(
+        '-fb',
+        '--follow-batch-lines',
+        type=int,
+        default=default_batch_lines,
+        help=f'Cada cuantas lineas se guarda el checkpoint del modo seguimiento. Por defecto: {default_batch_lines}'
+    )
+
+    parser.add_argument(
+        '-pg',
+        '--progress',
+        choices=progress_outputs,
+        help='Informa del avance de cada fichero: lineas y MB por segundo, filas y tiempo restante. '
+             'terminal: en la salida de error; log: como registros del log (en JSON con --log-json)'
+    )
+
+    parser.add_argument(
+        '-pi',
+        '--progress-interval',
+        type=float,
+        default=default_progress_interval,
+        help=f'Segundos entre dos informes de avance. Por defecto: {default_progress_interval}'
+    )
+
+    parser.add_argument(
+        '-ll',
+        '--log-level',
+        choices=LOG_LEVELS,
+        default='INFO',
+        help='Nivel del log. Con DEBUG se registra cada linea descartada. Por defecto: INFO'
+    )
+
+    parser.add_argument(
+        '-lf',
+        '--log-file',
+        help='Fichero de log, ademas de la salida de error. Se rota cada dia'
+    )
+
+    parser.add_argument(
+        '-lj',
+        '--log-json',
+        action='store_true',
+        help='Escribe el log en formato JSON, un objeto por linea'
+    )
+
+    parser.add_argument(
+        '-la',
+        '--log-async',
+        action='store_true',
+        help='Escribe el log en un hilo aparte, para que el proceso no espere a que se escriba'
+    )
+
     parser.add_argument(
         '-f',
         '--format',
@@ -817,19 +2259,87 @@ def parse_args():
     parser.add_argument(
         'files',
         nargs='+',
-        help='Fichero/s a procesar'
+        help=f'Fichero/s a procesar, {stdin_name} para la entrada estandar'
     )
 
     # procesa la línea de comandos
-    return parser.parse_args()    
+    args = parser.parse_args()
+    if args.partition_by and (args.format != output_formats.csv.name or args.merge):
+        parser.error('--partition-by solo se puede usar con el formato csv y sin --merge')
+    if (args.rejected_file or args.max_errors is not None) and args.on_error == 'fail':
+        parser.error('--rejected-file y --max-errors necesitan --on-error skip, empty o raw')
+    if args.max_errors is not None and args.max_errors < 0:
+        parser.error('--max-errors no puede ser negativo')
+    if args.resume and not args.journal:
+        parser.error('--resume necesita --journal')
+    if (args.journal or args.keep_going) and (args.merge or args.stdout):
+        parser.error('--journal y --keep-going no se pueden usar con --merge ni con --stdout')
+    if args.output_cache and (args.merge or args.stdout or args.follow or args.time_stamp or stdin_name in args.files):
+        parser.error('--output-cache no se puede usar con --merge, --stdout, --follow, --time-stamp '
+                     'ni con la entrada estandar (-)')
+    if args.follow:
+        if args.format != output_formats.csv.name:
+            parser.error('--follow solo se puede usar con el formato csv')
+        if args.merge or args.stdout or args.partition_by or args.time_stamp or args.evaluate_formulas or \
+                args.source_column:
+            parser.error('--follow no se puede usar con --merge, --stdout, --partition-by, --time-stamp, '
+                         '--evaluate-formulas ni --source-column')
+        if stdin_name in args.files:
+            parser.error('--follow no se puede usar con la entrada estandar (-)')
+        if args.follow_batch_lines < 1:
+            parser.error('--follow-batch-lines debe ser mayor que 0')
+    if args.progress_interval <= 0:
+        parser.error('--progress-interval debe ser mayor que 0')
+    if args.max_open_files < 1:
+        parser.error('--max-open-files debe ser mayor que 0')
+    if args.files.count(stdin_name) > 1 or (stdin_name in args.files and args.conf_folder):
+        parser.error('la entrada estandar (-) solo se puede leer una vez y necesita --conf-file')
+    if args.stdout:
+        if args.format not in (output_format.name for output_format in text_formats):
+            parser.error('--stdout solo se puede usar con los formatos csv, json, xml y html')
+        if args.merge or args.partition_by:
+            parser.error('--stdout no se puede usar con --merge ni con --partition-by')
+        if args.format != output_formats.csv.name and len(args.files) > 1:
+            parser.error('--stdout con los formatos json, xml y html solo admite un fichero de entrada')
+    return args    
 
 
 if __name__ == '__main__':
 
     cli_args = parse_args() 
 
-    generated_files = report_processor(cli_args)
+    configure_logging(cli_args.log_level, cli_args.log_file, cli_args.log_json, cli_args.log_async)
+
+    cli_profiler = Profiler() if cli_args.profile or cli_args.profile_json else null_profiler
+    cli_metrics = RunMetrics() if cli_args.metrics_file else null_metrics
+    cli_progress = Progress(cli_args.progress_interval, cli_args.progress) if cli_args.progress else None
+
+    cli_error_policy = ErrorPolicy(cli_args.on_error, cli_args.rejected_file, cli_args.max_errors) \
+        if cli_args.on_error != default_on_error else None
+
+    exit_code = 0
+    try:
+        generated_files = report_processor(cli_args, cli_profiler, cli_metrics, cli_progress, cli_error_policy)
+    except BatchException as e:
+        # con --keep-going los ficheros que no han fallado se han procesado
+        logger.error(str(e))
+        generated_files = e.output_files
+        exit_code = 1
+    finally:
+        if cli_error_policy:
+            cli_error_policy.close()
+        # las métricas se guardan también si algún fichero falla
+        for metrics_file in cli_args.metrics_file or []:
+            cli_metrics.write(metrics_file)
+
+    if cli_profiler is not null_profiler:
+        # el resumen va a la salida de error para no mezclarse con la salida de --stdout
+        cli_profiler.summary()
+        if cli_args.profile_json:
+            cli_profiler.dump(cli_args.profile_json)
     if generated_files:
         print('Se han creado los siguientes ficheros:')
         for _file in generated_files:
             print(_file)
+
+    sys.exit(exit_code)
@@ -0,0 +1,77 @@
+# política para las líneas con valores que no se pueden convertir al tipo de su campo
+# (opciones --on-error, --rejected-file y --max-errors)
+#
+# por defecto (fail) el primer valor que no se puede convertir detiene el proceso del fichero. Si no:
+#   skip: la línea se descarta
+#   empty: el valor se sustituye por una celda vacía
+#   raw: el valor se escribe como texto, tal como está en el listado
+# cada línea con errores se puede registrar en un fichero aparte (JSON, un objeto por línea) con el fichero,
+# el número de línea, la sección y el fieldset, los campos con error y el motivo, y el texto de la línea
+# para poder corregirla y volver a procesar solo esas líneas
+# con max_errors, el proceso de un fichero se detiene cuando tiene más líneas con errores
+
+import json
+
+from logger import get_logger
+
+
+logger = get_logger()
+
+# qué se hace con los valores que no se pueden convertir
+on_error_actions = ('fail', 'skip', 'empty', 'raw')
+
+default_on_error = 'fail'
+
+
+class RejectedLine(ValueError):
+    # la línea tiene valores que no se pueden convertir y se descarta (on_error skip)
+    pass
+
+
+class TooManyErrors(Exception):
+    pass
+
+
+class ErrorPolicy:
+    # Qué se hace con los valores que no se pueden convertir y dónde se registran las líneas con errores
+
+    def __init__(self, on_error=default_on_error, rejected_file=None, max_errors=None):
+        self.on_error = on_error
+        self.max_errors = max_errors
+        self.rejected_file = rejected_file
+        self._rejected = open(rejected_file, 'w', encoding='utf-8') if rejected_file else None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def close(self):
+        if self._rejected:
+            self._rejected.close()
+            self._rejected = None
+
+    def reject(self, report_file, number_line, section_index, fieldset_index, line, errors, failures):
+        # registra una línea con errores, errors son los campos que no se han podido convertir: (campo, valor, motivo)
+        # failures es el número de líneas con errores del fichero, incluida esta
+        if self._rejected:
+            entry = {
+                'file': str(report_file),
+                'line': number_line,
+                'section': section_index,
+                'fieldset': fieldset_index,
+                'action': self.on_error,
+                'errors': [
+                    {'field': field.name, 'index': field.index, 'value': value, 'reason': reason}
+                    for field, value, reason in errors
+                ],
+                'text': line.rstrip('\r\n'),
+            }
+            self._rejected.write(json.dumps(entry, ensure_ascii=False) + '\n')
+        logger.warning(f'{report_file}:{number_line}: {errors[0][2]}')
+
+        if self.max_errors is not None and failures > self.max_errors:
+            raise TooManyErrors(
+                f'El fichero {report_file} tiene mas de {self.max_errors} lineas con valores que no se pueden convertir'
+            )
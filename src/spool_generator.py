@@ -0,0 +1,396 @@
+# genera listados sintéticos de cualquier tamaño a partir de un fichero de configuración
+#
+# las líneas del cuerpo de cada fieldset con filtros de inclusión se construyen así:
+# - una muestra de texto que concuerda con uno de sus filtros (ver regex_sample)
+# - encima, en la posición de cada campo extraído, un valor válido para su tipo: palabras para los campos de
+#   texto, números con los separadores de millar y decimales de cada tipo numérico y fechas con su formato
+# y solo se aceptan si el informe las procesaría con ese fieldset: no las descarta ningún filtro de exclusión,
+# concuerdan con ese fieldset (y no con uno anterior) y sus campos se pueden convertir a su tipo
+# además se pueden añadir líneas de ruido (que no concuerdan con ningún filtro) y líneas que descartan los
+# filtros de exclusión
+#
+# construir y comprobar cada línea es mucho más lento que procesarla, así que para generar listados grandes
+# se construye una reserva de líneas distintas de cada tipo y el listado se forma eligiendo líneas de ellas
+
+import argparse
+import bz2
+import csv
+import gzip
+import io
+import lzma
+import pathlib
+import random
+import sys
+
+from datetime import datetime, timedelta
+
+from commons import numeric_fields, date_fields, numeric_types_info, minus
+from redaxtor import Report, ReportRouter
+
+try:
+    from re import _parser as sre_parse, _constants as sre_constants  # python 3.11+
+except ImportError:
+    import sre_parse
+    import sre_constants
+
+
+# número de líneas distintas que se construyen de cada fieldset y de ruido y de líneas excluidas
+default_pool_size = 10000
+
+# número medio de líneas del cuerpo seguidas de cada sección
+default_section_lines = 50
+
+# intentos de construir una línea válida antes de dar por imposible un fieldset
+max_attempts = 200
+
+# repeticiones como mucho de los cuantificadores sin límite (*, +, {n,}) en las muestras de los filtros
+max_extra_repeat = 3
+
+# caracteres con los que se generan las muestras de los filtros
+alphabet = ''.join(chr(code) for code in range(32, 127))
+
+words = (
+    'alpha', 'bravo', 'charlie', 'delta', 'echo', 'foxtrot', 'golf', 'hotel', 'india', 'juliet', 'kilo', 'lima',
+    'mike', 'november', 'oscar', 'papa', 'quebec', 'romeo', 'sierra', 'tango', 'uniform', 'victor', 'whiskey',
+    'xray', 'yankee', 'zulu'
+)
+
+# nombre de la salida estándar como fichero de salida
+stdout_name = '-'
+
+# ficheros de salida comprimidos según su extensión
+compressed_writers = {'.gz': gzip.open, '.bz2': bz2.open, '.xz': lzma.open}
+
+# separadores de millar y decimal de los tipos numéricos
+separators = {
+    numeric_type: (type_info.thousands_separator, type_info.decimal_separator)
+    for numeric_type, type_info in numeric_types_info.items()
+}
+
+first_date = datetime(2000, 1, 1)
+date_range_seconds = 30 * 365 * 86400
+
+category_chars = {
+    sre_constants.CATEGORY_DIGIT: '0123456789',
+    sre_constants.CATEGORY_SPACE: ' ',
+    sre_constants.CATEGORY_WORD: 'abcdefghijklmnopqrstuvwxyzABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789_',
+}
+category_chars[sre_constants.CATEGORY_NOT_DIGIT] = ''.join(c for c in alphabet if not c.isdigit())
+category_chars[sre_constants.CATEGORY_NOT_SPACE] = alphabet[1:]
+category_chars[sre_constants.CATEGORY_NOT_WORD] = ''.join(
+    c for c in alphabet if c not in category_chars[sre_constants.CATEGORY_WORD]
+)
+
+
+class GeneratorException(Exception):
+    pass
+
+
+def _set_chars(items):
+    # caracteres de un conjunto [...] de una expresión regular
+    chars = set()
+    negate = False
+    for op, value in items:
+        if op == sre_constants.NEGATE:
+            negate = True
+        elif op == sre_constants.LITERAL:
+            chars.add(chr(value))
+        elif op == sre_constants.RANGE:
+            low, high = value
+            chars.update(chr(code) for code in range(low, min(high, low + 255) + 1))
+        elif op == sre_constants.CATEGORY:
+            chars.update(category_chars.get(value, ''))
+    if negate:
+        chars = set(alphabet) - chars
+    return sorted(chars)
+
+
+def _sample(parsed, rnd, groups):
+    # texto que concuerda con la expresión regular ya analizada
+    result = []
+    for op, value in parsed:
+        if op == sre_constants.LITERAL:
+            result.append(chr(value))
+        elif op == sre_constants.NOT_LITERAL:
+            result.append(rnd.choice([c for c in alphabet if c != chr(value)]))
+        elif op == sre_constants.ANY:
+            result.append(rnd.choice(alphabet))
+        elif op == sre_constants.IN:
+            result.append(rnd.choice(_set_chars(value) or [' ']))
+        elif op in (sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT,
+                    getattr(sre_constants, 'POSSESSIVE_REPEAT', None)):
+            low, high, item = value
+            high = min(high, low + max_extra_repeat)
+            result.extend(_sample(item, rnd, groups) for _ in range(rnd.randint(low, high)))
+        elif op == sre_constants.SUBPATTERN:
+            group, _, _, item = value
+            text = _sample(item, rnd, groups)
+            if group:
+                groups[group] = text
+            result.append(text)
+        elif op == getattr(sre_constants, 'ATOMIC_GROUP', None):
+            result.append(_sample(value, rnd, groups))
+        elif op == sre_constants.BRANCH:
+            result.append(_sample(rnd.choice(value[1]), rnd, groups))
+        elif op == sre_constants.GROUPREF:
+            result.append(groups.get(value, ''))
+        elif op == sre_constants.CATEGORY:
+            result.append(rnd.choice(category_chars.get(value, ' ')))
+        # las anclas (^, $, \b) y las aserciones no generan texto
+    return ''.join(result)
+
+
+def regex_sample(pattern, rnd):
+    # texto que concuerda (o casi siempre concuerda, las aserciones no se tienen en cuenta) con la expresión
+    # regular pattern desde su inicio, como la usa match
+    return _sample(sre_parse.parse(pattern), rnd, {})
+
+
+def format_number(number, thousands_separator):
+    # entero con el separador de millar indicado (sin separador si es '')
+    text = f'{abs(number):,}'.replace(',', thousands_separator or '')
+    return f'{minus}{text}' if number < 0 else text
+
+
+class SpoolGenerator:
+    # Genera las líneas de un listado sintético que procesa la definición de informe report
+
+    def __init__(self, report, seed=None, pool_size=default_pool_size):
+        self.report = report
+        self.random = random.Random(seed)
+        self.pool_size = pool_size
+
+        # fieldsets del cuerpo que procesan líneas, agrupados por sección
+        self.sections = []
+        for section in report.sections:
+            fieldsets = [fieldset for fieldset in section.body if fieldset.include_filters]
+            if fieldsets:
+                self.sections.append(fieldsets)
+        if not self.sections:
+            raise GeneratorException(
+                f'La definicion {report.conf_file} no tiene ningun fieldset con filtros de inclusion'
+            )
+
+        self._pools = {}
+
+    # valores de los campos
+
+    def _words(self, width):
+        # palabras separadas por espacios que caben en width caracteres
+        text = self.random.choice(words)
+        while self.random.random() < 0.5:
+            word = self.random.choice(words)
+            if len(text) + len(word) + 1 > width:
+                break
+            text = f'{text} {word}'
+        return text[:width]
+
+    def _number(self, field_type, width):
+        # número válido para el tipo numérico con como mucho width caracteres
+        thousands_separator, decimal_separator = separators[field_type]
+        decimals = 2 if decimal_separator else 0
+        for _ in range(max_attempts):
+            digits = self.random.randint(1, max(1, min(12, width - decimals - (1 if decimals else 0))))
+            number = self.random.randint(0, 10 ** digits - 1)
+            if self.random.random() < 0.1:
+                number = -number
+            text = format_number(number, thousands_separator)
+            if decimals:
+                text = f'{text}{decimal_separator}{self.random.randint(0, 99):02d}'
+            if len(text) <= width:
+                return text
+        raise GeneratorException(f'No cabe ningun numero de tipo {field_type.name} en {width} caracteres')
+
+    def _date(self, field):
+        value = first_date + timedelta(seconds=self.random.randrange(date_range_seconds))
+        return value.strftime(field.format)
+
+    def field_value(self, field, width):
+        # valor del campo en el listado
+        if field.type in numeric_fields:
+            return self._number(field.type, width)
+        if field.type in date_fields:
+            return self._date(field)
+        return self._words(width)
+
+    # líneas
+
+    def _fixed_line(self, fieldset, include_filter):
+        # línea de longitud fija: muestra del filtro y valores de los campos en sus posiciones
+        # los campos de texto se escriben antes que el resto, que se escriben encima si comparten posición
+        fields = sorted(
+            (field for field in fieldset.fields if field.is_extracted),
+            key=lambda field: field.type in numeric_fields or field.type in date_fields
+        )
+        sample = regex_sample(include_filter.pattern, self.random)
+        width = max([len(sample)] + [field.right for field in fields])
+        line = list(sample.ljust(width))
+        for field in fields:
+            value = self.field_value(field, field.right - field.left)
+            if field.type in numeric_fields:
+                # los números se alinean a la derecha o a la izquierda y ocupan todo el campo, por si comparten
+                # posición con un campo de texto
+                width = field.right - field.left
+                value = value.rjust(width) if self.random.random() < 0.5 else value.ljust(width)
+            line[field.left:field.left + len(value)] = value
+        if self.random.random() < 0.5:
+            # la muestra del filtro por encima de los campos, si los campos la han estropeado
+            line[:len(sample)] = sample
+        return self._fit(''.join(line).rstrip())
+
+    def _fit(self, line):
+        # si el listado es de registros de longitud fija, la línea ocupa exactamente un registro
+        record_length = self.report.record_length
+        return line.ljust(record_length)[:record_length] if record_length else line
+
+    def _delimited_line(self, fieldset, include_filter):
+        # línea delimitada: columnas de la muestra del filtro con los valores de los campos en sus columnas
+        delimiter = self.report.delimiter
+        columns = regex_sample(include_filter.pattern, self.random).split(delimiter)
+        fields = [field for field in fieldset.fields if field.by_column]
+        needed = max([field.column + 1 for field in fields] + [len(columns)])
+        columns.extend(self._words(10) for _ in range(needed - len(columns)))
+        for field in fields:
+            columns[field.column] = self.field_value(field, 20)
+        if self.report.quoted:
+            output = io.StringIO()
+            csv.writer(output, delimiter=delimiter, lineterminator='').writerow(columns)
+            return output.getvalue()
+        return delimiter.join(columns)
+
+    def _accepted(self, line, fieldset):
+        # el informe procesaría la línea con el fieldset
+        report = self.report
+        if report._exclude_line(line):
+            return False
+        _, _, matched_fieldset = report._match_include_filters(line)
+        return matched_fieldset is fieldset and ReportRouter._converts(report, fieldset, line)
+
+    def body_line(self, fieldset):
+        for _ in range(max_attempts):
+            include_filter = self.random.choice(fieldset.include_filters)
+            if self.report.delimiter:
+                line = self._delimited_line(fieldset, include_filter)
+            else:
+                line = self._fixed_line(fieldset, include_filter)
+            if self._accepted(line, fieldset):
+                return line
+        patterns = ', '.join(f'"{include_filter.pattern}"' for include_filter in fieldset.include_filters)
+        raise GeneratorException(f'No se ha podido generar ninguna linea valida para el fieldset {patterns}')
+
+    def noise_line(self):
+        # línea que no procesa el informe: no concuerda con ningún filtro (None si no es posible)
+        report = self.report
+        for _ in range(max_attempts):
+            line = ' '.join(self._words(12) for _ in range(self.random.randint(1, 6)))
+            if self.random.random() < 0.3:
+                line = self.random.choice(('-', '=', '*', ' ')) * self.random.randint(1, 80)
+            line = self._fit(line)
+            if not report._exclude_line(line) and report._match_include_filters(line)[0] is None:
+                return line
+        return None
+
+    def excluded_line(self):
+        # línea que descarta algún filtro de exclusión (None si no hay filtros de exclusión)
+        for _ in range(max_attempts):
+            if not self.report.exclude_filters:
+                return None
+            line = self._fit(regex_sample(self.random.choice(self.report.exclude_filters).pattern, self.random))
+            if self.report._exclude_line(line):
+                return line
+        return None
+
+    def _pool(self, key, build):
+        # reserva de líneas distintas de un tipo, se construye la primera vez que se necesita
+        pool = self._pools.get(key)
+        if pool is None:
+            pool = []
+            for _ in range(self.pool_size):
+                line = build()
+                if line is None:
+                    break
+                pool.append(line)
+            self._pools[key] = pool
+        return pool
+
+    def lines(self, count, noise=0.0, excluded=0.0, section_lines=default_section_lines):
+        # genera count líneas: noise y excluded son las proporciones de líneas de ruido y excluidas
+        # las líneas del cuerpo de cada sección aparecen seguidas, section_lines de media
+        rnd = self.random
+        noise_pool = self._pool('noise', self.noise_line) if noise else []
+        excluded_pool = self._pool('excluded', self.excluded_line) if excluded else []
+        section = None
+        remaining = 0
+        for _ in range(count):
+            dice = rnd.random()
+            if dice < noise and noise_pool:
+                yield rnd.choice(noise_pool)
+            elif dice < noise + excluded and excluded_pool:
+                yield rnd.choice(excluded_pool)
+            else:
+                if remaining <= 0:
+                    # cambio de sección
+                    candidates = [s for s in self.sections if s is not section] or self.sections
+                    section = rnd.choice(candidates)
+                    remaining = rnd.randint(1, 2 * section_lines)
+                remaining -= 1
+                fieldset = rnd.choice(section)
+                yield rnd.choice(self._pool(id(fieldset), lambda: self.body_line(fieldset)))
+
+    def write(self, output_file, count, **kwargs):
+        # escribe el listado con la codificación del informe, output_file puede ser - (la salida estándar)
+        # con extensión .gz, .bz2 o .xz se comprime
+        report = self.report
+        terminator = '' if report.record_length else '\n'
+        if output_file == stdout_name:
+            fout = open(sys.stdout.fileno(), 'w', encoding=report.encoding, newline='', closefd=False)
+        else:
+            output_file = pathlib.Path(output_file)
+            opener = compressed_writers.get(output_file.suffix.lower())
+            if opener:
+                fout = opener(output_file, 'wt', encoding=report.encoding, newline='')
+            else:
+                fout = open(output_file, 'w', encoding=report.encoding, newline='')
+        with fout:
+            batch = []
+            for line in self.lines(count, **kwargs):
+                batch.append(line + terminator)
+                if len(batch) >= 10000:
+                    fout.writelines(batch)
+                    batch = []
+            fout.writelines(batch)
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(
+        description='Genera un listado sintetico que procesa el fichero de configuracion indicado'
+    )
+    parser.add_argument('-c', '--conf-file', required=True, help='Fichero de configuracion')
+    parser.add_argument('-n', '--lines', type=int, default=1000, help='Numero de lineas del listado')
+    parser.add_argument(
+        '-o', '--output', default=stdout_name,
+        help='Fichero de salida, con extension .gz, .bz2 o .xz se comprime. Por defecto la salida estandar'
+    )
+    parser.add_argument('-s', '--seed', type=int, default=None, help='Semilla para generar el mismo listado')
+    parser.add_argument('-nr', '--noise', type=float, default=0.0, help='Proporcion de lineas de ruido (0-1)')
+    parser.add_argument('-er', '--excluded', type=float, default=0.0, help='Proporcion de lineas excluidas (0-1)')
+    parser.add_argument(
+        '-sl', '--section-lines', type=int, default=default_section_lines,
+        help='Numero medio de lineas seguidas de cada seccion'
+    )
+    parser.add_argument(
+        '-ps', '--pool-size', type=int, default=default_pool_size,
+        help='Numero de lineas distintas que se generan de cada tipo'
+    )
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    cli_args = parse_args()
+
+    generator = SpoolGenerator(Report(cli_args.conf_file), cli_args.seed, cli_args.pool_size)
+    generator.write(
+        cli_args.output, cli_args.lines,
+        noise=cli_args.noise, excluded=cli_args.excluded, section_lines=cli_args.section_lines
+    )
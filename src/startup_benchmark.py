@@ -0,0 +1,112 @@
+# mide el coste del arranque de redaxtor.py
+#
+# cada medida se toma en un proceso nuevo para que los módulos no estén ya importados
+# - informe de python -X importtime: tiempo total de import redaxtor y los módulos más costosos
+# - tiempo de import redaxtor, de cargar la configuración (interpretándola y desde la caché)
+#   y de importar los backends de salida (xlsxwriter y jinja2)
+
+import argparse
+import json
+import pathlib
+import re
+import statistics
+import subprocess
+import sys
+import tempfile
+
+
+# carpeta donde están los módulos de redaxtor
+src_folder = pathlib.Path(__file__).parent.absolute()
+
+# línea del informe de -X importtime: "import time: self [us] | cumulative | imported package"
+importtime_regexp = re.compile(r'import time:\s*(?P<self>\d+) \|\s*(?P<cumulative>\d+) \| (?P<name>.*)$')
+
+# programa que se ejecuta en el proceso hijo para medir los tiempos de cada fase del arranque
+timing_program = '''
+import json, sys, time
+
+conf_file, cache_folder = sys.argv[1], sys.argv[2]
+times = {}
+
+start = time.perf_counter()
+from redaxtor import Report
+times['import redaxtor'] = time.perf_counter() - start
+
+start = time.perf_counter()
+Report(conf_file, cache_folder) if cache_folder else Report(conf_file)
+times['cached config' if cache_folder else 'parse config'] = time.perf_counter() - start
+
+start = time.perf_counter()
+import xlsxwriter
+times['import xlsxwriter'] = time.perf_counter() - start
+
+start = time.perf_counter()
+import jinja2
+times['import jinja2'] = time.perf_counter() - start
+
+print(json.dumps(times))
+'''
+
+
+# ejecuta un programa python en un proceso nuevo dentro de la carpeta de redaxtor
+def run_python(*args):
+    return subprocess.run(
+        [sys.executable, *args], cwd=src_folder, capture_output=True, text=True, check=True
+    )
+
+
+# devuelve los módulos importados al importar redaxtor con sus tiempos (self, cumulative) en microsegundos
+def import_times():
+    result = run_python('-X', 'importtime', '-c', 'import redaxtor')
+    modules = []
+    for line in result.stderr.splitlines():
+        if match := importtime_regexp.match(line):
+            modules.append((match.group('name'), int(match.group('self')), int(match.group('cumulative'))))
+    return modules
+
+
+# mide las fases del arranque, si se indica una carpeta de caché la configuración se carga desde ella
+def startup_times(conf_file, cache_folder=''):
+    result = run_python('-c', timing_program, str(conf_file), str(cache_folder))
+    return json.loads(result.stdout.splitlines()[-1])
+
+
+def print_times(label, samples):
+    # muestra la mediana y el mínimo de cada fase
+    print(f'\n{label}')
+    for phase in samples[0]:
+        values = [sample[phase] * 1000 for sample in samples]
+        print(f'  {phase:<20} median {statistics.median(values):8.1f} ms   min {min(values):8.1f} ms')
+
+
+def startup_benchmark(conf_file, repeat=5, top=15):
+
+    modules = import_times()
+    # la última línea es el propio módulo redaxtor, su tiempo acumulado es el total
+    _, _, total = modules[-1]
+    print(f'python -X importtime -c "import redaxtor": {total / 1000:.1f} ms')
+    print(f'\nLos {top} modulos mas costosos (tiempo propio):')
+    for name, self_time, cumulative in sorted(modules, key=lambda module: module[1], reverse=True)[:top]:
+        print(f'  {name.strip():<40} self {self_time / 1000:8.1f} ms   cumulative {cumulative / 1000:8.1f} ms')
+
+    print_times('Interpretando la configuracion:', [startup_times(conf_file) for _ in range(repeat)])
+
+    with tempfile.TemporaryDirectory() as cache_folder:
+        # la primera ejecución llena la caché
+        startup_times(conf_file, cache_folder)
+        print_times('Configuracion desde la cache:', [startup_times(conf_file, cache_folder) for _ in range(repeat)])
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Mide el tiempo de arranque de redaxtor.py')
+    parser.add_argument('-c', '--conf-file', required=True, type=pathlib.Path, help='Fichero de configuracion')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Numero de repeticiones de cada medida')
+    parser.add_argument('-n', '--top', type=int, default=15, help='Numero de modulos a mostrar')
+    return parser.parse_args()
+
+
+if __name__ == '__main__':
+
+    cli_args = parse_args()
+
+    startup_benchmark(cli_args.conf_file.absolute(), cli_args.repeat, cli_args.top)
@@ -1,7 +1,8 @@
 # parser para los estilos
 
-import pyparsing as pp
+import functools
 from enum import Enum
+from types import SimpleNamespace
 
 from logger import get_logger
 from commons import store_false, store_true, store_int, store_dict_value, print_item, parse_args
@@ -62,89 +63,108 @@ valign_options = {
 }
 
 # reglas de la gramática
+# la gramática se construye la primera vez que se necesita y no al importar el módulo
+# así no se paga su coste cuando la definición del informe se carga desde la caché
+@functools.cache
+def grammar():
 
-text = pp.dbl_quoted_string.copy().set_parse_action(pp.remove_quotes)
+    import pyparsing as pp
 
-# nombre/identificador del estilo
-# style_id = pp.Word(pp.alphas, pp.alphanums)
-style_id = pp.pyparsing_common.identifier
+    text = pp.dbl_quoted_string.copy().set_parse_action(pp.remove_quotes)
 
-integer = pp.Word(pp.nums)
+    # nombre/identificador del estilo
+    # style_id = pp.Word(pp.alphas, pp.alphanums)
+    style_id = pp.pyparsing_common.identifier
 
-# expresión de formato numérico de celdas en excel
-# más información: https://xlsxwriter.readthedocs.org/format.html#set_num_format
-number_format = pp.CaselessLiteral('format').suppress() + text.set_results_name('num_format')
+    integer = pp.Word(pp.nums)
 
-font_name = pp.CaselessLiteral('font').suppress() + text.set_results_name('font_name')
- 
-font_size = pp.CaselessLiteral('size').suppress() + \
-            integer.copy().set_parse_action(store_int).set_results_name('font_size')
+    # expresión de formato numérico de celdas en excel
+    # más información: https://xlsxwriter.readthedocs.org/format.html#set_num_format
+    number_format = pp.CaselessLiteral('format').suppress() + text.set_results_name('num_format')
 
-font_bold = pp.CaselessLiteral('bold').set_parse_action(store_true).set_results_name('bold')
+    font_name = pp.CaselessLiteral('font').suppress() + text.set_results_name('font_name')
 
-font_italic = pp.CaselessLiteral('italic').set_parse_action(store_true).set_results_name('italic')
+    font_size = pp.CaselessLiteral('size').suppress() + \
+                integer.copy().set_parse_action(store_int).set_results_name('font_size')
 
-font_underline = pp.CaselessLiteral('underline').set_parse_action(store_true).set_results_name('underline')
+    font_bold = pp.CaselessLiteral('bold').set_parse_action(store_true).set_results_name('bold')
 
-font_outline = pp.CaselessLiteral('strikeout').set_parse_action(store_true).set_results_name('font_strikeout')
+    font_italic = pp.CaselessLiteral('italic').set_parse_action(store_true).set_results_name('italic')
 
-horizontal_align = pp.CaselessLiteral('align').suppress() + \
-                   pp.one_of('left center right justify').set_results_name('align')
+    font_underline = pp.CaselessLiteral('underline').set_parse_action(store_true).set_results_name('underline')
 
-vertical_align = pp.CaselessLiteral('valign').suppress() + \
-    pp.one_of(list(valign_options.keys())).set_parse_action(store_dict_value(valign_options)).set_results_name('valign')
+    font_outline = pp.CaselessLiteral('strikeout').set_parse_action(store_true).set_results_name('font_strikeout')
 
-# color en formato hexadecimal RRGGBB (ejemplo AABB11)
-# no incluyo # porque el parser lo interpreta como un comentario dentro del archivo de la gramática, lo añado más tarde
-# prefijamos el código del color con #
-color_code = pp.Word(pp.srange('[a-fA-F0-9]'), exact=6).set_parse_action(lambda tokens: '#' + tokens[0])
+    horizontal_align = pp.CaselessLiteral('align').suppress() + \
+                       pp.one_of('left center right justify').set_results_name('align')
 
-color_name = pp.one_of('black blue brown cyan gray green lime magent navy orange pink purple red silver white yellow')
+    vertical_align = pp.CaselessLiteral('valign').suppress() + \
+        pp.one_of(list(valign_options.keys())).set_parse_action(store_dict_value(valign_options)).set_results_name('valign')
 
-color_id = (color_name | color_code).set_results_name('color_id')
+    # color en formato hexadecimal RRGGBB (ejemplo AABB11)
+    # no incluyo # porque el parser lo interpreta como un comentario dentro del archivo de la gramática, lo añado más tarde
+    # prefijamos el código del color con #
+    color_code = pp.Word(pp.srange('[a-fA-F0-9]'), exact=6).set_parse_action(lambda tokens: '#' + tokens[0])
 
-border_line = pp.one_of(border_names).set_parse_action(store_dict_value(Border))
+    color_name = pp.one_of('black blue brown cyan gray green lime magent navy orange pink purple red silver white yellow')
 
-background_color = pp.CaselessLiteral('background').suppress() + color_id.set_results_name('bg_color')
+    color_id = (color_name | color_code).set_results_name('color_id')
 
-foreground_color = pp.CaselessLiteral('color').suppress() + color_id.set_results_name('font_color')
+    border_line = pp.one_of(border_names).set_parse_action(store_dict_value(Border))
 
-# El color del borde es opcional
-borderStyle = pp.CaselessLiteral('border').suppress() + \
-    (pp.Opt(color_id.set_results_name('border_color')) & border_line.set_results_name('border'))
- 
-unlocked_cell = pp.CaselessLiteral('unlocked').set_parse_action(store_false).set_results_name('locked')
+    background_color = pp.CaselessLiteral('background').suppress() + color_id.set_results_name('bg_color')
 
-hidden_cell = pp.CaselessLiteral('hidden').set_parse_action(store_true).set_results_name('hidden')
+    foreground_color = pp.CaselessLiteral('color').suppress() + color_id.set_results_name('font_color')
 
-wrap_text = pp.CaselessLiteral('wrap').set_parse_action(store_true).set_results_name('text_wrap')
+    # El color del borde es opcional
+    borderStyle = pp.CaselessLiteral('border').suppress() + \
+        (pp.Opt(color_id.set_results_name('border_color')) & border_line.set_results_name('border'))
 
-shrink_ext = pp.CaselessLiteral('shrink').set_parse_action(store_true).set_results_name('shrink')
+    unlocked_cell = pp.CaselessLiteral('unlocked').set_parse_action(store_false).set_results_name('locked')
 
-style_options =                  \
-    pp.Opt(number_format) &      \
-    pp.Opt(font_name) &          \
-    pp.Opt(font_size) &          \
-    pp.Opt(font_bold) &          \
-    pp.Opt(font_italic) &        \
-    pp.Opt(font_underline) &     \
-    pp.Opt(font_outline) &       \
-    pp.Opt(horizontal_align) &   \
-    pp.Opt(vertical_align) &     \
-    pp.Opt(borderStyle) &        \
-    pp.Opt(background_color) &   \
-    pp.Opt(foreground_color) &   \
-    pp.Opt(unlocked_cell) &      \
-    pp.Opt(hidden_cell) &        \
-    pp.Opt(wrap_text) &          \
-    pp.Opt(shrink_ext)
+    hidden_cell = pp.CaselessLiteral('hidden').set_parse_action(store_true).set_results_name('hidden')
 
-cell_style = pp.CaselessLiteral('style').suppress() + style_id.set_results_name('style_id') + style_options
+    wrap_text = pp.CaselessLiteral('wrap').set_parse_action(store_true).set_results_name('text_wrap')
 
-styles_grammar = pp.OneOrMore(pp.Group(cell_style)).set_results_name('styles')
+    shrink_ext = pp.CaselessLiteral('shrink').set_parse_action(store_true).set_results_name('shrink')
 
-# los comentarios estilo python están permitidos pero son ignorados
-styles_grammar.ignore(pp.python_style_comment)
+    style_options =                  \
+        pp.Opt(number_format) &      \
+        pp.Opt(font_name) &          \
+        pp.Opt(font_size) &          \
+        pp.Opt(font_bold) &          \
+        pp.Opt(font_italic) &        \
+        pp.Opt(font_underline) &     \
+        pp.Opt(font_outline) &       \
+        pp.Opt(horizontal_align) &   \
+        pp.Opt(vertical_align) &     \
+        pp.Opt(borderStyle) &        \
+        pp.Opt(background_color) &   \
+        pp.Opt(foreground_color) &   \
+        pp.Opt(unlocked_cell) &      \
+        pp.Opt(hidden_cell) &        \
+        pp.Opt(wrap_text) &          \
+        pp.Opt(shrink_ext)
+
+    cell_style = pp.CaselessLiteral('style').suppress() + style_id.set_results_name('style_id') + style_options
+
+    styles_grammar = pp.OneOrMore(pp.Group(cell_style)).set_results_name('styles')
+
+    # los comentarios estilo python están permitidos pero son ignorados
+    styles_grammar.ignore(pp.python_style_comment)
+
+    return SimpleNamespace(text=text, style_id=style_id, integer=integer, styles_grammar=styles_grammar)
+
+
+# permite seguir importando los elementos de la gramática como atributos del módulo (styles_grammar, text,...)
+# solo se construye la gramática cuando se pide uno de sus elementos
+grammar_names = ('text', 'style_id', 'integer', 'styles_grammar')
+
+
+def __getattr__(name):
+    if name in grammar_names:
+        return getattr(grammar(), name)
+    raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
 
 
 # Pretty printer para los estilos
@@ -159,6 +179,8 @@ def print_style(style, align_level=0):
 
 if __name__ == '__main__':
 
+    from pyparsing import ParseException
+
     # Inicia el sistema de log
     logger = get_logger()
 
@@ -168,14 +190,14 @@ if __name__ == '__main__':
     try:
 
         with open(args.file) as styles:
-            result = styles_grammar.parse_file(styles)
+            result = grammar().styles_grammar.parse_file(styles)
 
         for current_style in result.styles:
             a_style = Style(current_style)
             # print_style(a_style)
             print(a_style)
 
-    except pp.ParseException as e:
+    except ParseException as e:
         logger.error(f'Ha ocurrido un error interpretando el archivo {args.styles_file}')
         logger.error(f'Linea {e.lineno}, Columna {e.col}:\n"{e.line}"')
     
@@ -0,0 +1,42 @@
+# hoja de cálculo de xlsxwriter adaptada a las fórmulas de los listados
+#
+# xlsxwriter prepara cada fórmula aplicando unas treinta sustituciones (una por cada función de Excel que
+# necesita el prefijo _xlfn.), aunque la fórmula no llame a ninguna función
+# las fórmulas de los campos del cuerpo suelen ser operaciones entre celdas de la fila (=G5*(1-(F5/100))),
+# así que esas sustituciones son la mayor parte del coste de escribir una celda con fórmula
+# si la fórmula no contiene ninguna llamada a una función, el resultado es la misma fórmula sin el =
+#
+# Worksheet._prepare_formula es un método interno de xlsxwriter que puede cambiar en cualquier versión, por eso
+# el atajo solo se usa con las versiones con las que se ha comprobado (checked_versions): con otra versión se usa
+# siempre el método de xlsxwriter. Para añadir una versión hay que comprobar antes con equivalence.py que el atajo
+# da el mismo resultado que xlsxwriter con las fórmulas de los ejemplos (ver equivalence.formula_differences)
+
+import re
+
+from xlsxwriter import __version__ as xlsxwriter_version
+from xlsxwriter.worksheet import Worksheet as BaseWorksheet
+
+
+# versiones de xlsxwriter con las que se ha comprobado el atajo
+checked_versions = ('3.2.9',)
+simple_formulas = xlsxwriter_version in checked_versions
+
+# un nombre seguido de un paréntesis: la fórmula llama a alguna función
+function_call_regexp = re.compile(r'[\w.]\(')
+
+
+def simple_formula(formula):
+    # la fórmula preparada para xlsxwriter si no llama a ninguna función, si no None
+    if formula.startswith('=') and not formula.endswith('}') and not function_call_regexp.search(formula):
+        return formula[1:]
+    return None
+
+
+class Worksheet(BaseWorksheet):
+
+    def _prepare_formula(self, formula, expand_future_functions=False):
+        if simple_formulas:
+            prepared = simple_formula(formula)
+            if prepared is not None:
+                return prepared
+        return super()._prepare_formula(formula, expand_future_functions)